@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""Benchmarks the annotation of every frame against keyframes and tracking.
+
+By default, synthetic videos of a moving face are annotated by a fake detector
+that knows the true eye positions and takes ``--detector-cost`` seconds per
+frame, which is about the time MTCNN takes on one CPU core. Real videos are
+annotated with the annotator of ``config_annotate.py`` (or of ``--config``)
+instead; the drift is then measured against detecting every frame::
+
+    $ python benchmarks/annotate_propagation.py /path/to/swan/IDIAP/session_02/iPhone/00001/*_p_1.mp4
+"""
+
+import argparse
+import time
+import numpy as np
+from bob.db.swan.annotate import (
+    DEFAULT_ANNOTATE_CONFIG,
+    LandmarkTracker,
+    annotate_video,
+    load_annotator,
+)
+
+EYES = ("leye", "reye")
+
+
+class SyntheticDetector(object):
+    """Returns the true eye positions of the synthetic frames."""
+
+    def __init__(self, truth, cost):
+        self.truth = truth
+        self.cost = cost
+
+    def __call__(self, frame, annotations=None):
+        time.sleep(self.cost)
+        return dict(self.truth[id(frame)])
+
+
+def _synthetic_videos(n_videos, n_frames, shape=(640, 360)):
+    rng = np.random.RandomState(0)
+    yy, xx = np.mgrid[: shape[0], : shape[1]]
+    for v in range(n_videos):
+        background = rng.rand(*shape).astype("float32") * 60 + 100
+        frames, truth = [], {}
+        for i in range(n_frames):
+            # a hand-held selfie: slow sway and a little jitter
+            cy = shape[0] * 0.4 + 20 * np.sin(i / 25.0 + v) + rng.randn()
+            cx = shape[1] * 0.5 + 15 * np.cos(i / 30.0 + v) + rng.randn()
+            eyes = {"reye": (cy, cx - 40), "leye": (cy, cx + 40)}
+            frame = background.copy()
+            frame -= 50 * np.exp(-((yy - cy - 30) ** 2 + (xx - cx) ** 2) / 5000.0)
+            for y, x in eyes.values():
+                frame -= 90 * np.exp(-((yy - y) ** 2 + (xx - x) ** 2) / 40.0)
+            frame = np.repeat(frame[None].clip(0, 255), 3, axis=0).astype("uint8")
+            truth[id(frame)] = eyes
+            frames.append(frame)
+        yield "synthetic-{}".format(v), frames, truth
+
+
+def _real_videos(paths):
+    from bob.io.base import load
+    from bob.db.swan.video import rotate
+
+    for path in paths:
+        yield path, list(rotate(load(path))), None
+
+
+def _drift(annotations, reference):
+    errors, distances = [], []
+    for index, expected in reference.items():
+        found = annotations.get(index)
+        if not expected or not found:
+            continue
+        for key in EYES:
+            errors.append(np.hypot(*np.subtract(found[key], expected[key])))
+        distances.append(np.hypot(*np.subtract(expected["leye"], expected["reye"])))
+    if not errors:
+        return float("nan"), float("nan"), float("nan")
+    return np.mean(errors), np.max(errors), np.mean(errors) / np.mean(distances)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="*", help="SWAN video files to annotate.")
+    parser.add_argument("--config", default=DEFAULT_ANNOTATE_CONFIG)
+    parser.add_argument("--videos", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=150)
+    parser.add_argument("--detector-cost", type=float, default=0.05)
+    parser.add_argument("--keyframe-interval", type=int, nargs="+", default=[5, 10, 30])
+    parser.add_argument("--min-confidence", type=float, default=0.8)
+    args = parser.parse_args(argv)
+
+    if args.paths:
+        annotator, videos = load_annotator(args.config), _real_videos(args.paths)
+    else:
+        annotator, videos = None, _synthetic_videos(args.videos, args.frames)
+
+    print(
+        "{:<40} {:>9} {:>10} {:>10} {:>8} {:>10} {:>10} {:>8}".format(
+            "video",
+            "interval",
+            "detected",
+            "time (s)",
+            "speedup",
+            "drift (px)",
+            "max (px)",
+            "rel.",
+        )
+    )
+    for name, frames, truth in videos:
+        if truth is not None:
+            annotator = SyntheticDetector(truth, args.detector_cost)
+        start = time.time()
+        reference, _ = annotate_video(annotator, frames)
+        full_time = time.time() - start
+        if truth is not None:
+            reference = {str(i): truth[id(f)] for i, f in enumerate(frames)}
+        print(
+            "{:<40} {:>9} {:>10} {:>10.2f} {:>7.1f}x".format(
+                name[-40:], "-", len(frames), full_time, 1.0
+            )
+        )
+        for interval in args.keyframe_interval:
+            tracker = LandmarkTracker(min_confidence=args.min_confidence)
+            start = time.time()
+            annotations, detectors = annotate_video(
+                annotator, frames, tracker=tracker, keyframe_interval=interval
+            )
+            elapsed = time.time() - start
+            detected = sum(1 for d in detectors.values() if d != "LandmarkTracker")
+            drift, max_drift, relative = _drift(annotations, reference)
+            print(
+                "{:<40} {:>9} {:>10} {:>10.2f} {:>7.1f}x {:>10.2f} {:>10.2f} "
+                "{:>7.1%}".format(
+                    "",
+                    interval,
+                    detected,
+                    elapsed,
+                    full_time / elapsed,
+                    drift,
+                    max_drift,
+                    relative,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""Benchmarks the resampling and the memory use of audio per data type.
+
+By default, synthetic signals with typical durations of SWAN voice recordings
+are resampled. Real recordings are decoded and resampled with
+:any:`bob.db.swan.audio.read_audio` instead::
+
+    $ python benchmarks/audio_dtype.py /path/to/swan/IDIAP/session_02/iPhone/00001/*_p_2.mp4
+"""
+
+import argparse
+import timeit
+import numpy as np
+from bob.db.swan.audio import AUDIO_DTYPES, cast_audio, read_audio
+from bob.db.swan.resample import resample
+
+# durations (in seconds) of short, typical and long SWAN voice recordings
+DURATIONS = (4.0, 8.5, 15.0, 30.0)
+
+
+def _synthetic(rate, new_rate):
+    rng = np.random.RandomState(0)
+    for duration in DURATIONS:
+        signal = (rng.randn(int(duration * rate)) * 3000).astype(np.int16)
+
+        def load(dtype, signal=signal):
+            # as read_audio does
+            working = "float64" if dtype == "float64" else "float32"
+            resampled = resample(signal, rate, new_rate, dtype=working)
+            return cast_audio(resampled, dtype)
+
+        yield "{:.1f}s".format(duration), duration, load
+
+
+def _real(paths, new_rate):
+    for path in paths:
+        rate, signal = read_audio(path, dtype="int16")
+
+        def load(dtype, path=path):
+            return read_audio(path, new_rate=new_rate, dtype=dtype)[1]
+
+        yield path, len(signal) / float(rate), load
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="*", help="SWAN video files to decode.")
+    parser.add_argument("--rate", type=int, default=44100)
+    parser.add_argument("--new-rate", type=int, default=16000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.paths:
+        signals = _real(args.paths, args.new_rate)
+    else:
+        signals = _synthetic(args.rate, args.new_rate)
+
+    print(
+        "{:<40} {:>8} {:>10} {:>14} {:>10} {:>10}".format(
+            "signal", "dtype", "time (s)", "audio s / s", "MB / min", "max error"
+        )
+    )
+    for name, duration, load in signals:
+        reference = load("float64")
+        for dtype in AUDIO_DTYPES:
+            elapsed = min(
+                timeit.repeat(lambda: load(dtype), number=1, repeat=args.repeat)
+            )
+            audio = load(dtype)
+            error = np.abs(audio - reference).max()
+            print(
+                "{:<40} {:>8} {:>10.4f} {:>14.0f} {:>10.2f} {:>10.3f}".format(
+                    name[-40:],
+                    dtype,
+                    elapsed,
+                    duration / elapsed,
+                    audio.nbytes / duration * 60 / 2**20,
+                    error,
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
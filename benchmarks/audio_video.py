@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Benchmarks loading the frames and the audio of a video in one pass against
+opening the container once for the frames and once for the audio.
+
+By default, a synthetic talking-face recording is encoded with PyAV (H.264
+and AAC, like the SWAN ``_p_2.mp4`` files). Real recordings can be given
+instead::
+
+    $ python benchmarks/audio_video.py /path/to/swan/IDIAP/session_02/iPhone/00001/*_p_2.mp4
+"""
+
+import argparse
+import fractions
+import os
+import tempfile
+import timeit
+import numpy as np
+from bob.db.swan.audio import read_audio
+from bob.db.swan.audiovisual import _video_frame, load_audio_video
+from bob.db.swan.video import rotate
+
+
+def _encode(path, duration, fps=30, rate=44100, shape=(720, 1280)):
+    import av
+
+    rng = np.random.RandomState(0)
+    with av.open(path, "w") as container:
+        video = container.add_stream("libx264", rate=fps)
+        video.height, video.width = shape
+        video.pix_fmt = "yuv420p"
+        audio = container.add_stream("aac", rate=rate)
+        audio.layout = "mono"
+        background = rng.randint(0, 255, shape + (3,)).astype("uint8")
+        for i in range(int(duration * fps)):
+            image = np.roll(background, i * 4, axis=1)
+            frame = av.VideoFrame.from_ndarray(image, format="rgb24")
+            container.mux(video.encode(frame))
+        container.mux(video.encode())
+        signal = (rng.randn(int(duration * rate)) * 3000).astype("int16")
+        for start in range(0, len(signal), 1024):
+            frame = av.AudioFrame.from_ndarray(
+                signal[None, start : start + 1024], format="s16", layout="mono"
+            )
+            frame.sample_rate = rate
+            frame.pts = start
+            frame.time_base = fractions.Fraction(1, rate)
+            container.mux(audio.encode(frame))
+        container.mux(audio.encode())
+
+
+def _decode_video(path):
+    # the same C-contiguous upright frames as load_audio_video
+    import av
+
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+        frames = None
+        for index, frame in enumerate(container.decode(stream)):
+            image = rotate(_video_frame(frame))
+            if frames is None:
+                frames = np.empty((stream.frames,) + image.shape, image.dtype)
+            frames[index] = image
+    return frames
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="*", help="SWAN video files to decode.")
+    parser.add_argument("--duration", type=float, default=8.5)
+    parser.add_argument("--new-rate", type=int, default=16000)
+    parser.add_argument("--backend", default="av", help="the audio backend")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    paths = args.paths
+    if not paths:
+        folder = tempfile.mkdtemp()
+        paths = [os.path.join(folder, "synthetic_p_2.mp4")]
+        _encode(paths[0], args.duration)
+
+    def two_passes(path):
+        frames = _decode_video(path)
+        return frames, read_audio(path, new_rate=args.new_rate, backend=args.backend)
+
+    def one_pass(path):
+        return load_audio_video(path, transform=rotate, new_rate=args.new_rate)
+
+    print(
+        "{:<40} {:>8} {:>14} {:>14} {:>8}".format(
+            "video", "frames", "2 passes (s)", "1 pass (s)", "speedup"
+        )
+    )
+    for path in paths:
+        times = []
+        for load in (two_passes, one_pass):
+            times.append(
+                min(timeit.repeat(lambda: load(path), number=1, repeat=args.repeat))
+            )
+        sample = one_pass(path)
+        print(
+            "{:<40} {:>8} {:>14.3f} {:>14.3f} {:>7.2f}x".format(
+                path[-40:], len(sample.frames), times[0], times[1], times[0] / times[1]
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
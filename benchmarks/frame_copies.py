@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""Counts the copies of each frame between the decoder and its consumers.
+
+SWAN frames are rotated with :any:`numpy.swapaxes`, which returns a
+non-contiguous view. Consumers such as OpenCV, bob.ip or inference libraries
+need contiguous data and silently copy such views. This benchmark passes the
+frames through three such consumers and counts how often each frame is copied
+when the frames are views, contiguous copies or copies into a reused buffer.
+
+By default, synthetic frames of the size of SWAN frames are used. Real
+recordings can be given instead::
+
+    $ python benchmarks/frame_copies.py /path/to/swan/IDIAP/session_02/iPhone/00001/*_p_1.mp4
+"""
+
+import argparse
+import time
+import numpy as np
+from bob.db.swan.video import upright_frames
+
+# the frames as they come out of the decoder, before the rotation
+DECODED_SHAPE = (3, 720, 1280)
+
+MODES = (
+    ("view", dict(contiguous=False)),
+    ("contiguous", dict(contiguous=True)),
+    ("reuse buffer", dict(contiguous=True, reuse_buffer=True)),
+)
+
+
+def _decoded_frames(paths, n_frames):
+    if paths:
+        from bob.io.video import reader
+
+        for path in paths:
+            for frame in reader(path):
+                yield frame
+        return
+    rng = np.random.RandomState(0)
+    frame = rng.randint(0, 256, size=DECODED_SHAPE).astype("uint8")
+    for _ in range(n_frames):
+        yield frame
+
+
+def _copied(result, source):
+    return not np.shares_memory(result, source)
+
+
+def _consumers(frame):
+    # what OpenCV, bob.ip and a batched inference call do to their input
+    return (
+        np.ascontiguousarray(frame),
+        np.ascontiguousarray(frame, dtype=frame.dtype),
+        np.ascontiguousarray(frame[None]),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="*", help="SWAN video files to decode.")
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    frames = list(_decoded_frames(args.paths, args.frames))
+    print(
+        "{:<14} {:>14} {:>18} {:>16}".format(
+            "mode", "copies/frame", "MB copied/frame", "ms/frame"
+        )
+    )
+    for name, options in MODES:
+        copies = copied_bytes = 0
+        start = time.time()
+        for decoded, frame in zip(frames, upright_frames(frames, **options)):
+            if _copied(frame, decoded):
+                copies += 1
+                copied_bytes += frame.nbytes
+            for result in _consumers(frame):
+                if _copied(result, frame):
+                    copies += 1
+                    copied_bytes += result.nbytes
+        elapsed = time.time() - start
+        print(
+            "{:<14} {:>14.1f} {:>18.2f} {:>16.2f}".format(
+                name,
+                copies / len(frames),
+                copied_bytes / len(frames) / 1e6,
+                elapsed / len(frames) * 1000,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Benchmarks the polyphase resampling against the FFT resampling.
+
+By default, synthetic signals with typical durations of SWAN voice recordings
+are used. Real recordings can be given instead::
+
+    $ python benchmarks/resample.py /path/to/swan/IDIAP/session_02/iPhone/00001/*_p_2.mp4
+"""
+
+import argparse
+import timeit
+import numpy as np
+from bob.db.swan.resample import resample
+
+# durations (in seconds) of short, typical and long SWAN voice recordings
+DURATIONS = (4.0, 8.5, 15.0, 30.0)
+
+
+def _signals(paths, rate):
+    if paths:
+        from bob.db.swan.audio import decode_audio
+
+        for path in paths:
+            rate, signal = decode_audio(path)
+            yield path, rate, signal
+        return
+    rng = np.random.RandomState(0)
+    for duration in DURATIONS:
+        # add a few samples to get prime lengths, the worst case of the FFT
+        for extra in (0, 1, 17):
+            n_samples = int(duration * rate) + extra
+            signal = (rng.randn(n_samples) * 3000).astype(np.int16)
+            yield "{:.1f}s+{}".format(duration, extra), rate, signal
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("paths", nargs="*", help="SWAN video files to decode.")
+    parser.add_argument("--rate", type=int, default=44100)
+    parser.add_argument("--new-rate", type=int, default=16000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(
+        "{:<40} {:>10} {:>12} {:>12} {:>8}".format(
+            "signal", "samples", "fft (s)", "poly (s)", "speedup"
+        )
+    )
+    for name, rate, signal in _signals(args.paths, args.rate):
+        times = {}
+        for method in ("fft", "polyphase"):
+            times[method] = min(
+                timeit.repeat(
+                    lambda: resample(signal, rate, args.new_rate, method),
+                    number=1,
+                    repeat=args.repeat,
+                )
+            )
+        print(
+            "{:<40} {:>10} {:>12.4f} {:>12.4f} {:>7.1f}x".format(
+                name[-40:],
+                len(signal),
+                times["fft"],
+                times["polyphase"],
+                times["fft"] / times["polyphase"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ SWAN_FRAME_SHAPE = (3, 1280, 720)
 
 # from .query_bio import Database, SwanAudioBioFile, SwanVideoBioFile
 from .query_bio import Database, SwanVideoBioFile
+from .common import SampleFilter
 
 
 def __appropriate__(*args):
@@ -24,6 +25,7 @@ __appropriate__(
     Database,
     # SwanAudioBioFile,
     SwanVideoBioFile,
+    SampleFilter,
 )
 
 
@@ -0,0 +1,690 @@
+"""Annotates the faces in SWAN videos in parallel.
+
+The files are distributed to worker processes that each load the annotator of
+a configuration file once (by default ``config_annotate.py`` of this package)
+and annotate one video at a time. Frames are decoded and annotated one by one,
+so only the annotations of a video are kept in memory, never its frames.
+
+Every annotated video is appended to a progress file in the output directory.
+An interrupted run is resumed by running the same command again: files that
+are already in the progress file are skipped. The progress file also records
+which detector of the :any:`bob.bio.base.annotator.FailSafe` chain annotated
+each frame:
+
+.. code-block:: sh
+
+    $ bob_dbmanage.py swan annotate --protocol pad_p2_face_f1 \\
+        --output-directory annotations --jobs 8
+
+Large corpora can be split across several machines with ``--shard``, e.g.
+``--shard 1/4`` to ``--shard 4/4``.
+
+With ``--keyframe-interval``, the detectors only run on keyframes and the eyes
+are tracked in the frames in between with a :any:`LandmarkTracker`. Detection
+runs again as soon as tracking is unsure or its annotations are not valid.
+"""
+
+from collections import Counter, OrderedDict
+from multiprocessing import get_context
+import json
+import os
+import time
+import numpy as np
+import pkg_resources
+from bob.io.video import reader
+from .video import upright_frames
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ANNOTATE_CONFIG = pkg_resources.resource_filename(
+    __name__, "config_annotate.py"
+)
+"The configuration file that defines the default ``annotator``."
+
+PROGRESS_FILE = "annotate_progress.jsonl"
+"The name of the progress file in the output directory."
+
+
+def _name(annotator):
+    return type(annotator).__name__
+
+
+def annotate_frame(annotator, frame):
+    """Annotates one frame and tells which detector produced the annotations.
+
+    If ``annotator`` is a :any:`bob.bio.base.annotator.FailSafe`, its
+    annotators are tried in order, exactly like the fail-safe annotator does,
+    to find out which one completed the required annotations.
+
+    Parameters
+    ----------
+    annotator : :any:`bob.bio.base.annotator.Annotator`
+        An image annotator.
+    frame : numpy.ndarray
+        The frame.
+
+    Returns
+    -------
+    annotations : dict or None
+        The annotations of the frame.
+    detector : str or None
+        The class name of the annotator that produced the annotations.
+    """
+    annotators = getattr(annotator, "annotators", None)
+    required_keys = getattr(annotator, "required_keys", None)
+    if annotators is None or required_keys is None:
+        annotations = annotator(frame)
+        return annotations, _name(annotator) if annotations else None
+
+    annotations = {}
+    for detector in annotators:
+        try:
+            # later annotators may use the annotations of earlier ones
+            result = detector(frame, annotations=annotations)
+        except Exception:
+            logger.debug("The annotator %s failed.", _name(detector), exc_info=True)
+            result = None
+        annotations.update(result or {})
+        if all(key in annotations for key in required_keys):
+            if annotator.only_required_keys:
+                annotations = {key: annotations[key] for key in required_keys}
+            return annotations, _name(detector)
+    return None, None
+
+
+class LandmarkTracker(object):
+    """Tracks landmarks from one frame to the next with template matching.
+
+    A patch around each landmark is taken from the last frame where the
+    landmarks were detected. In the next frames, each patch is searched
+    around the last position of its landmark in a downscaled grey version of
+    the frame and the best normalized cross-correlation is the new position.
+
+    Parameters
+    ----------
+    keys : [str]
+        The landmarks to track. Other points of the annotations (e.g.
+        ``topleft``) are moved with the mean motion of the tracked ones.
+    patch_size : int
+        The size of the patches in pixels of the original frame.
+    search_radius : int
+        How far (in pixels of the original frame) a landmark may move from
+        one frame to the next.
+    scale : int
+        The downscaling factor of the frames.
+    min_confidence : float
+        The lowest correlation that is accepted for all landmarks.
+    """
+
+    def __init__(
+        self,
+        keys=("leye", "reye"),
+        patch_size=32,
+        search_radius=24,
+        scale=2,
+        min_confidence=0.8,
+        **kwargs
+    ):
+        super(LandmarkTracker, self).__init__(**kwargs)
+        self.keys = tuple(keys)
+        self.half = max(1, patch_size // (2 * scale))
+        self.radius = max(1, search_radius // scale)
+        self.scale = scale
+        self.min_confidence = min_confidence
+        self.annotations = None
+
+    def __repr__(self):
+        return "LandmarkTracker(keys={!r}, min_confidence={!r})".format(
+            self.keys, self.min_confidence
+        )
+
+    def _grey(self, frame):
+        frame = frame[..., :: self.scale, :: self.scale]
+        if frame.ndim == 3:
+            return frame.mean(axis=0, dtype="float32")
+        return frame.astype("float32")
+
+    def _patch(self, grey, y, x, half):
+        if y < half or x < half:
+            return None
+        patch = grey[y - half : y + half + 1, x - half : x + half + 1]
+        if patch.shape != (2 * half + 1, 2 * half + 1):
+            return None
+        return patch
+
+    def reset(self, frame, annotations):
+        """Starts tracking the landmarks of a frame.
+
+        Returns
+        -------
+        bool
+            ``False`` if the landmarks cannot be tracked, e.g. because they
+            are too close to the border of the frame.
+        """
+        self.annotations = None
+        if not annotations or not all(
+            _is_position(annotations.get(key)) for key in self.keys
+        ):
+            return False
+        grey = self._grey(frame)
+        templates, positions = {}, {}
+        for key in self.keys:
+            y, x = (int(round(v / self.scale)) for v in annotations[key])
+            patch = self._patch(grey, y, x, self.half)
+            if patch is None:
+                return False
+            patch = patch - patch.mean()
+            norm = np.sqrt((patch**2).sum())
+            if norm == 0:
+                return False
+            templates[key], positions[key] = patch / norm, (y, x)
+        self.annotations = annotations
+        self.templates = templates
+        self.origins = dict(positions)
+        self.positions = {
+            key: (float(y), float(x)) for key, (y, x) in positions.items()
+        }
+        return True
+
+    def track(self, frame):
+        """Finds the landmarks in the next frame.
+
+        Returns
+        -------
+        annotations : dict or None
+            The annotations of the frame or ``None`` if nothing is tracked.
+        confidence : float
+            The lowest correlation of the landmarks, between -1 and 1.
+        """
+        if self.annotations is None:
+            return None, -1.0
+        grey = self._grey(frame)
+        size = 2 * self.half + 1
+        positions, confidence = {}, 1.0
+        for key in self.keys:
+            y, x = (int(round(v)) for v in self.positions[key])
+            region = self._patch(grey, y, x, self.half + self.radius)
+            if region is None:
+                return None, -1.0
+            windows = np.lib.stride_tricks.sliding_window_view(region, (size, size))
+            windows = windows - windows.mean(axis=(2, 3), keepdims=True)
+            norms = np.sqrt((windows**2).sum(axis=(2, 3)))
+            scores = np.einsum("ijkl,kl->ij", windows, self.templates[key])
+            scores /= np.maximum(norms, 1e-6)
+            i, j = np.unravel_index(np.argmax(scores), scores.shape)
+            confidence = min(confidence, float(scores[i, j]))
+            positions[key] = (
+                y - self.radius + i + _subpixel(scores[:, j], i),
+                x - self.radius + j + _subpixel(scores[i, :], j),
+            )
+        self.positions = positions
+        return self._move(positions), confidence
+
+    def _move(self, positions):
+        annotations, shifts = {}, []
+        for key in self.keys:
+            (y, x), (y0, x0) = positions[key], self.origins[key]
+            shift = ((y - y0) * self.scale, (x - x0) * self.scale)
+            annotations[key] = tuple(
+                float(v + d) for v, d in zip(self.annotations[key], shift)
+            )
+            shifts.append(shift)
+        shift = np.mean(shifts, axis=0)
+        for key, value in self.annotations.items():
+            if key in annotations:
+                continue
+            if _is_position(value):
+                value = tuple(float(v + d) for v, d in zip(value, shift))
+            annotations[key] = value
+        return annotations
+
+
+def _is_position(value):
+    return isinstance(value, (list, tuple)) and len(value) == 2
+
+
+def _subpixel(scores, i):
+    # the vertex of a parabola through the best score and its neighbours
+    if i == 0 or i == len(scores) - 1:
+        return 0.0
+    left, center, right = scores[i - 1], scores[i], scores[i + 1]
+    denominator = left - 2 * center + right
+    if denominator >= 0:
+        return 0.0
+    return float(0.5 * (left - right) / denominator)
+
+
+def annotate_video(annotator, frames, tracker=None, keyframe_interval=10):
+    """Annotates the frames of a video as they are decoded.
+
+    This gives the same annotations as the
+    :any:`bob.bio.video.annotator.Wrapper` of ``config_annotate.py`` without
+    loading all frames first.
+
+    Parameters
+    ----------
+    annotator : :any:`bob.bio.video.annotator.Wrapper` or :any:`bob.bio.base.annotator.Annotator`
+        A video annotator that wraps an image annotator, or an image
+        annotator. If the wrapper normalizes annotations, invalid annotations
+        are replaced by the last valid ones (see
+        :any:`bob.bio.video.annotator.normalize_annotations`).
+    frames : iterable of numpy.ndarray
+        The frames of the video, e.g. :any:`bob.db.swan.common.SwanVideoFile.frames`.
+    tracker : :any:`LandmarkTracker`, optional
+        If given, the detectors only run on keyframes and the landmarks are
+        tracked in the frames in between. A frame is detected again if
+        tracking is less confident than ``tracker.min_confidence`` or the
+        validator of the wrapper rejects the tracked annotations.
+    keyframe_interval : int
+        The maximum number of frames between two detections when tracking.
+
+    Returns
+    -------
+    annotations : collections.OrderedDict
+        ``{frame_index: annotations}`` with string frame indices.
+    detectors : collections.OrderedDict
+        ``{frame_index: detector}``, the detector that produced the
+        annotations of each frame.
+    """
+    image_annotator = getattr(annotator, "annotator", annotator)
+    validator = getattr(annotator, "validator", None) or bool
+    annotations, detectors = OrderedDict(), OrderedDict()
+    age = None  # the number of frames since the last keyframe
+    for index, frame in enumerate(frames):
+        index = str(index)
+        if age is not None and age < keyframe_interval:
+            tracked, confidence = tracker.track(frame)
+            if (
+                tracked is not None
+                and confidence >= tracker.min_confidence
+                and validator(tracked)
+            ):
+                annotations[index], detectors[index] = tracked, _name(tracker)
+                age += 1
+                continue
+            logger.debug("Lost track in frame %s (%.2f)", index, confidence)
+        annotations[index], detectors[index] = annotate_frame(image_annotator, frame)
+        age = None
+        if (
+            tracker is not None
+            and annotations[index] is not None
+            and validator(annotations[index])
+            and tracker.reset(frame, annotations[index])
+        ):
+            age = 1
+    if getattr(annotator, "normalize", False):
+        annotations, detectors = _normalize(
+            annotations, detectors, annotator.validator, annotator.max_age
+        )
+    return annotations, detectors
+
+
+def _normalize(annotations, detectors, validator, max_age):
+    # like bob.bio.video.annotator.normalize_annotations but keeps track of
+    # the detectors of the frames whose annotations are reused
+    current, detector, age = None, None, 0
+    normalized, sources = OrderedDict(), OrderedDict()
+    for index, annotation in annotations.items():
+        if validator(annotation):
+            current, detector, age = annotation, detectors[index], 0
+        elif max_age < 0 or age < max_age:
+            age += 1
+        else:
+            current, detector = None, None
+        normalized[index], sources[index] = current, detector
+    return normalized, sources
+
+
+def detector_runs(detectors):
+    """Compresses the detectors of the frames of a video.
+
+    Parameters
+    ----------
+    detectors : collections.OrderedDict
+        The detectors returned by :any:`annotate_video`.
+
+    Returns
+    -------
+    [[int, str]]
+        The first frame index and the detector of each run of frames that
+        were annotated by the same detector.
+    """
+    runs = []
+    for index, detector in detectors.items():
+        if not runs or runs[-1][1] != detector:
+            runs.append([int(index), detector])
+    return runs
+
+
+def _to_json(value):
+    # annotators may return numpy scalars or arrays
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+def write_annotations(annotations, path):
+    """Writes annotations to a JSON file that
+    :any:`bob.db.base.read_annotation_file` reads.
+
+    The file is written next to its destination first and then moved, so an
+    interrupted run never leaves a truncated file behind.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(annotations, f, indent=1, default=_to_json)
+    os.replace(tmp_path, path)
+
+
+def read_progress(path):
+    """Reads a progress file.
+
+    Returns
+    -------
+    dict
+        The last entry of each file. Entries of files that failed have an
+        ``error``.
+    """
+    entries = {}
+    if not os.path.isfile(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the last line of an interrupted run may be incomplete
+                continue
+            entries[entry["path"]] = entry
+    return entries
+
+
+def _end_last_line(path):
+    # an interrupted run may have left an incomplete line at the end
+    if os.path.isfile(path) and os.path.getsize(path):
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+_worker_annotator = _worker_tracking = None
+
+
+def load_annotator(config=DEFAULT_ANNOTATE_CONFIG):
+    """Loads the ``annotator`` defined in a configuration file."""
+    from bob.extension.config import load
+
+    return load([config], entry_point_group="bob.bio.annotator").annotator
+
+
+def _init_worker(config, tracking=None):
+    global _worker_annotator, _worker_tracking
+    _worker_annotator = load_annotator(config)
+    _worker_tracking = tracking
+
+
+def _iter_frames(video_path):
+    # the detectors need contiguous frames
+    return upright_frames(reader(video_path))
+
+
+def _annotate_task(task):
+    path, video_path, output_path = task
+    start = time.time()
+    entry = dict(path=path, frames=0, detectors=[], counts={}, error=None)
+    try:
+        tracking = dict(_worker_tracking or {})
+        keyframe_interval = tracking.pop("keyframe_interval", None)
+        annotations, detectors = annotate_video(
+            _worker_annotator,
+            _iter_frames(video_path),
+            tracker=LandmarkTracker(**tracking) if keyframe_interval else None,
+            keyframe_interval=keyframe_interval,
+        )
+        write_annotations(annotations, output_path)
+        entry["frames"] = len(annotations)
+        entry["detectors"] = detector_runs(detectors)
+        entry["counts"] = dict(Counter(d for d in detectors.values() if d))
+    except Exception as e:
+        logger.debug("Failed to annotate %s", video_path, exc_info=True)
+        entry["error"] = "{}: {}".format(type(e).__name__, e)
+    entry["seconds"] = round(time.time() - start, 3)
+    return entry
+
+
+def annotate_files(
+    paths,
+    directory,
+    output_directory,
+    config=DEFAULT_ANNOTATE_CONFIG,
+    extension="",
+    output_extension=".json",
+    jobs=1,
+    force=False,
+    keyframe_interval=None,
+    min_confidence=0.8,
+):
+    """Annotates videos in parallel and resumes interrupted runs.
+
+    Parameters
+    ----------
+    paths : iterable of str
+        The paths of the videos relative to ``directory``.
+    directory : str
+        The root directory of the database.
+    output_directory : str
+        The directory where the annotations and the progress file
+        (:any:`PROGRESS_FILE`) are written.
+    config : str
+        The configuration file (or ``bob.bio.annotator`` resource) that
+        defines the ``annotator``.
+    extension : str
+        Appended to each path to get the video file.
+    output_extension : str
+        Appended to each path to get the annotation file.
+    jobs : int
+        The number of worker processes.
+    force : bool
+        If ``True``, files that were already annotated are annotated again.
+    keyframe_interval : int, optional
+        If given, landmarks are tracked between detections, see
+        :any:`annotate_video`.
+    min_confidence : float
+        The lowest accepted confidence of the :any:`LandmarkTracker`.
+
+    Returns
+    -------
+    dict
+        The number of ``annotated``, ``skipped`` and ``failed`` files.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    progress_path = os.path.join(output_directory, PROGRESS_FILE)
+    done = (
+        set()
+        if force
+        else {
+            path
+            for path, entry in read_progress(progress_path).items()
+            if entry["error"] is None
+            and os.path.isfile(os.path.join(output_directory, path + output_extension))
+        }
+    )
+
+    tasks, skipped = [], 0
+    for path in OrderedDict.fromkeys(paths):
+        if path in done:
+            skipped += 1
+            continue
+        tasks.append(
+            (
+                path,
+                os.path.join(directory, path + extension),
+                os.path.join(output_directory, path + output_extension),
+            )
+        )
+    logger.info("Annotating %d files, %d were already annotated", len(tasks), skipped)
+
+    stats = dict(annotated=0, skipped=skipped, failed=0)
+    tracking = None
+    if keyframe_interval:
+        tracking = dict(
+            keyframe_interval=keyframe_interval, min_confidence=min_confidence
+        )
+    if not tasks:
+        return stats
+    if jobs > 1:
+        pool = get_context().Pool(
+            min(jobs, len(tasks)), initializer=_init_worker, initargs=(config, tracking)
+        )
+        results = pool.imap_unordered(_annotate_task, tasks)
+    else:
+        pool = None
+        _init_worker(config, tracking)
+        results = map(_annotate_task, tasks)
+
+    try:
+        _end_last_line(progress_path)
+        with open(progress_path, "a") as progress:
+            for entry in results:
+                progress.write(json.dumps(entry) + "\n")
+                # the progress file is the checkpoint of the run
+                progress.flush()
+                if entry["error"] is None:
+                    stats["annotated"] += 1
+                    logger.info(
+                        "Annotated %s (%d frames) in %.1fs",
+                        entry["path"],
+                        entry["frames"],
+                        entry["seconds"],
+                    )
+                else:
+                    stats["failed"] += 1
+                    logger.error(
+                        "Failed to annotate %s: %s", entry["path"], entry["error"]
+                    )
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return stats
+
+
+def shard(items, spec):
+    """Returns the shard ``k/n`` (1-based) of a sequence."""
+    k, n = (int(v) for v in spec.split("/"))
+    if not 1 <= k <= n:
+        raise ValueError("Invalid shard {}, expected k/n with 1 <= k <= n".format(spec))
+    return list(items)[k - 1 :: n]
+
+
+def annotate_subparser(subparsers):
+    from bob.extension import rc
+    from .filelists import GROUPS
+
+    parser = subparsers.add_parser(
+        "annotate", help="Annotates the faces in the videos of the protocols."
+    )
+    parser.add_argument(
+        "-p",
+        "--protocol",
+        action="append",
+        help="if given, only the videos of this protocol are annotated. Can be "
+        "given several times. [default: all protocols]",
+    )
+    parser.add_argument(
+        "-g",
+        "--group",
+        action="append",
+        choices=GROUPS,
+        help="if given, only the files of this group are annotated",
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=rc["bob.db.swan.directory"],
+        required=rc["bob.db.swan.directory"] is None,
+        help="the root directory of the database [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-e",
+        "--extension",
+        default="",
+        help="the extension appended to every sample [default: %(default)r]",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-directory",
+        required=True,
+        help="the directory of the annotations and of the progress file",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        default=DEFAULT_ANNOTATE_CONFIG,
+        help="the configuration file that defines the annotator "
+        "[default: %(default)s]",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="the number of worker processes [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--shard",
+        help="only annotate the k-th of n shards of the files, e.g. 2/4",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="annotate files again even if they were annotated before",
+    )
+    parser.add_argument(
+        "-k",
+        "--keyframe-interval",
+        type=int,
+        help="if given, the detectors run at least every this many frames and "
+        "the eyes are tracked in between",
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=0.8,
+        help="the lowest tracking confidence before detecting again "
+        "[default: %(default)s]",
+    )
+    parser.set_defaults(func=_annotate)  # action
+
+
+def _annotate(args):
+    from .filelists import iter_paths
+
+    paths = iter_paths(protocols=args.protocol, groups=args.group, unique=True)
+    # the lists also have the audio (.wav) and image (.png) files of attacks
+    paths = sorted(path for path in paths if path.endswith(".mp4"))
+    if args.shard:
+        paths = shard(paths, args.shard)
+    stats = annotate_files(
+        paths,
+        args.directory,
+        args.output_directory,
+        config=args.config,
+        extension=args.extension,
+        jobs=args.jobs,
+        force=args.force,
+        keyframe_interval=args.keyframe_interval,
+        min_confidence=args.min_confidence,
+    )
+    print(
+        "Annotated {annotated} files, skipped {skipped} and {failed} failed".format(
+            **stats
+        )
+    )
+    return 1 if stats["failed"] else 0
@@ -0,0 +1,366 @@
+"""Fast access to the annotations of SWAN videos.
+
+The annotations of a video are stored in a JSON file with the positions of
+the landmarks in every frame. Parsing these files again every time the
+annotations of a file are accessed is slow, so this module provides:
+
+* :any:`AnnotationCache`, a per-process cache of parsed annotations with a
+  memory limit, used by :any:`bob.db.swan.common.SwanVideoFile` by default;
+* :any:`pack_annotations`, which packs the annotations of all files of a
+  protocol into one compact array file; and
+* :any:`AnnotationPack`, which loads such a file and returns the same
+  dictionaries as the JSON files.
+
+Annotations are packed with:
+
+.. code-block:: sh
+
+    $ bob_dbmanage.py swan pack-annotations --protocol pad_p2_face_f1 \\
+        --output pad_p2_face_f1_annotations.npz
+
+The memory limit of the cache can be changed with:
+
+.. code-block:: sh
+
+    $ bob config set bob.db.swan.annotation_cache_size 1000000000  # in bytes
+"""
+
+from collections import OrderedDict
+import json
+import os
+import sys
+import threading
+import numpy as np
+from bob.db.base import read_annotation_file
+from bob.extension import rc
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _copy(value):
+    # parsed annotations only nest dictionaries and lists
+    if isinstance(value, dict):
+        return type(value)((k, _copy(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+
+def _size_of(value):
+    # a rough estimate of the memory used by parsed annotations
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_size_of(v) for v in value.values())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+
+class AnnotationCache(object):
+    """A least-recently-used cache of parsed annotation files.
+
+    Files that were modified since they were cached are parsed again.
+
+    Parameters
+    ----------
+    max_size : int, optional
+        The (approximate) maximum memory used by the cached annotations in
+        bytes. If ``None``, the cache grows without limit. If ``0``, nothing
+        is cached.
+
+    Attributes
+    ----------
+    size : int
+        The estimated memory used by the cached annotations.
+    hits, misses : int
+        The number of accesses that were and were not served from the cache.
+    """
+
+    def __init__(self, max_size=256 * 1024**2, **kwargs):
+        super(AnnotationCache, self).__init__(**kwargs)
+        self.max_size = None if max_size is None else int(max_size)
+        self.size = 0
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "AnnotationCache(max_size={!r})".format(self.max_size)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def read(self, path, annotation_type="json"):
+        """Returns the annotations of a file, parsing it only if needed.
+
+        Parameters
+        ----------
+        path : str
+            The path of the annotation file.
+        annotation_type : str
+            See :any:`bob.db.base.read_annotation_file`.
+
+        Returns
+        -------
+        dict or None
+            A copy of the annotations, which can be modified.
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            # read_annotation_file reports missing files
+            return read_annotation_file(path, annotation_type)
+        key = (path, annotation_type)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] == mtime:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry[0])
+            self.misses += 1
+        annotations = read_annotation_file(path, annotation_type)
+        if self.max_size != 0 and annotations is not None:
+            self._put(key, annotations, mtime)
+        return _copy(annotations)
+
+    def _put(self, key, annotations, mtime):
+        size = _size_of(annotations)
+        if self.max_size is not None and size > self.max_size:
+            return
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # the file was modified
+                self.size -= entry[1]
+            self._entries[key] = (annotations, size, mtime)
+            self.size += size
+            while self.max_size is not None and self.size > self.max_size:
+                _, (_, evicted, _) = self._entries.popitem(last=False)
+                self.size -= evicted
+
+
+def _is_point(value):
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) == 2
+        and all(isinstance(v, (int, float)) for v in value)
+    )
+
+
+def pack_annotations(annotations, output):
+    """Packs the annotations of several videos into one file.
+
+    The positions of landmarks, i.e. ``(y, x)`` pairs, are packed into one
+    ``float32`` array. Other values (e.g. quality scores) are kept as JSON
+    and frames without annotations (``None``) are marked as such.
+
+    Parameters
+    ----------
+    annotations : iterable of (str, dict)
+        The path of each video and its annotations as returned by
+        :any:`bob.db.base.read_annotation_file`, i.e. ``{frame_index:
+        {landmark: (y, x)}}``.
+    output : str
+        The path of the ``.npz`` file to write.
+
+    Returns
+    -------
+    int
+        The number of packed videos.
+    """
+    paths, offsets, frames, positions, landmarks = [], [0], [], [], {}
+    empty, extras = [], []
+    for path, video in annotations:
+        if video is None:
+            continue
+        for frame, points in video.items():
+            frames.append(int(frame))
+            empty.append(points is None)
+            row, extra = {}, {}
+            for name, value in (points or {}).items():
+                if _is_point(value):
+                    row[landmarks.setdefault(name, len(landmarks))] = value
+                else:
+                    extra[name] = value
+            positions.append(row)
+            extras.append(json.dumps(extra) if extra else "")
+        paths.append(path)
+        offsets.append(len(frames))
+
+    points = np.full((len(frames), len(landmarks), 2), np.nan, dtype="float32")
+    for i, row in enumerate(positions):
+        for j, value in row.items():
+            points[i, j] = value
+    np.savez_compressed(
+        output,
+        paths=np.array(paths, dtype=str).astype("S"),
+        landmarks=np.array(list(landmarks), dtype=str).astype("S"),
+        offsets=np.array(offsets, dtype="i8"),
+        frames=np.array(frames, dtype="i4"),
+        points=points,
+        empty=np.array(empty, dtype=bool),
+        extras=np.array(extras, dtype=str).astype("S"),
+    )
+    return len(paths)
+
+
+class AnnotationPack(object):
+    """Loads the annotations packed by :any:`pack_annotations`.
+
+    The file is only read on first access.
+
+    Parameters
+    ----------
+    path : str
+        The path of the packed annotations.
+    """
+
+    def __init__(self, path, **kwargs):
+        super(AnnotationPack, self).__init__(**kwargs)
+        self.path = path
+        self._data = None
+
+    def __repr__(self):
+        return "AnnotationPack({!r})".format(self.path)
+
+    def _load(self):
+        if self._data is None:
+            with np.load(self.path) as data:
+                paths = data["paths"].astype(str).tolist()
+                count = len(data["frames"])
+                self._data = dict(
+                    landmarks=data["landmarks"].astype(str).tolist(),
+                    offsets=data["offsets"],
+                    frames=data["frames"],
+                    points=data["points"],
+                    # older packs have neither empty frames nor extra values
+                    empty=data["empty"] if "empty" in data else np.zeros(count, bool),
+                    extras=(
+                        data["extras"].astype(str).tolist()
+                        if "extras" in data
+                        else [""] * count
+                    ),
+                    positions={path: i for i, path in enumerate(paths)},
+                )
+        return self._data
+
+    def __len__(self):
+        return len(self._load()["positions"])
+
+    def __contains__(self, path):
+        return path in self._load()["positions"]
+
+    def points(self, path):
+        """Returns the packed arrays of a video.
+
+        Returns
+        -------
+        frames : numpy.ndarray
+            The frame indices with the shape ``(n_frames,)``.
+        points : numpy.ndarray
+            The ``(y, x)`` positions with the shape ``(n_frames,
+            n_landmarks, 2)``. Missing landmarks are ``NaN``.
+        """
+        start, end = self._range(path)
+        data = self._load()
+        return data["frames"][start:end], data["points"][start:end]
+
+    def _range(self, path):
+        data = self._load()
+        position = data["positions"][path]
+        return data["offsets"][position], data["offsets"][position + 1]
+
+    def get(self, path):
+        """Returns the annotations of a video like
+        :any:`bob.db.base.read_annotation_file` or ``None`` if the video is
+        not packed.
+
+        Parameters
+        ----------
+        path : str
+            The path of the video relative to the database directory.
+
+        Returns
+        -------
+        dict or None
+            ``{frame_index: {landmark: [y, x]}}`` with string frame indices.
+            The positions were packed as ``float32``, so they are floats even
+            if the JSON files have integers and may differ from them in the
+            last digits.
+        """
+        if path not in self:
+            return None
+        data = self._load()
+        start = self._range(path)[0]
+        frames, points = self.points(path)
+        annotations = OrderedDict()
+        for i, (frame, row) in enumerate(zip(frames.tolist(), points.tolist())):
+            if data["empty"][start + i]:
+                annotations[str(frame)] = None
+                continue
+            annotations[str(frame)] = values = {
+                name: point
+                for name, point in zip(data["landmarks"], row)
+                if point[0] == point[0]  # skips NaN
+            }
+            if data["extras"][start + i]:
+                values.update(json.loads(data["extras"][start + i]))
+        return annotations
+
+
+def pack_annotations_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "pack-annotations",
+        help="Packs the annotations of a protocol into a single file.",
+    )
+    parser.add_argument("-p", "--protocol", required=True, help="the protocol to pack")
+    parser.add_argument(
+        "-o", "--output", required=True, help="the path of the packed file (.npz)"
+    )
+    parser.add_argument(
+        "-a",
+        "--annotation-directory",
+        default=rc["bob.db.swan.annotation_dir"],
+        required=rc["bob.db.swan.annotation_dir"] is None,
+        help="the directory of the annotations [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-e",
+        "--extension",
+        default=".json",
+        help="the extension of the annotation files [default: %(default)s]",
+    )
+    parser.set_defaults(func=_pack_annotations)  # action
+
+
+def _pack_annotations(args):
+    from .filelists import iter_paths
+
+    def annotations():
+        for path in iter_paths(protocols=[args.protocol], unique=True):
+            annotation_file = os.path.join(
+                args.annotation_directory, path + args.extension
+            )
+            if not os.path.isfile(annotation_file):
+                logger.warning("%s has no annotations.", path)
+                continue
+            yield path, read_annotation_file(annotation_file, "json")
+
+    count = pack_annotations(annotations(), args.output)
+    print("Packed the annotations of {} files into {}".format(count, args.output))
+    return 0
+
+
+DEFAULT_ANNOTATION_CACHE = AnnotationCache(
+    256 * 1024**2
+    if rc["bob.db.swan.annotation_cache_size"] is None
+    else rc["bob.db.swan.annotation_cache_size"]
+)
+"The annotation cache used by :any:`bob.db.swan.common.SwanVideoFile`."
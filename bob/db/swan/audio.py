@@ -0,0 +1,558 @@
+"""Audio decoding of SWAN video files.
+
+The audio stream of a SWAN ``.mp4`` file can be decoded with one of the
+following backends:
+
+``"av"``
+    Decodes the stream in-process using PyAV_ (optional dependency).
+``"pipe"``
+    Runs ``ffmpeg`` and reads the decoded PCM samples from its standard output.
+``"tempfile"``
+    Runs ``ffmpeg`` to write a temporary ``.wav`` file which is read back with
+    :any:`scipy.io.wavfile.read`.
+``"auto"``
+    Uses ``"av"`` when PyAV is installed and ``"pipe"`` otherwise. If decoding
+    fails, it falls back to ``"tempfile"``.
+
+:any:`stream_audio` yields the audio in fixed-size blocks while it is being
+decoded, so the memory usage does not depend on the length of the recording.
+
+.. _PyAV: https://pyav.org
+"""
+
+import struct
+import subprocess
+import tempfile
+import scipy.io.wavfile
+import numpy as np
+from .resample import StreamResampler, resample
+import logging
+
+logger = logging.getLogger(__name__)
+
+AUDIO_BACKENDS = ("auto", "av", "pipe", "tempfile")
+"Names of the available audio decoding backends."
+
+AUDIO_DTYPES = ("float64", "float32", "int16")
+"""The data types of decoded audio. Samples keep the scale of ``int16``
+samples in all types. ``float32`` and ``int16`` audio is also resampled in
+single precision."""
+
+AUDIO_DECODER_VERSION = 1
+"""Version of the decoded output. Bump it whenever decoding or resampling
+changes the returned signals so that cached audio is invalidated."""
+
+
+def _has_pyav():
+    try:
+        import av  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _parse_wav(data):
+    """Parses a 16 bit PCM wav file that was streamed through a pipe.
+
+    When ffmpeg writes to a pipe it cannot seek back to fill in the chunk sizes
+    so the ``data`` chunk is assumed to extend to the end of the stream.
+    """
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise RuntimeError("ffmpeg did not produce a valid wav stream.")
+    position, rate, channels = 12, None, None
+    while position + 8 <= len(data):
+        chunk_id = data[position : position + 4]
+        (size,) = struct.unpack("<I", data[position + 4 : position + 8])
+        position += 8
+        if chunk_id == b"fmt ":
+            _, channels, rate, _, _, bits = struct.unpack(
+                "<HHIIHH", data[position : position + 16]
+            )
+            if bits != 16:
+                raise RuntimeError("Expected 16 bit samples, got %d bits." % bits)
+        elif chunk_id == b"data":
+            break
+        position += size + (size & 1)
+    if rate is None:
+        raise RuntimeError("The wav stream does not contain a format chunk.")
+    payload = data[position:]
+    payload = payload[: len(payload) - len(payload) % (2 * channels)]
+    signal = np.frombuffer(payload, dtype="<i2").astype(np.int16)
+    if channels > 1:
+        signal = signal.reshape(-1, channels)
+    return rate, signal
+
+
+def _rate_args(rate):
+    return [] if rate is None else ["-ar", str(rate)]
+
+
+def decode_audio_tempfile(video_path, rate=None):
+    """Decodes the audio of a video through a temporary ``.wav`` file."""
+    with tempfile.NamedTemporaryFile(suffix=".wav") as f:
+        cmd = ["ffmpeg", "-v", "quiet", "-i", video_path, "-y", "-vn"]
+        cmd += _rate_args(rate) + [f.name]
+        subprocess.call(cmd)
+        f.seek(0)
+        rate, signal = scipy.io.wavfile.read(f.name)
+    return rate, signal
+
+
+def decode_audio_pipe(video_path, rate=None):
+    """Decodes the audio of a video by reading ffmpeg's output from a pipe."""
+    cmd = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-i",
+        video_path,
+        "-vn",
+        "-acodec",
+        "pcm_s16le",
+    ]
+    cmd += _rate_args(rate) + ["-f", "wav", "-"]
+    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(
+            "ffmpeg failed to decode {}: {}".format(
+                video_path, process.stderr.decode(errors="replace").strip()
+            )
+        )
+    return _parse_wav(process.stdout)
+
+
+def _resampled_frames(resampler, frame):
+    # PyAV < 9 returns a single frame (or None) instead of a list
+    frames = resampler.resample(frame)
+    if frames is None:
+        return []
+    if not isinstance(frames, (list, tuple)):
+        return [frames]
+    return frames
+
+
+def decode_audio_av(video_path, rate=None):
+    """Decodes the audio of a video in-process using PyAV."""
+    import av
+
+    with av.open(video_path) as container:
+        stream = container.streams.audio[0]
+        rate = rate or stream.codec_context.sample_rate
+        channels = len(stream.codec_context.layout.channels)
+        resampler = av.AudioResampler(
+            format="s16", layout=stream.codec_context.layout.name, rate=rate
+        )
+        chunks = []
+        for frame in container.decode(stream):
+            for out in _resampled_frames(resampler, frame):
+                chunks.append(out.to_ndarray().reshape(-1))
+        for out in _resampled_frames(resampler, None):
+            chunks.append(out.to_ndarray().reshape(-1))
+    signal = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+    signal = signal.astype(np.int16, copy=False)
+    if channels > 1:
+        signal = signal.reshape(-1, channels)
+    return rate, signal
+
+
+_DECODERS = {
+    "av": decode_audio_av,
+    "pipe": decode_audio_pipe,
+    "tempfile": decode_audio_tempfile,
+}
+
+
+def decode_audio(video_path, backend="auto", rate=None):
+    """Decodes the audio stream of a video file.
+
+    Parameters
+    ----------
+    video_path : str
+        The path of the video file.
+    backend : str
+        One of :any:`AUDIO_BACKENDS`.
+    rate : int, optional
+        If given, the decoder resamples the audio to this rate.
+
+    Returns
+    -------
+    rate : int
+        The sampling rate of the audio.
+    signal : numpy.ndarray
+        The decoded ``int16`` samples. Multi-channel audio has the shape
+        ``(n_samples, n_channels)``.
+    """
+    if backend not in AUDIO_BACKENDS:
+        raise ValueError(
+            "Unknown audio backend {!r}. Expected one of {}.".format(
+                backend, AUDIO_BACKENDS
+            )
+        )
+    if backend != "auto":
+        return _DECODERS[backend](video_path, rate=rate)
+
+    decoder = decode_audio_av if _has_pyav() else decode_audio_pipe
+    try:
+        return decoder(video_path, rate=rate)
+    except Exception:
+        logger.warning(
+            "Failed to decode %s in memory, falling back to a temporary file.",
+            video_path,
+            exc_info=True,
+        )
+        return decode_audio_tempfile(video_path, rate=rate)
+
+
+def read_audio(
+    video_path,
+    new_rate=None,
+    backend="auto",
+    resample_method="polyphase",
+    dtype=None,
+):
+    """Reads the audio of a video file and optionally resamples it.
+
+    Parameters
+    ----------
+    video_path : str
+        The path of the video file.
+    new_rate : int, optional
+        If given, the audio is resampled to this rate.
+    backend : str
+        One of :any:`AUDIO_BACKENDS`.
+    resample_method : str
+        One of :any:`bob.db.swan.resample.RESAMPLE_METHODS`.
+    dtype : str, optional
+        One of :any:`AUDIO_DTYPES`. By default, the signal is ``int16`` if it
+        is not resampled and ``float64`` otherwise.
+
+    Returns
+    -------
+    rate : int
+    signal : numpy.ndarray
+    """
+    if dtype is not None:
+        _check_dtype(dtype)
+    decoder_rate = new_rate if resample_method == "decoder" else None
+    rate, signal = decode_audio(video_path, backend=backend, rate=decoder_rate)
+    return convert_audio(rate, signal, new_rate, resample_method, dtype)
+
+
+def convert_audio(rate, signal, new_rate=None, resample_method="polyphase", dtype=None):
+    """Resamples and converts a decoded signal as :any:`read_audio` does.
+
+    Parameters
+    ----------
+    rate : int
+        The sampling rate of the signal.
+    signal : numpy.ndarray
+        The decoded ``int16`` signal.
+    new_rate, resample_method, dtype
+        See :any:`read_audio`.
+
+    Returns
+    -------
+    rate : int
+    signal : numpy.ndarray
+    """
+    if new_rate is not None and rate != new_rate:
+        signal = resample(
+            signal, rate, new_rate, resample_method, dtype=_working_dtype(dtype)
+        )
+        rate = new_rate
+    if dtype is not None:
+        signal = cast_audio(signal, dtype)
+    return rate, signal
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise RuntimeError("ffmpeg did not produce a valid wav stream.")
+    return data
+
+
+def _read_wav_header(stream):
+    """Reads the header of a wav stream up to its samples.
+
+    Returns
+    -------
+    rate : int
+    channels : int
+    """
+    header = _read_exactly(stream, 12)
+    if header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+        raise RuntimeError("ffmpeg did not produce a valid wav stream.")
+    rate, channels = None, None
+    while True:
+        chunk_id, size = struct.unpack("<4sI", _read_exactly(stream, 8))
+        if chunk_id == b"data":
+            break
+        data = _read_exactly(stream, size + (size & 1))
+        if chunk_id == b"fmt ":
+            _, channels, rate, _, _, bits = struct.unpack("<HHIIHH", data[:16])
+            if bits != 16:
+                raise RuntimeError("Expected 16 bit samples, got %d bits." % bits)
+    if rate is None:
+        raise RuntimeError("The wav stream does not contain a format chunk.")
+    return rate, channels
+
+
+def _stream_pipe(video_path, rate=None, chunk_size=4096):
+    cmd = ["ffmpeg", "-v", "error", "-i", video_path, "-vn", "-acodec", "pcm_s16le"]
+    cmd += _rate_args(rate) + ["-f", "wav", "-"]
+    errors = tempfile.TemporaryFile()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+    try:
+        rate, channels = _read_wav_header(process.stdout)
+    except BaseException:
+        process.kill()
+        process.wait()
+        errors.close()
+        raise
+
+    def chunks():
+        try:
+            frame_size = 2 * channels
+            rest = b""
+            while True:
+                data = process.stdout.read(chunk_size * frame_size)
+                if not data:
+                    break
+                data = rest + data
+                end = len(data) - len(data) % frame_size
+                rest = data[end:]
+                signal = np.frombuffer(data[:end], dtype="<i2").astype(np.int16)
+                yield signal.reshape(-1, channels) if channels > 1 else signal
+            if process.wait() != 0:
+                errors.seek(0)
+                raise RuntimeError(
+                    "ffmpeg failed to decode {}: {}".format(
+                        video_path, errors.read().decode(errors="replace").strip()
+                    )
+                )
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+            errors.close()
+
+    return rate, chunks()
+
+
+def _stream_av(video_path, rate=None, chunk_size=None):
+    import av
+
+    container = av.open(video_path)
+    try:
+        stream = container.streams.audio[0]
+        rate = rate or stream.codec_context.sample_rate
+        channels = len(stream.codec_context.layout.channels)
+        resampler = av.AudioResampler(
+            format="s16", layout=stream.codec_context.layout.name, rate=rate
+        )
+    except BaseException:
+        container.close()
+        raise
+
+    def chunks():
+        with container:
+            for frame in container.decode(stream):
+                for out in _resampled_frames(resampler, frame):
+                    signal = out.to_ndarray().reshape(-1)
+                    yield signal.reshape(-1, channels) if channels > 1 else signal
+            for out in _resampled_frames(resampler, None):
+                signal = out.to_ndarray().reshape(-1)
+                yield signal.reshape(-1, channels) if channels > 1 else signal
+
+    return rate, chunks()
+
+
+def _stream_tempfile(video_path, rate=None, chunk_size=4096):
+    rate, signal = decode_audio_tempfile(video_path, rate=rate)
+    return rate, (signal[i : i + chunk_size] for i in range(0, len(signal), chunk_size))
+
+
+_STREAMS = {
+    "av": _stream_av,
+    "pipe": _stream_pipe,
+    "tempfile": _stream_tempfile,
+}
+
+
+def open_audio_stream(video_path, backend="auto", rate=None, chunk_size=4096):
+    """Starts decoding the audio stream of a video file.
+
+    Parameters
+    ----------
+    video_path : str
+        The path of the video file.
+    backend : str
+        One of :any:`AUDIO_BACKENDS`. The ``"tempfile"`` backend decodes the
+        whole signal before the first chunk is returned.
+    rate : int, optional
+        If given, the decoder resamples the audio to this rate.
+    chunk_size : int
+        The number of samples that are read at once from ffmpeg.
+
+    Returns
+    -------
+    rate : int
+        The sampling rate of the audio.
+    chunks : generator
+        Yields the decoded ``int16`` samples in chunks of varying size.
+        Closing the generator stops the decoder.
+    """
+    if backend not in AUDIO_BACKENDS:
+        raise ValueError(
+            "Unknown audio backend {!r}. Expected one of {}.".format(
+                backend, AUDIO_BACKENDS
+            )
+        )
+    if backend == "auto":
+        backend = "av" if _has_pyav() else "pipe"
+    return _STREAMS[backend](video_path, rate=rate, chunk_size=chunk_size)
+
+
+def _check_dtype(dtype):
+    if dtype not in AUDIO_DTYPES:
+        raise ValueError(
+            "Unknown audio type {!r}. Expected one of {}.".format(dtype, AUDIO_DTYPES)
+        )
+
+
+def _working_dtype(dtype):
+    # the floating point type used to resample audio of a type
+    return "float64" if dtype in (None, "float64") else "float32"
+
+
+def cast_audio(signal, dtype):
+    """Converts a signal to one of :any:`AUDIO_DTYPES`.
+
+    Floating point samples are rounded and clipped when they are converted to
+    integers. The signal is not copied if it has the type already.
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer) and signal.dtype != dtype:
+        info = np.iinfo(dtype)
+        signal = np.rint(signal).clip(info.min, info.max)
+    return signal.astype(dtype, copy=False)
+
+
+def audio_blocks(chunks, block_size, hop_size=None, dtype="float32", pad=False):
+    """Cuts a signal that arrives in chunks into (overlapping) blocks.
+
+    Parameters
+    ----------
+    chunks : iterable of numpy.ndarray
+        The consecutive parts of the signal.
+    block_size : int
+        The number of samples of each block.
+    hop_size : int, optional
+        The number of samples between the starts of two blocks. Defaults to
+        ``block_size``.
+    dtype : str
+        One of :any:`AUDIO_DTYPES`.
+    pad : bool
+        If ``True``, the last incomplete block is padded with zeros.
+        Otherwise, it is dropped.
+
+    Yields
+    ------
+    numpy.ndarray
+        The blocks with the shape ``(block_size,)`` or
+        ``(block_size, n_channels)``.
+    """
+    _check_dtype(dtype)
+    hop_size = hop_size or block_size
+    buffer, start, skip = None, 0, 0
+    for chunk in chunks:
+        if skip:
+            # the next block starts after the end of the previous chunks
+            chunk, skip = chunk[skip:], max(0, skip - len(chunk))
+        buffer = chunk if buffer is None else np.concatenate([buffer, chunk])
+        while start + block_size <= len(buffer):
+            yield cast_audio(buffer[start : start + block_size], dtype)
+            start += hop_size
+        skip += max(0, start - len(buffer))
+        buffer, start = buffer[start:], 0
+    if pad and buffer is not None and len(buffer):
+        block = np.zeros((block_size,) + buffer.shape[1:], buffer.dtype)
+        block[: len(buffer)] = buffer
+        yield cast_audio(block, dtype)
+
+
+def stream_audio(
+    video_path,
+    block_duration=0.02,
+    hop_duration=None,
+    new_rate=None,
+    backend="auto",
+    resample_method="polyphase",
+    dtype="float32",
+    pad=False,
+):
+    """Yields the audio of a video file in fixed-size blocks while decoding.
+
+    The signal is decoded, resampled and cut into blocks incrementally, so the
+    first blocks are available before the decoding finishes and the memory
+    usage does not depend on the length of the recording.
+
+    Parameters
+    ----------
+    video_path : str
+        The path of the video file.
+    block_duration : float
+        The duration of each block in seconds, e.g. 20 ms.
+    hop_duration : float, optional
+        The time between the starts of two blocks in seconds. Defaults to
+        ``block_duration``, i.e. blocks do not overlap.
+    new_rate : int, optional
+        If given, the audio is resampled to this rate.
+    backend : str
+        One of :any:`AUDIO_BACKENDS`.
+    resample_method : str
+        ``"polyphase"`` resamples the blocks with a
+        :any:`bob.db.swan.resample.StreamResampler`, which gives the same
+        signal as :any:`read_audio`, and ``"decoder"`` lets the decoder
+        resample. ``"fft"`` needs the whole signal and is not supported.
+    dtype : str
+        One of :any:`AUDIO_DTYPES`.
+    pad : bool
+        If ``True``, the last incomplete block is padded with zeros.
+
+    Returns
+    -------
+    rate : int
+        The sampling rate of the blocks.
+    blocks : generator
+        Yields the blocks, see :any:`audio_blocks`.
+    """
+    if resample_method == "fft" and new_rate is not None:
+        raise ValueError("fft resampling needs the whole signal, use read_audio.")
+    decoder_rate = new_rate if resample_method == "decoder" else None
+    rate, chunks = open_audio_stream(video_path, backend=backend, rate=decoder_rate)
+    if new_rate is not None and rate != new_rate:
+        resampler = StreamResampler(rate, new_rate, dtype=_working_dtype(dtype))
+
+        def resampled(chunks=chunks):
+            try:
+                for chunk in chunks:
+                    yield resampler.process(chunk)
+                yield resampler.flush()
+            finally:
+                chunks.close()
+
+        rate, chunks = new_rate, resampled()
+    block_size = int(round(block_duration * rate))
+    hop_size = int(round(hop_duration * rate)) if hop_duration else None
+
+    def blocks(chunks=chunks):
+        try:
+            yield from audio_blocks(chunks, block_size, hop_size, dtype, pad)
+        finally:
+            # stops the decoder if the blocks are not consumed until the end
+            chunks.close()
+
+    return rate, blocks()
@@ -0,0 +1,224 @@
+"""Joint decoding of the frames and the audio of SWAN videos.
+
+The ``_p_2.mp4`` recordings of SWAN (e.g. of the ``licit_p4_face`` protocol
+and the talking-face folds of ``pad_p1_paf5`` and ``pad_p1_paf6``) carry both
+the face and the voice of the subject. Loading them with
+:any:`bob.db.swan.common.SwanVideoFile.load` and
+:any:`bob.db.swan.audio.read_audio` opens and demuxes each container twice.
+:any:`load_audio_video` demuxes the container once with PyAV_ and returns the
+frames and the audio together with the times of the frames, so that the audio
+of each frame can be looked up:
+
+.. code-block:: python
+
+    sample = load_audio_video(path, transform=rotate, new_rate=16000)
+    audio = sample.frame_audio(10)  # the audio while frame 10 is shown
+
+.. _PyAV: https://pyav.org
+"""
+
+import numpy as np
+from .audio import _check_dtype, _resampled_frames, convert_audio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AudioVideo(object):
+    """The time-aligned frames and audio of a video.
+
+    Times are in seconds on the clock of the container.
+
+    Parameters
+    ----------
+    frames : numpy.ndarray
+        The decoded frames.
+    frame_indices : numpy.ndarray
+        The index of each frame in the video.
+    frame_times : numpy.ndarray
+        The presentation time of each frame.
+    rate : int
+        The sampling rate of the audio.
+    audio : numpy.ndarray
+        The audio signal with the shape ``(n_samples,)`` or
+        ``(n_samples, n_channels)``.
+    audio_start : float
+        The time of the first audio sample.
+    """
+
+    def __init__(
+        self, frames, frame_indices, frame_times, rate, audio, audio_start, **kwargs
+    ):
+        super(AudioVideo, self).__init__(**kwargs)
+        self.frames = frames
+        self.frame_indices = frame_indices
+        self.frame_times = frame_times
+        self.rate = rate
+        self.audio = audio
+        self.audio_start = audio_start
+
+    def __repr__(self):
+        return "AudioVideo({} frames, {} samples at {} Hz)".format(
+            len(self.frames), len(self.audio), self.rate
+        )
+
+    def sample_index(self, time):
+        """Returns the index of the audio sample at a time (or times).
+
+        The index is not clipped to the length of the audio.
+        """
+        return np.rint((np.asarray(time) - self.audio_start) * self.rate).astype(int)
+
+    @property
+    def frame_samples(self):
+        """The index of the audio sample at each frame."""
+        return self.sample_index(self.frame_times)
+
+    def frame_audio(self, position, duration=None):
+        """Returns the audio of a frame.
+
+        Parameters
+        ----------
+        position : int
+            The position of the frame in :py:attr:`frames`.
+        duration : float, optional
+            The duration of the audio in seconds. By default, the audio lasts
+            until the next frame (or one frame period for the last frame).
+
+        Returns
+        -------
+        numpy.ndarray
+            The audio samples, fewer at the start or the end of the audio.
+        """
+        start = self.frame_times[position]
+        if duration is None:
+            if position + 1 < len(self.frame_times):
+                duration = self.frame_times[position + 1] - start
+            elif len(self.frame_times) > 1:
+                duration = start - self.frame_times[position - 1]
+            else:
+                duration = 0.0
+        first, last = self.sample_index([start, start + duration])
+        return self.audio[max(first, 0) : max(last, 0)]
+
+
+def _video_frame(frame):
+    # the same layout as the frames of bob.io.video, i.e. (3, height, width)
+    return frame.to_ndarray(format="rgb24").transpose(2, 0, 1)
+
+
+def load_audio_video(
+    video_path,
+    indices=None,
+    transform=None,
+    frame_format=None,
+    new_rate=None,
+    resample_method="polyphase",
+    dtype=None,
+):
+    """Decodes the frames and the audio of a video in one pass using PyAV.
+
+    Parameters
+    ----------
+    video_path : str
+        The path of the video file.
+    indices : [int], optional
+        If given, only these frames are returned. The audio is always decoded
+        completely.
+    transform : callable, optional
+        A function that is applied on each frame, e.g.
+        :any:`bob.db.swan.video.rotate`.
+    frame_format : :any:`bob.db.swan.video.FrameFormat`, optional
+        If given, it is applied on each frame after ``transform``.
+    new_rate, resample_method, dtype
+        See :any:`bob.db.swan.audio.read_audio`. With the ``"decoder"``
+        method, the audio is resampled by PyAV.
+
+    Returns
+    -------
+    :any:`AudioVideo`
+        The frames, their times and the audio. The frames are copied once
+        into a C-contiguous array.
+    """
+    import av
+
+    if dtype is not None:
+        _check_dtype(dtype)
+    transform = transform or (lambda data: data)
+    selected = None if indices is None else set(indices)
+    last = None if indices is None else max(selected, default=-1)
+
+    data, count, frame_indices, frame_times, chunks = None, 0, [], [], []
+    audio_start = None
+    with av.open(video_path) as container:
+        video_stream = container.streams.video[0]
+        video_stream.thread_type = "AUTO"
+        streams = [video_stream]
+        if container.streams.audio:
+            audio_stream = container.streams.audio[0]
+            streams.append(audio_stream)
+            rate = audio_stream.codec_context.sample_rate
+            channels = len(audio_stream.codec_context.layout.channels)
+            if resample_method == "decoder" and new_rate is not None:
+                rate = new_rate
+            resampler = av.AudioResampler(
+                format="s16", layout=audio_stream.codec_context.layout.name, rate=rate
+            )
+        else:
+            logger.warning("%s has no audio stream", video_path)
+            rate, channels, resampler = new_rate, 1, None
+        frame_period = 1.0 / float(video_stream.average_rate or 30)
+        capacity = len(selected) if indices is not None else video_stream.frames
+
+        index = 0
+        for frame in container.decode(*streams):
+            if isinstance(frame, av.AudioFrame):
+                if audio_start is None:
+                    audio_start = frame.time or 0.0
+                for out in _resampled_frames(resampler, frame):
+                    chunks.append(out.to_ndarray().reshape(-1))
+                continue
+            if selected is None or index in selected:
+                image = transform(_video_frame(frame))
+                if frame_format is not None:
+                    image = frame_format(image)
+                if data is None:
+                    shape = (max(capacity, 1),) + image.shape
+                    data = np.empty(shape, image.dtype)
+                elif count == len(data):
+                    # the header announced fewer frames than the video has
+                    data = np.concatenate([data, np.empty_like(data)])
+                data[count] = image
+                count += 1
+                frame_indices.append(index)
+                time = frame.time
+                frame_times.append(index * frame_period if time is None else time)
+            index += 1
+        if resampler is not None:
+            for out in _resampled_frames(resampler, None):
+                chunks.append(out.to_ndarray().reshape(-1))
+
+    if last is not None and last >= index:
+        logger.warning(
+            "%s has %d frames, frames up to %d were selected", video_path, index, last
+        )
+    frames = np.zeros((0,), dtype="uint8") if data is None else data[:count]
+    signal = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+    signal = signal.astype(np.int16, copy=False)
+    if channels > 1:
+        signal = signal.reshape(-1, channels)
+    rate, signal = convert_audio(rate, signal, new_rate, resample_method, dtype)
+    logger.debug(
+        "Decoded %d frames and %d audio samples of %s in one pass",
+        count,
+        len(signal),
+        video_path,
+    )
+    return AudioVideo(
+        frames,
+        np.asarray(frame_indices, dtype=int),
+        np.asarray(frame_times, dtype=float),
+        rate,
+        signal,
+        0.0 if audio_start is None else audio_start,
+    )
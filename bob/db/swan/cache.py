@@ -0,0 +1,459 @@
+"""A persistent on-disk cache for the decoded audio of SWAN videos.
+
+Decoded (and resampled) signals are stored as ``.npz`` files under a cache
+directory which can be shared between processes and machines. Entries are
+keyed by the source path, its size and modification time, the decoding and
+resampling options, and :any:`bob.db.swan.audio.AUDIO_DECODER_VERSION`. Files are written
+to a temporary file first and atomically moved in place so that concurrent
+writers never expose partial entries. When the cache grows beyond its maximum
+size, the least recently used entries are removed. The size of the cache is
+shared by all processes through a file in the cache directory.
+
+To enable the cache for the audio configurations of this package, run:
+
+.. code-block:: sh
+
+    $ bob config set bob.db.swan.audio_cache_dir /path/to/cache
+    $ bob config set bob.db.swan.audio_cache_size 50000000000  # in bytes
+
+The cache can be filled for a whole protocol in parallel beforehand. The
+options must match the ones of the experiments (see ``config_audio.py``) for
+the entries to be found, including the database directory:
+
+.. code-block:: sh
+
+    $ bob_dbmanage.py swan extract-audio --protocol pad_p2_voice_f1 --jobs 8
+"""
+
+from collections import OrderedDict
+from multiprocessing import get_context
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from bob.extension import rc
+from .audio import AUDIO_BACKENDS, AUDIO_DECODER_VERSION, AUDIO_DTYPES, read_audio
+from .resample import RESAMPLE_METHODS
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AudioCache(object):
+    """A least-recently-used on-disk cache of decoded audio.
+
+    Parameters
+    ----------
+    directory : str
+        The directory where the cache is stored.
+    max_size : int, optional
+        The maximum size of the cache in bytes. If ``None``, the cache grows
+        without limit.
+    """
+
+    def __init__(
+        self, directory, max_size=rc["bob.db.swan.audio_cache_size"], **kwargs
+    ):
+        super(AudioCache, self).__init__(**kwargs)
+        self.directory = directory
+        self.max_size = None if max_size is None else int(max_size)
+
+    def __repr__(self):
+        return "AudioCache({!r}, max_size={!r})".format(self.directory, self.max_size)
+
+    def key(self, video_path, **options):
+        """Returns the cache key of a video file decoded with some options."""
+        stat = os.stat(video_path)
+        payload = json.dumps(
+            [
+                os.path.abspath(video_path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                options,
+                AUDIO_DECODER_VERSION,
+            ],
+            sort_keys=True,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def audio_key(
+        self,
+        video_path,
+        new_rate=None,
+        resample_method="polyphase",
+        dtype=None,
+        backend="auto",
+    ):
+        """Returns the key of the audio of a video file as read by
+        :any:`read_audio`."""
+        return self.key(
+            video_path,
+            new_rate=new_rate,
+            resample_method=resample_method,
+            dtype=dtype,
+            backend=backend,
+        )
+
+    def path(self, key):
+        """Returns the path of a cache entry."""
+        return os.path.join(self.directory, key[:2], key + ".npz")
+
+    def __contains__(self, key):
+        return os.path.isfile(self.path(key))
+
+    def get(self, key):
+        """Returns the ``(rate, signal)`` of an entry or ``None`` on a miss."""
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                rate, signal = int(data["rate"]), data["signal"]
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.warning("Ignoring the corrupt cache entry %s", path, exc_info=True)
+            return None
+        try:
+            # mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            # e.g. a read-only cache shared by other users
+            logger.debug("Could not mark %s as recently used", path, exc_info=True)
+        return rate, signal
+
+    def put(self, key, rate, signal):
+        """Stores an entry in the cache."""
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=folder, suffix=".tmp", delete=False) as f:
+            try:
+                np.savez(f, rate=rate, signal=signal)
+            except BaseException:
+                os.remove(f.name)
+                raise
+        os.replace(f.name, path)
+        if self.max_size is not None:
+            self._add_size(os.path.getsize(path))
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".npz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield stat.st_mtime, stat.st_size, path
+
+    def disk_usage(self):
+        """Returns the total size of the cache entries in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _size_file(self):
+        return os.path.join(self.directory, ".size")
+
+    def _add_size(self, size):
+        # the size of the cache is counted in a file that all processes update
+        # under the lock, so that the writes of others are counted too
+        with self._lock():
+            try:
+                with open(self._size_file()) as f:
+                    total = int(f.read()) + size
+            except (FileNotFoundError, ValueError):
+                total = self.disk_usage()
+            if total > self.max_size:
+                total = self._evict()
+            self._write_size(total)
+
+    def _write_size(self, size):
+        with open(self._size_file(), "w") as f:
+            f.write(str(size))
+
+    @contextlib.contextmanager
+    def _lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in
+        :py:attr:`max_size`.
+
+        Returns
+        -------
+        int
+            The size of the cache after eviction.
+        """
+        with self._lock():
+            size = self._evict()
+            self._write_size(size)
+        return size
+
+    def _evict(self):
+        # the caller holds the lock
+        entries = sorted(self._entries())
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if self.max_size is None or size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+            logger.debug("Evicted %s from the audio cache", path)
+        return size
+
+    def read_audio(
+        self,
+        video_path,
+        new_rate=None,
+        backend="auto",
+        resample_method="polyphase",
+        dtype=None,
+    ):
+        """Same as :any:`bob.db.swan.audio.read_audio` but uses the cache.
+
+        Signals are cached in the requested ``dtype``, so ``int16`` entries
+        take a quarter of the space of ``float64`` entries.
+        """
+        key = self.audio_key(video_path, new_rate, resample_method, dtype, backend)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        rate, signal = read_audio(
+            video_path,
+            new_rate=new_rate,
+            backend=backend,
+            resample_method=resample_method,
+            dtype=dtype,
+        )
+        try:
+            self.put(key, rate, signal)
+        except OSError:
+            logger.warning("Could not write to the audio cache", exc_info=True)
+        return rate, signal
+
+
+def _extract_task(task):
+    cache, video_path, options, force = task
+    start = time.time()
+    entry = dict(path=video_path, duration=0.0, size=0, cached=False, error=None)
+    try:
+        key = cache.audio_key(
+            video_path,
+            new_rate=options["new_rate"],
+            resample_method=options["resample_method"],
+            dtype=options["dtype"],
+            backend=options["backend"],
+        )
+        if not force and key in cache:
+            entry["cached"] = True
+        else:
+            rate, signal = read_audio(video_path, **options)
+            cache.put(key, rate, signal)
+            entry["duration"] = len(signal) / float(rate)
+            entry["size"] = signal.nbytes
+    except Exception as e:
+        logger.debug("Failed to extract the audio of %s", video_path, exc_info=True)
+        entry["error"] = "{}: {}".format(type(e).__name__, e)
+    entry["seconds"] = time.time() - start
+    return entry
+
+
+def extract_audio(
+    video_paths,
+    cache,
+    new_rate=None,
+    backend="auto",
+    resample_method="polyphase",
+    dtype=None,
+    workers=1,
+    force=False,
+    progress=None,
+):
+    """Decodes and resamples the audio of many videos into a cache in
+    parallel.
+
+    Parameters
+    ----------
+    video_paths : iterable of str
+        The paths of the video files.
+    cache : :any:`AudioCache`
+        The cache to fill. Its entries are read back by
+        :any:`AudioCache.read_audio` with the same options.
+    new_rate, backend, resample_method, dtype
+        See :any:`bob.db.swan.audio.read_audio`.
+    workers : int
+        The number of decoding processes.
+    force : bool
+        If ``True``, videos that are in the cache already are decoded again.
+    progress : file, optional
+        If given, a progress line is written to this file after each video.
+
+    Returns
+    -------
+    dict
+        The number of ``extracted``, ``skipped`` (already cached) and
+        ``failed`` videos, the ``duration`` of the extracted audio and the
+        elapsed wall time (``seconds``), both in seconds, and the ``size`` of
+        the extracted signals in bytes.
+    """
+    options = dict(
+        new_rate=new_rate, backend=backend, resample_method=resample_method, dtype=dtype
+    )
+    tasks = [
+        (cache, video_path, options, force)
+        for video_path in OrderedDict.fromkeys(video_paths)
+    ]
+    stats = dict(extracted=0, skipped=0, failed=0, duration=0.0, seconds=0.0, size=0)
+    if not tasks:
+        return stats
+    logger.info("Extracting the audio of %d videos to %s", len(tasks), cache.directory)
+    start = time.time()
+    if workers > 1:
+        pool = get_context().Pool(min(workers, len(tasks)))
+        results = pool.imap_unordered(_extract_task, tasks)
+    else:
+        pool = None
+        results = map(_extract_task, tasks)
+
+    try:
+        for done, entry in enumerate(results, 1):
+            if entry["error"] is not None:
+                stats["failed"] += 1
+                logger.error(
+                    "Failed to extract the audio of %s: %s",
+                    entry["path"],
+                    entry["error"],
+                )
+            elif entry["cached"]:
+                stats["skipped"] += 1
+            else:
+                stats["extracted"] += 1
+                stats["duration"] += entry["duration"]
+                stats["size"] += entry["size"]
+            stats["seconds"] = time.time() - start
+            if progress is not None:
+                progress.write(
+                    "[{}/{}] {:.0f}s of audio in {:.0f}s ({:.1f}x real time, "
+                    "{:.1f} MB), {} cached, {} failed\n".format(
+                        done,
+                        len(tasks),
+                        stats["duration"],
+                        stats["seconds"],
+                        stats["duration"] / max(stats["seconds"], 1e-9),
+                        stats["size"] / 2**20,
+                        stats["skipped"],
+                        stats["failed"],
+                    )
+                )
+                progress.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    if cache.max_size is not None and stats["size"] > cache.max_size:
+        logger.warning(
+            "The extracted audio (%d bytes) does not fit in the cache (%d bytes), "
+            "the least recently used entries were evicted",
+            stats["size"],
+            cache.max_size,
+        )
+    return stats
+
+
+def extract_audio_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "extract-audio",
+        help="Decodes the audio of a protocol into the audio cache in parallel.",
+    )
+    parser.add_argument(
+        "-p", "--protocol", required=True, help="the protocol to extract"
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        default=rc["bob.db.swan.audio_cache_dir"],
+        required=rc["bob.db.swan.audio_cache_dir"] is None,
+        help="the directory of the audio cache [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=rc["bob.db.swan.directory"],
+        required=rc["bob.db.swan.directory"] is None,
+        help="the root directory of the SWAN database [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-r",
+        "--new-rate",
+        type=int,
+        default=16000,
+        help="the sampling rate of the audio [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--backend",
+        default="auto",
+        choices=AUDIO_BACKENDS,
+        help="the audio decoder [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--resample-method",
+        default="polyphase",
+        choices=RESAMPLE_METHODS,
+        help="the resampling method [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--dtype",
+        default="float64",
+        choices=AUDIO_DTYPES,
+        help="the type of the audio [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="extract cached videos again"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="the number of parallel processes"
+    )
+    parser.set_defaults(func=_extract_audio)  # action
+
+
+def _extract_audio(args):
+    from .driver import database_for_protocol
+
+    db = database_for_protocol(
+        args.protocol,
+        original_directory=args.directory,
+        new_rate=args.new_rate,
+        audio_backend=args.backend,
+        resample_method=args.resample_method,
+        audio_cache=args.cache,
+        audio_dtype=args.dtype,
+    )
+    files = db.objects(protocol=args.protocol)
+    stats = db.extract_audio(
+        files, workers=args.jobs, force=args.force, progress=sys.stderr
+    )
+    print(
+        "Extracted the audio of {} videos ({:.1f} hours, {:.1f}x real time) to {}, "
+        "skipped {} and {} failed".format(
+            stats["extracted"],
+            stats["duration"] / 3600,
+            stats["duration"] / max(stats["seconds"], 1e-9),
+            args.cache,
+            stats["skipped"],
+            stats["failed"],
+        )
+    )
+    return 1 if stats["failed"] else 0
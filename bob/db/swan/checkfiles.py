@@ -0,0 +1,179 @@
+"""Checks that the files of the protocols are available.
+
+Calling :any:`os.path.exists` on each of the tens of thousands of SWAN files
+one after another is slow on network file systems. :any:`check_files` groups
+the files by directory, lists each directory once with :any:`os.scandir` and
+checks several directories concurrently:
+
+.. code-block:: sh
+
+    $ bob_dbmanage.py swan checkfiles --jobs 32 --size --readable \\
+        --report report.csv
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+import csv
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPORT_FIELDS = ("path", "exists", "size", "readable", "error")
+"The fields of each entry of the report."
+
+# the first bytes of the containers used in SWAN
+_SIGNATURES = {
+    ".png": ((0, b"\x89PNG\r\n\x1a\n"),),
+    ".wav": ((0, b"RIFF"), (8, b"WAVE")),
+}
+_MP4_BOXES = (b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide")
+
+
+def check_header(path):
+    """Checks that a file can be opened and starts like its container.
+
+    Parameters
+    ----------
+    path : str
+        The path of an ``.mp4``, ``.png`` or ``.wav`` file. Only the
+        readability of the first bytes is checked for other files.
+
+    Returns
+    -------
+    str or None
+        ``None`` if the header is valid, otherwise the reason why it is not.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        with open(path, "rb") as f:
+            header = f.read(16)
+    except OSError as e:
+        return str(e)
+    if not header:
+        return "empty file"
+    if extension in (".mp4", ".mov"):
+        if header[4:8] not in _MP4_BOXES:
+            return "not an MP4 container"
+        return None
+    for offset, signature in _SIGNATURES.get(extension, ()):
+        if header[offset : offset + len(signature)] != signature:
+            return "not a {} file".format(extension[1:].upper())
+    return None
+
+
+def _check_directory(
+    directory, files, check_size=False, check_readable=False, expected_sizes=None
+):
+    results = []
+    try:
+        with os.scandir(directory) as it:
+            entries = {entry.name: entry for entry in it}
+        error = None
+    except FileNotFoundError:
+        entries, error = {}, "not found"
+    except OSError as e:
+        entries, error = {}, str(e)
+    for path, full_path in files:
+        entry = entries.get(os.path.basename(full_path))
+        result = dict(path=path, exists=entry is not None, size=None, readable=None)
+        result["error"] = None if entry is not None else error or "not found"
+        if entry is not None and (check_size or check_readable):
+            try:
+                result["size"] = entry.stat().st_size
+            except OSError as e:
+                result["error"] = str(e)
+        if check_size and result["size"] is not None:
+            expected = (expected_sizes or {}).get(path)
+            if result["size"] == 0:
+                result["error"] = "empty file"
+            elif expected is not None and expected != result["size"]:
+                result["error"] = "size is {} instead of {}".format(
+                    result["size"], expected
+                )
+        if check_readable and entry is not None:
+            reason = check_header(full_path)
+            result["readable"] = reason is None
+            result["error"] = result["error"] or reason
+        results.append(result)
+    return results
+
+
+def check_files(
+    paths,
+    directory,
+    extension="",
+    jobs=16,
+    check_size=False,
+    check_readable=False,
+    expected_sizes=None,
+):
+    """Checks the existence (and optionally the size and header) of files.
+
+    Parameters
+    ----------
+    paths : iterable of str
+        The paths relative to ``directory``. Duplicates are checked once.
+    directory : str
+        The root directory of the database.
+    extension : str
+        Appended to each path.
+    jobs : int
+        The number of directories that are checked concurrently.
+    check_size : bool
+        If ``True``, files must not be empty and must have the size in
+        ``expected_sizes``, when known.
+    check_readable : bool
+        If ``True``, the header of each file is read, see
+        :any:`check_header`.
+    expected_sizes : dict, optional
+        The expected size of each path, e.g. from the metadata index.
+
+    Returns
+    -------
+    [dict]
+        One entry with the :any:`REPORT_FIELDS` for each file, sorted by
+        path. ``error`` is ``None`` for good files.
+    """
+    folders = defaultdict(list)
+    for path in set(paths):
+        full_path = os.path.join(directory, path + extension)
+        folders[os.path.dirname(full_path)].append((path, full_path))
+    logger.info(
+        "Checking %d files in %d directories",
+        sum(map(len, folders.values())),
+        len(folders),
+    )
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [
+            executor.submit(
+                _check_directory,
+                folder,
+                files,
+                check_size,
+                check_readable,
+                expected_sizes,
+            )
+            for folder, files in folders.items()
+        ]
+        results = [result for future in futures for result in future.result()]
+    results.sort(key=lambda result: result["path"])
+    return results
+
+
+def write_report(results, path):
+    """Writes the results of :any:`check_files` to a ``.json`` or ``.csv``
+    file, depending on the extension of ``path``."""
+    if path.endswith(".csv"):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        bad = [result for result in results if result["error"]]
+        with open(path, "w") as f:
+            json.dump(
+                dict(total=len(results), bad=len(bad), files=results), f, indent=1
+            )
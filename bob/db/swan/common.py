@@ -1,15 +1,26 @@
-import scipy.io.wavfile
-import scipy.signal
 from bob.db.base import read_annotation_file
-from bob.io.base import load
 from bob.io.video import reader
 from bob.bio.video.utils import FrameSelector
 from bob.bio.video.database import VideoBioFile
-import numpy as np
-import subprocess
-import tempfile
 from os.path import split, splitext
 from . import SWAN_FRAME_SHAPE
+from .audio import audio_blocks, cast_audio, read_audio, stream_audio
+from .audiovisual import load_audio_video
+from .cache import AudioCache, extract_audio
+from .retry import DEFAULT_RETRY_POLICY
+from .video import (
+    batch_frames,
+    format_video,
+    load_video,
+    rotate,
+    selected_frame_indices,
+    stream_frames,
+    upright_frames,
+)
+from .metadata import DEFAULT_METADATA_INDEX
+from .framestore import FrameStore
+from .protocol_index import DEFAULT_PROTOCOL_INDEX
+from .annotations import DEFAULT_ANNOTATION_CACHE, AnnotationPack
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,31 +32,33 @@ DEVICE_MAPPING = {"p": "iPhone", "t": "iPad"}
 MODALITY_MAPPING = {"1": "face", "2": "voice", "3": "eye", "4": "finger"}
 
 
-def read_audio(video_path, new_rate=None):
-    with tempfile.NamedTemporaryFile(suffix=".wav") as f:
-        cmd = ["ffmpeg", "-v", "quiet", "-i", video_path, "-y", "-vn", f.name]
-        subprocess.call(cmd)
-        f.seek(0)
-        rate, signal = scipy.io.wavfile.read(f.name)
-    if new_rate is not None and rate != new_rate:
-        logger.debug("Resampling audio from %d to %d", rate, new_rate)
-        samps = round(len(signal) * new_rate / rate)  # Number of samples to resample
-        signal, rate = scipy.signal.resample(signal, samps), new_rate
-    return rate, signal
-
-
 class Client(object):
     """A base class for SWAN clients"""
 
+    __slots__ = ("institute", "id_in_site", "gender", "id")
+
     def __init__(self, site, id_in_site, gender, **kwargs):
         super(Client, self).__init__(**kwargs)
         self.institute = site
         self.id_in_site = id_in_site
         self.gender = gender
+        self.id = "{}_{}".format(self.institute, self.id_in_site)
 
-    @property
-    def id(self):
-        return "{}_{}".format(self.institute, self.id_in_site)
+
+_CLIENTS = {}
+
+
+def get_client(site, id_in_site, gender):
+    """Returns the shared :any:`Client` object of a SWAN client.
+
+    Clients are interned so that all files of a client refer to the same
+    object.
+    """
+    key = (site, id_in_site, gender)
+    client = _CLIENTS.get(key)
+    if client is None:
+        client = _CLIENTS[key] = Client(site, id_in_site, gender)
+    return client
 
 
 def swan_file_metadata(path):
@@ -76,7 +89,7 @@ def swan_file_metadata(path):
     # path: 4_00001_m_01_01_t_2
     site, identity, gender, session, nrecording, device, modality = parts
     site = SITE_MAPPING[site]
-    client = Client(site, identity, gender)
+    client = get_client(site, identity, gender)
     device = DEVICE_MAPPING[device]
     modality = MODALITY_MAPPING[modality]
     session = int(session)
@@ -84,25 +97,182 @@ def swan_file_metadata(path):
 
 
 class SwanFile(object):
-    """A base class for SWAN bio files which can handle the metadata."""
+    """A base class for SWAN bio files which can handle the metadata.
+
+    The metadata is parsed from the path on first access.
+    """
+
+    def _swan_metadata(self):
+        metadata = self.__dict__.get("_metadata")
+        if metadata is None:
+            metadata = self.__dict__["_metadata"] = swan_file_metadata(self.path)
+        return metadata
+
+    @property
+    def client(self):
+        return self._swan_metadata()[0]
+
+    @property
+    def session(self):
+        return self._swan_metadata()[1]
+
+    @property
+    def nrecording(self):
+        return self._swan_metadata()[2]
+
+    @property
+    def device(self):
+        return self._swan_metadata()[3]
+
+    @property
+    def modality(self):
+        return self._swan_metadata()[4]
+
+
+def _as_set(values):
+    if values is None:
+        return None
+    if isinstance(values, (str, int)):
+        values = (values,)
+    return frozenset(values)
+
+
+def _client_id(sample):
+    client_id = sample.client_id
+    if client_id.startswith("attack/"):
+        # the attacks of the spoof lists have the client_id "attack/<type>",
+        # the attacked client is in the file name
+        client_id = swan_file_metadata(sample.path)[0].id
+    return client_id
+
+
+class SampleFilter(object):
+    """A structured filter of SWAN samples.
+
+    Unlike ``filter_samples``, which is called on fully built file objects,
+    this filter is applied on the entries of the file lists before any file
+    object is created. Each criterion is either ``None`` (no filtering), a
+    single value, or a collection of accepted values.
+
+    Parameters
+    ----------
+    sites : str or [str], optional
+        The accepted sites, e.g. ``"IDIAP"``.
+    sessions : int or [int], optional
+        The accepted sessions.
+    devices : str or [str], optional
+        The accepted devices (``"iPhone"`` or ``"iPad"``).
+    modalities : str or [str], optional
+        The accepted modalities, e.g. ``"face"``.
+    client_ids : str or [str], optional
+        The accepted client ids, e.g. ``"IDIAP_00001"``. The attacks of the
+        spoof protocols (whose client id is ``"attack/<type>"``) are filtered
+        by the client (and the site) that they attack.
+    attack_types : str or [str], optional
+        The accepted attack types (PAD only). Include ``None`` to accept bona
+        fide samples.
+    """
+
+    def __init__(
+        self,
+        sites=None,
+        sessions=None,
+        devices=None,
+        modalities=None,
+        client_ids=None,
+        attack_types=None,
+        **kwargs
+    ):
+        super(SampleFilter, self).__init__(**kwargs)
+        self.sites = _as_set(sites)
+        self.sessions = _as_set(sessions)
+        self.devices = _as_set(devices)
+        self.modalities = _as_set(modalities)
+        self.client_ids = _as_set(client_ids)
+        self.attack_types = _as_set(attack_types)
+
+    def __repr__(self):
+        criteria = (
+            "{}={}".format(name, sorted(value, key=str))
+            for name, value in sorted(vars(self).items())
+            if value is not None
+        )
+        return "SampleFilter({})".format(", ".join(criteria))
+
+    def __call__(self, sample):
+        """Returns ``True`` if a list entry or a file object is accepted."""
+        if self.client_ids is not None or self.sites is not None:
+            client_id = _client_id(sample)
+            if self.client_ids is not None and client_id not in self.client_ids:
+                return False
+            if self.sites is not None and client_id.split("_")[0] not in self.sites:
+                return False
+        if (
+            self.attack_types is not None
+            and getattr(sample, "attack_type", None) not in self.attack_types
+        ):
+            return False
+        if self.sessions is None and self.devices is None and self.modalities is None:
+            return True
+        # only parse the file name when it is needed
+        _, session, _, device, modality = swan_file_metadata(sample.path)
+        return (
+            (self.sessions is None or session in self.sessions)
+            and (self.devices is None or device in self.devices)
+            and (self.modalities is None or modality in self.modalities)
+        )
+
+
+class _Option(object):
+    """A setting of files that is shared by all files of a query.
 
-    def __init__(self, **kwargs):
-        super(SwanFile, self).__init__(**kwargs)
-        (
-            self.client,
-            self.session,
-            self.nrecording,
-            self.device,
-            self.modality,
-        ) = swan_file_metadata(self.path)
+    :any:`SwanVideoDatabase.update_files` gives all files of a query one
+    reference to the same dict of settings instead of copying each setting
+    into each file. A value set on a file itself takes precedence.
+    """
+
+    def __init__(self, default=None):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        values = obj.__dict__
+        if self.name in values:
+            return values[self.name]
+        return values.get("_options", {}).get(self.name, self.default)
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
 
 
 class SwanVideoFile(VideoBioFile, SwanFile):
     """A base class for SWAN video files"""
 
+    original_directory = _Option()
+    annotation_directory = _Option()
+    annotation_extension = _Option()
+    annotation_type = _Option()
+    retry_policy = _Option(DEFAULT_RETRY_POLICY)
+    metadata_index = _Option(DEFAULT_METADATA_INDEX)
+    frame_store = _Option()
+    frame_format = _Option()
+    contiguous_frames = _Option(True)
+    annotation_cache = _Option(DEFAULT_ANNOTATION_CACHE)
+    annotation_pack = _Option()
+    # used by load_audio_video, see SwanAudioFile
+    new_rate = _Option()
+    audio_backend = _Option("auto")
+    resample_method = _Option("polyphase")
+    audio_cache = _Option()
+    audio_dtype = _Option("float64")
+
     def swap(self, data):
         # rotate the video or image since SWAN videos are not upright!
-        return np.swapaxes(data, -2, -1)
+        return rotate(data)
 
     def load(
         self,
@@ -111,18 +281,63 @@ class SwanVideoFile(VideoBioFile, SwanFile):
         frame_selector=FrameSelector(selection_style="all"),
     ):
         if extension is None:
+            if self.frame_store is not None and self.path in self.frame_store:
+                # memory-mapped frames are only read when they are selected
+                video = self.frame_store.load(self.path)
+                frame_format = self.frame_store.frame_format(self.frame_format)
+                if frame_format is not None:
+                    indices = selected_frame_indices(frame_selector, len(video))
+                    video = format_video(video, frame_format, indices)
+                return frame_selector(video)
             video_path = self.make_path(directory or self.original_directory, extension)
-            for _ in range(100):
-                try:
-                    video = load(video_path)
-                    break
-                except RuntimeError:
-                    pass
-            video = self.swap(video)
+            # only the frames that frame_selector needs are decoded
+            video = self.retry_policy(
+                load_video,
+                video_path,
+                frame_selector,
+                transform=self.swap,
+                frame_format=self.frame_format,
+                contiguous=self.contiguous_frames,
+            )
             return frame_selector(video)
         else:
             return super(SwanVideoFile, self).load(directory, extension, frame_selector)
 
+    def load_audio_video(self, directory=None, frame_selector=None):
+        """Decodes the frames and the audio of the file in one pass.
+
+        See :any:`bob.db.swan.audiovisual.load_audio_video`. The frames are
+        upright (and in ``frame_format``) like the frames of :any:`load` and
+        the audio is resampled to ``new_rate`` and of type ``audio_dtype``.
+        Frame stores and audio caches are not used.
+
+        Parameters
+        ----------
+        directory : str, optional
+            The directory of the database.
+        frame_selector : :any:`bob.bio.video.FrameSelector`, optional
+            If given, only the frames that it selects are returned.
+
+        Returns
+        -------
+        :any:`bob.db.swan.audiovisual.AudioVideo`
+            The selected frames, their times and the audio.
+        """
+        video_path = self.make_path(directory or self.original_directory)
+        indices = None
+        if frame_selector is not None:
+            indices = selected_frame_indices(frame_selector, self.number_of_frames)
+        return self.retry_policy(
+            load_audio_video,
+            video_path,
+            indices,
+            transform=self.swap,
+            frame_format=self.frame_format,
+            new_rate=self.new_rate,
+            resample_method=self.resample_method,
+            dtype=self.audio_dtype,
+        )
+
     @property
     def frames(self):
         """Yields the frames of the padfile one by one.
@@ -135,12 +350,35 @@ class SwanVideoFile(VideoBioFile, SwanFile):
         Yields
         ------
         :any:`numpy.array`
-            A frame of the video. The size is (3, 1280, 720).
+            A frame of the video. The size is (3, 1280, 720) unless a
+            ``frame_format`` is set. Frames are C-contiguous unless
+            ``contiguous_frames`` is ``False``.
         """
+        frame_format = self.frame_format or (lambda frame: frame)
+        if self.frame_store is not None and self.path in self.frame_store:
+            # stored frames may be downscaled
+            stored_format = self.frame_store.frame_format(self.frame_format)
+            for frame in self.frame_store.load(self.path):
+                yield frame if stored_format is None else stored_format(frame)
+            return
         vfilename = self.make_path(directory=self.original_directory)
         video = reader(vfilename)
-        for frame in video:
-            yield self.swap(frame)
+        for frame in upright_frames(video, contiguous=self.contiguous_frames):
+            yield frame_format(frame)
+
+    @property
+    def video_metadata(self):
+        """Returns the metadata of this video from the metadata index.
+
+        Returns
+        -------
+        dict or None
+            The fields of :any:`bob.db.swan.metadata.METADATA_DTYPE` or
+            ``None`` if the video is not indexed.
+        """
+        if self.metadata_index is None:
+            return None
+        return self.metadata_index.get(self.path)
 
     @property
     def number_of_frames(self):
@@ -156,6 +394,9 @@ class SwanVideoFile(VideoBioFile, SwanFile):
         int
             The number of frames.
         """
+        metadata = self.video_metadata
+        if metadata is not None:
+            return metadata["number_of_frames"]
         vfilename = self.make_path(directory=self.original_directory)
         return reader(vfilename).number_of_frames
 
@@ -165,10 +406,18 @@ class SwanVideoFile(VideoBioFile, SwanFile):
 
         Returns
         -------
-        (int, int, int)
-            The (#Channels, Height, Width) which is (3, 1920, 1080).
+        (int, int, int) or (int, int)
+            The (#Channels, Height, Width) which is (3, 1280, 720) unless the
+            metadata index says otherwise, or the shape of the formatted
+            frames if a ``frame_format`` is set.
         """
-        return SWAN_FRAME_SHAPE
+        shape = SWAN_FRAME_SHAPE
+        metadata = self.video_metadata
+        if metadata is not None:
+            shape = (3, metadata["height"], metadata["width"])
+        if self.frame_format is not None:
+            return self.frame_format.shape(shape)
+        return shape
 
     @property
     def annotations(self):
@@ -180,34 +429,210 @@ class SwanVideoFile(VideoBioFile, SwanFile):
             The annotations as a dictionary, e.g.:
             ``{'0': {'reye':(re_y,re_x), 'leye':(le_y,le_x)}, ...}``
         """
-        return read_annotation_file(
-            self.make_path(self.annotation_directory, self.annotation_extension),
-            self.annotation_type,
-        )
+        if self.annotation_pack is not None and self.path in self.annotation_pack:
+            return self.annotation_pack.get(self.path)
+        path = self.make_path(self.annotation_directory, self.annotation_extension)
+        if self.annotation_cache is None:
+            return read_annotation_file(path, self.annotation_type)
+        return self.annotation_cache.read(path, self.annotation_type)
+
+
+def _audio_options(obj):
+    # the options of read_audio for the audio options of a file or database;
+    # float64 audio is decoded (and cached) as in earlier versions
+    return dict(
+        new_rate=obj.new_rate,
+        backend=obj.audio_backend,
+        resample_method=obj.resample_method,
+        dtype=None if obj.audio_dtype == "float64" else obj.audio_dtype,
+    )
 
 
 class SwanAudioFile(SwanVideoFile):
     """A base class that extracts audio from SWAN video files"""
 
-    def __init__(self, new_rate=None, **kwargs):
+    def __init__(
+        self,
+        new_rate=None,
+        audio_backend="auto",
+        resample_method="polyphase",
+        audio_cache=None,
+        audio_dtype="float64",
+        **kwargs
+    ):
         super().__init__(**kwargs)
-        self.new_rate = new_rate
+        # only the settings that differ from the defaults are stored on the
+        # file, the others are shared, see SwanVideoDatabase.update_files
+        for name, value in (
+            ("new_rate", new_rate),
+            ("audio_backend", audio_backend),
+            ("resample_method", resample_method),
+            ("audio_cache", audio_cache),
+            ("audio_dtype", audio_dtype),
+        ):
+            if value != getattr(SwanVideoFile, name).default:
+                setattr(self, name, value)
 
     def load(self, directory=None, extension=None):
         if extension is None:
             video_path = self.make_path(directory, extension)
-            rate, audio = read_audio(video_path, new_rate=self.new_rate)
-            return rate, np.cast["float"](audio)
+            reader = (
+                read_audio if self.audio_cache is None else self.audio_cache.read_audio
+            )
+            rate, audio = reader(video_path, **_audio_options(self))
+            return rate, cast_audio(audio, self.audio_dtype)
         else:
             return super(SwanAudioFile, self).load(directory, extension)
 
+    def stream(
+        self,
+        directory=None,
+        block_duration=0.02,
+        hop_duration=None,
+        dtype=None,
+        pad=False,
+    ):
+        """Yields the audio of the file in fixed-size blocks while decoding.
+
+        See :any:`bob.db.swan.audio.stream_audio`. If the signal is in the
+        audio cache, the blocks are cut from the cached signal instead.
+
+        Parameters
+        ----------
+        directory : str, optional
+            The directory of the database.
+        block_duration : float
+            The duration of each block in seconds.
+        hop_duration : float, optional
+            The time between the starts of two blocks in seconds.
+        dtype : str, optional
+            One of :any:`bob.db.swan.audio.AUDIO_DTYPES`. Defaults to
+            ``audio_dtype``.
+        pad : bool
+            If ``True``, the last incomplete block is padded with zeros.
+
+        Returns
+        -------
+        rate : int
+            The sampling rate of the blocks.
+        blocks : generator
+            Yields the blocks.
+        """
+        dtype = dtype or self.audio_dtype
+        video_path = self.make_path(directory or self.original_directory)
+        if self.audio_cache is not None:
+            # the same entry as the one of load
+            options = _audio_options(self)
+            key = self.audio_cache.audio_key(
+                video_path,
+                new_rate=options["new_rate"],
+                resample_method=options["resample_method"],
+                dtype=options["dtype"],
+                backend=options["backend"],
+            )
+            entry = self.audio_cache.get(key)
+            if entry is not None:
+                rate, signal = entry
+                block_size = int(round(block_duration * rate))
+                hop_size = int(round(hop_duration * rate)) if hop_duration else None
+                return rate, audio_blocks([signal], block_size, hop_size, dtype, pad)
+        return stream_audio(
+            video_path,
+            block_duration=block_duration,
+            hop_duration=hop_duration,
+            new_rate=self.new_rate,
+            backend=self.audio_backend,
+            resample_method=self.resample_method,
+            dtype=dtype,
+            pad=pad,
+        )
+
 
 class SwanVideoDatabase(object):
-    """SwanVideoDatabase"""
+    """SwanVideoDatabase
+
+    Parameters
+    ----------
+    new_rate : int, optional
+        If given, the audio of the files is resampled to this rate.
+    audio_backend : str
+        The backend used to decode audio. One of
+        :any:`bob.db.swan.audio.AUDIO_BACKENDS`.
+    resample_method : str
+        The method used to resample audio to ``new_rate``. One of
+        :any:`bob.db.swan.resample.RESAMPLE_METHODS`.
+    audio_cache : str or :any:`bob.db.swan.cache.AudioCache`, optional
+        If given, decoded audio is cached in this directory.
+    audio_dtype : str
+        The type of the loaded audio, one of
+        :any:`bob.db.swan.audio.AUDIO_DTYPES`. ``float32`` and ``int16`` audio
+        is resampled in single precision and cached in its type.
+    retry_policy : :any:`bob.db.swan.retry.RetryPolicy`, optional
+        The policy used to retry loading videos. Defaults to
+        :any:`bob.db.swan.retry.DEFAULT_RETRY_POLICY`.
+    metadata_index : :any:`bob.db.swan.metadata.MetadataIndex`, optional
+        The index used to look up the metadata of videos. Defaults to
+        :any:`bob.db.swan.metadata.DEFAULT_METADATA_INDEX`.
+    frame_store : str or :any:`bob.db.swan.framestore.FrameStore`, optional
+        If given, videos that were exported to this frame store are loaded as
+        memory-mapped arrays instead of being decoded.
+    frame_format : :any:`bob.db.swan.video.FrameFormat`, optional
+        If given, frames are cropped, scaled and converted to this format as
+        they are decoded, e.g. ``FrameFormat(size=(224, 224), grey=True)``.
+    contiguous_frames : bool
+        If ``True``, frames are returned as C-contiguous upright arrays,
+        copied once while decoding. If ``False``, they are non-contiguous
+        views of the decoded frames, as in earlier versions.
+    protocol_index : :any:`bob.db.swan.protocol_index.ProtocolIndex`, optional
+        The compiled file lists. Defaults to
+        :any:`bob.db.swan.protocol_index.DEFAULT_PROTOCOL_INDEX`. If ``None``,
+        the text file lists are parsed.
+    annotation_cache : :any:`bob.db.swan.annotations.AnnotationCache`, optional
+        The cache of parsed annotation files. Defaults to
+        :any:`bob.db.swan.annotations.DEFAULT_ANNOTATION_CACHE`. If ``None``,
+        annotation files are parsed on every access.
+    annotation_pack : str or :any:`bob.db.swan.annotations.AnnotationPack`, optional
+        If given, the annotations of the files in this pack are read from it
+        instead of the annotation files.
+    """
 
-    def __init__(self, new_rate=None, **kwargs):
+    def __init__(
+        self,
+        new_rate=None,
+        audio_backend="auto",
+        resample_method="polyphase",
+        audio_cache=None,
+        audio_dtype="float64",
+        retry_policy=DEFAULT_RETRY_POLICY,
+        metadata_index=DEFAULT_METADATA_INDEX,
+        frame_store=None,
+        frame_format=None,
+        contiguous_frames=True,
+        protocol_index=DEFAULT_PROTOCOL_INDEX,
+        annotation_cache=DEFAULT_ANNOTATION_CACHE,
+        annotation_pack=None,
+        **kwargs
+    ):
         super().__init__(**kwargs)
         self.new_rate = new_rate
+        self.audio_backend = audio_backend
+        self.resample_method = resample_method
+        self.retry_policy = retry_policy
+        self.metadata_index = metadata_index
+        if isinstance(audio_cache, str):
+            audio_cache = AudioCache(audio_cache)
+        self.audio_cache = audio_cache
+        self.audio_dtype = audio_dtype
+        if isinstance(frame_store, str):
+            frame_store = FrameStore(frame_store)
+        self.frame_store = frame_store
+        self.frame_format = frame_format
+        self.contiguous_frames = contiguous_frames
+        self.protocol_index = protocol_index
+        self.annotation_cache = annotation_cache
+        if isinstance(annotation_pack, str):
+            annotation_pack = AnnotationPack(annotation_pack)
+        self.annotation_pack = annotation_pack
 
     def frames(self, padfile):
         return padfile.frames
@@ -215,15 +640,172 @@ class SwanVideoDatabase(object):
     def number_of_frames(self, padfile):
         return padfile.number_of_frames
 
+    def stream_frames(
+        self, files, batch_size=None, workers=4, prefetch=32, skip_errors=False
+    ):
+        """Decodes the frames of many files in a pool of worker processes.
+
+        Parameters
+        ----------
+        files : [:any:`SwanVideoFile`]
+            The files to decode.
+        batch_size : int, optional
+            If given, frames are yielded in batches of this size.
+        workers : int
+            The number of decoding processes.
+        prefetch : int
+            The maximum number of decoded frames that wait to be consumed.
+        skip_errors : bool
+            If ``True``, files that fail to decode are skipped.
+
+        Files in the ``frame_store`` are read from it and the other files are
+        decoded with the ``retry_policy``. See
+        :any:`bob.db.swan.video.stream_frames`.
+
+        Yields
+        ------
+        (file, frame_index, frame)
+            If ``batch_size`` is ``None``. Frames of different files are
+            interleaved.
+        ([(file, frame_index)], batch)
+            Otherwise, where ``batch`` has the shape
+            ``(batch_size,) + self.frame_shape``.
+        """
+        paths = [f.make_path(directory=self.original_directory) for f in files]
+        store = self.frame_store
+        stored_paths = [
+            store.path(f.path) if store is not None and f.path in store else None
+            for f in files
+        ]
+        frames = stream_frames(
+            paths,
+            workers=workers,
+            prefetch=prefetch,
+            skip_errors=skip_errors,
+            frame_format=self.frame_format,
+            stored_paths=stored_paths,
+            stored_frame_format=(
+                None if store is None else store.frame_format(self.frame_format)
+            ),
+            retry_policy=self.retry_policy,
+        )
+        if batch_size is None:
+            for position, index, frame in frames:
+                yield files[position], index, frame
+            return
+        for keys, batch in batch_frames(frames, batch_size):
+            yield [(files[position], index) for position, index in keys], batch
+
+    def extract_audio(self, files, workers=1, force=False, progress=None):
+        """Decodes the audio of many files into the audio cache in parallel.
+
+        The audio is decoded and resampled with the audio options of the
+        database, so :any:`SwanAudioFile.load` finds it in the cache later.
+        See :any:`bob.db.swan.cache.extract_audio`.
+
+        Parameters
+        ----------
+        files : [:any:`SwanVideoFile`]
+            The files to extract, e.g. all files of a protocol.
+        workers : int
+            The number of decoding processes.
+        force : bool
+            If ``True``, files that are in the cache already are decoded again.
+        progress : file, optional
+            If given, a progress line is written to this file after each file.
+
+        Returns
+        -------
+        dict
+            The statistics of the extraction.
+        """
+        if self.audio_cache is None:
+            raise ValueError("Extracting audio needs an audio_cache to store it in.")
+        return extract_audio(
+            [f.make_path(directory=self.original_directory) for f in files],
+            self.audio_cache,
+            workers=workers,
+            force=force,
+            progress=progress,
+            **_audio_options(self)
+        )
+
     @property
     def frame_shape(self):
+        if self.frame_format is not None:
+            return self.frame_format.shape(SWAN_FRAME_SHAPE)
         return SWAN_FRAME_SHAPE
 
+    @staticmethod
+    def prefilter(entries, sample_filter=None):
+        """Applies a :any:`SampleFilter` on list entries.
+
+        Parameters
+        ----------
+        entries : list
+            The entries of the file lists (or file objects).
+        sample_filter : :any:`SampleFilter`, optional
+            The filter. If ``None``, all entries are returned.
+
+        Returns
+        -------
+        list
+            The accepted entries.
+        """
+        if sample_filter is None:
+            return entries
+        return [e for e in entries if sample_filter(e)]
+
+    def filtered_objects(self, objects, sample_filter=None, filter_samples=None):
+        """Runs a query while pushing ``sample_filter`` down to the lists.
+
+        Parameters
+        ----------
+        objects : callable
+            Takes the :any:`SampleFilter` (or ``None``) and returns the file
+            objects of the query, usually passing the list entries through
+            :any:`prefilter` before the file objects are created.
+        sample_filter : :any:`SampleFilter` or dict, optional
+            Applied on the list entries before the file objects are created.
+            A dict is passed to :any:`SampleFilter` as keyword arguments.
+        filter_samples : callable, optional
+            Applied on the final file objects.
+
+        Returns
+        -------
+        list
+            The filtered file objects.
+        """
+        if isinstance(sample_filter, dict):
+            sample_filter = SampleFilter(**sample_filter)
+        files = self.update_files(objects(sample_filter))
+        if filter_samples is None:
+            return files
+        return list(filter(filter_samples, files))
+
     def update_files(self, files):
+        """Passes the settings of the database to its files.
+
+        All files share one dict of the settings instead of a copy of each.
+        """
+        options = dict(
+            original_directory=self.original_directory,
+            annotation_directory=self.annotation_directory,
+            annotation_extension=self.annotation_extension,
+            annotation_type=self.annotation_type,
+            new_rate=self.new_rate,
+            audio_backend=self.audio_backend,
+            resample_method=self.resample_method,
+            audio_cache=self.audio_cache,
+            audio_dtype=self.audio_dtype,
+            retry_policy=self.retry_policy,
+            metadata_index=self.metadata_index,
+            frame_store=self.frame_store,
+            frame_format=self.frame_format,
+            contiguous_frames=self.contiguous_frames,
+            annotation_cache=self.annotation_cache,
+            annotation_pack=self.annotation_pack,
+        )
         for f in files:
-            f.original_directory = self.original_directory
-            f.annotation_directory = self.annotation_directory
-            f.annotation_extension = self.annotation_extension
-            f.annotation_type = self.annotation_type
-            f.new_rate = self.new_rate
+            f._options = options
         return files
@@ -9,7 +9,8 @@ from bob.bio.base_legacy.annotator import FailSafe
 
 
 def load_frames(biofile, directory, extension):
-    return [f for f in biofile.frames]
+    # the frames are decoded while they are annotated
+    return biofile.frames
 
 
 annotator = Wrapper(
@@ -1,9 +1,18 @@
 #!/usr/bin/env python
 
+from bob.extension import rc
 from bob.db.swan import Database, SwanAudioBioFile
 
 database = Database(
     bio_file_class=SwanAudioBioFile,
     annotation_directory=None,  # no annotations for the voice part
     new_rate=16000,
+    # one of "auto", "av", "pipe" or "tempfile", see bob.db.swan.audio
+    audio_backend="auto",
+    # one of "polyphase", "fft" or "decoder", see bob.db.swan.resample
+    resample_method="polyphase",
+    # decoded audio is cached here if set, see bob.db.swan.cache
+    audio_cache=rc["bob.db.swan.audio_cache_dir"],
+    # one of "float64", "float32" or "int16", see bob.db.swan.audio
+    audio_dtype="float64",
 )
@@ -1,13 +1,33 @@
-from os.path import join
+from collections import Counter, namedtuple
+from fnmatch import fnmatch
+from multiprocessing import Pool
+from os.path import basename, isfile, join, relpath
+import hashlib
+import json
 import re
 import pkg_resources
 from bob.io.base import create_directories_safe
 from .common import swan_file_metadata
+from .protocol_index import compile_protocols
 
 
 def create_subparser(subparsers):
     parser = subparsers.add_parser(
         'create', help="Creates the PAD file lists of the dataset.")
+    parser.add_argument(
+        '-o', '--output', default=pkg_resources.resource_filename(
+            __name__, 'lists'),
+        help="the directory to write the protocols to [default: %(default)s]")
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help="the number of protocol families to write in parallel")
+    parser.add_argument(
+        '--only', action='append', metavar='PROTOCOL_GLOB',
+        help="only create the protocols that match this glob pattern, e.g. "
+        "'pad_p2_*'. Can be given several times.")
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help="create the protocols even if their inputs did not change")
     parser.set_defaults(func=_create)  # action
 
 
@@ -64,19 +84,212 @@ PAD_FOLDS = (('1', (2, 0, 5, 8, 4), (9, 7), (1, 6, 3)),
              ('5', (8, 2, 9, 0, 1), (5, 4), (6, 7, 3)))
 
 
-def get_ids(ids):
-    return tuple(x for i in ids for x in IDS[i])
+MANIFEST_VERSION = 1
+"""The version of the generated lists. Increase it when the code that writes
+them changes so that all protocols are generated again."""
+
+
+SwanRecord = namedtuple('SwanRecord', ('path', 'client_id', 'attack_type'))
+"""A file of ``swan_noextra.lst`` with the columns of the lists."""
+
+
+class FileTable(object):
+    """The files of ``swan_noextra.lst``, parsed once.
 
+    The protocols select files with regular expressions over their paths.
+    Since many protocols (and all their folds and groups) share the same
+    patterns, the result of each pattern is memoized.
+
+    Parameters
+    ----------
+    lines : [str]
+        The lines of ``swan_noextra.lst``.
+    """
+
+    def __init__(self, lines, **kwargs):
+        super(FileTable, self).__init__(**kwargs)
+        lines = list(lines)
+        self.digest = hashlib.sha1(''.join(lines).encode()).hexdigest()
+        self.records = []
+        for line in lines:
+            path = line.strip()
+            if not path:
+                continue
+            # the protocols select files by their paths, so only the client
+            # id of the metadata is needed
+            client = swan_file_metadata(path)[0]
+            parts = path.split('/')
+            attack_type = parts[2] if parts[0] == 'pa-database' else None
+            self.records.append(SwanRecord(path, client.id, attack_type))
+        self._matches = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, pattern, ids=None):
+        """Returns the records whose path matches ``pattern``.
+
+        Parameters
+        ----------
+        pattern : str
+            A regular expression that is searched in the paths.
+        ids : set, optional
+            If given, only records of these client ids are returned.
+
+        Returns
+        -------
+        [SwanRecord]
+            The records in the order of ``swan_noextra.lst``.
+        """
+        if pattern not in self._matches:
+            regex = re.compile(pattern)
+            self._matches[pattern] = [
+                r for r in self.records if regex.search(r.path)]
+        records = self._matches[pattern]
+        if ids is None:
+            return records
+        return [r for r in records if r.client_id in ids]
 
-def empty_norm(folder):
+
+def get_ids(ids):
+    return frozenset(x for i in ids for x in IDS[i])
+
+
+def write_list(path, lines, manifest=None):
+    """Writes a file list unless it already has the same content.
+
+    Parameters
+    ----------
+    path : str
+        The path of the list.
+    lines : [str]
+        The lines of the list.
+    manifest : :any:`Manifest`, optional
+        If given, the hash of the list is recorded in it.
+    """
+    content = ''.join(lines).encode()
+    digest = hashlib.sha1(content).hexdigest()
+    changed = not isfile(path) or _file_digest(path) != digest
+    if changed:
+        with open(path, 'wb') as f:
+            f.write(content)
+    if manifest is not None:
+        manifest.record(path, digest, changed)
+
+
+def _file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def _digest(*values):
+    return hashlib.sha1(
+        json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+
+class Manifest(object):
+    """Records the inputs and the outputs of the create command.
+
+    Each protocol folder is recorded with a hash of everything it is
+    generated from (the :any:`MANIFEST_VERSION`, the master list, its
+    patterns, its fold and its client ids) and the hashes of its lists. A
+    folder whose inputs did not change and whose lists are untouched is not
+    generated again.
+
+    Parameters
+    ----------
+    output : str
+        The directory of the protocols. The manifest is stored in
+        ``create_manifest.json`` there.
+    files : :any:`FileTable`
+        The files of the database.
+    only : [str], optional
+        If given, only protocols that match one of these glob patterns are
+        generated.
+    force : bool
+        If ``True``, all (selected) protocols are generated again.
+    """
+
+    def __init__(self, output, files, only=None, force=False, **kwargs):
+        super(Manifest, self).__init__(**kwargs)
+        self.output = output
+        self.path = join(output, 'create_manifest.json')
+        self.only = only
+        self.force = force
+        self.inputs = dict(
+            version=MANIFEST_VERSION,
+            master_list=files.digest,
+            ids=_digest(IDS),
+            bio_folds=_digest(BIO_FOLDS),
+            pad_folds=_digest(PAD_FOLDS),
+        )
+        previous = {}
+        if isfile(self.path):
+            with open(self.path) as f:
+                previous = json.load(f).get('protocols', {})
+        self.previous = previous
+        self.protocols = {}
+        self.stats = Counter()
+        self._current = None
+
+    def wanted(self, folder, *inputs):
+        """Returns whether a protocol folder has to be generated.
+
+        Parameters
+        ----------
+        folder : str
+            The folder of the protocol.
+        *inputs
+            Everything (besides the master list) the folder depends on.
+        """
+        name = basename(folder)
+        entry = dict(inputs=_digest(MANIFEST_VERSION,
+                                    self.inputs['master_list'], inputs),
+                     files={})
+        previous = self.previous.get(name)
+        if self.only is not None and \
+                not any(fnmatch(name, pattern) for pattern in self.only):
+            if previous is not None:
+                self.protocols[name] = previous
+            return False
+        if not self.force and previous is not None and \
+                previous['inputs'] == entry['inputs'] and all(
+                    isfile(join(self.output, path)) and
+                    _file_digest(join(self.output, path)) == digest
+                    for path, digest in previous['files'].items()):
+            self.protocols[name] = previous
+            self.stats['unchanged protocols'] += 1
+            return False
+        self.protocols[name] = self._current = entry
+        self.stats['generated protocols'] += 1
+        return True
+
+    def record(self, path, digest, changed):
+        """Records a list of the protocol that is being generated."""
+        self._current['files'][relpath(path, self.output)] = digest
+        self.stats['written lists' if changed else 'unchanged lists'] += 1
+
+    def update(self, protocols, stats):
+        """Merges the results of a :any:`Manifest` of another process."""
+        self.protocols.update(protocols)
+        self.stats.update(stats)
+
+    def save(self):
+        # keep the protocols that were not generated in this run
+        protocols = dict(self.previous, **self.protocols)
+        with open(self.path, 'w') as f:
+            json.dump(dict(inputs=self.inputs, protocols=protocols), f,
+                      indent=1, sort_keys=True)
+
+
+def empty_norm(folder, manifest=None):
     path = join(folder, 'norm')
     create_directories_safe(path)
-    path = join(path, 'train_world.lst')
-    with open(path, 'w'):
-        pass
+    write_list(join(path, 'train_world.lst'), [], manifest)
 
 
-def enrollment_probes(folder, files, group, pattern, ids, cls='enroll'):
+def enrollment_probes(folder, files, group, pattern, ids, cls='enroll',
+                      manifest=None):
     path = join(folder, group)
     create_directories_safe(path)
     if cls == 'probe':
@@ -85,77 +298,70 @@ def enrollment_probes(folder, files, group, pattern, ids, cls='enroll'):
         path = join(path, 'for_scores.lst')
     else:
         path = join(path, 'for_models.lst')
-    regex = re.compile(pattern)
-    files = filter(regex.search, files)
-    with open(path, 'w') as f:
-        for line in files:
-            path = line.strip()
-            client_id = swan_file_metadata(path)[0].id
-            if client_id not in ids:
-                continue
-            if cls == 'probe':
-                f.write('{0} {1}\n'.format(path, client_id))
-            elif cls == 'attack':
-                attack_type = path.split('/')[2]
-                f.write('{0} {1} {1} attack/{2}\n'.format(
-                    path, client_id, attack_type))
-            else:
-                f.write('{0} {1} {1}\n'.format(path, client_id))
+    lines = []
+    for record in files.select(pattern, ids):
+        if cls == 'probe':
+            lines.append('{0} {1}\n'.format(record.path, record.client_id))
+        elif cls == 'attack':
+            lines.append('{0} {1} {1} attack/{2}\n'.format(
+                record.path, record.client_id, record.attack_type))
+        else:
+            lines.append('{0} {1} {1}\n'.format(
+                record.path, record.client_id))
+    write_list(path, lines, manifest)
 
 
 def licit_protocols(
-    out_folder, files, patterns, attack=False, modalities=('eye', 'face', 'voice')
+    out_folder, files, patterns, attack=False,
+    modalities=('eye', 'face', 'voice'), manifest=None
 ):
     for fold, dev_ids, eval_ids in BIO_FOLDS:
         for modality in modalities:
             folder = '{}_{}_f{}'.format(out_folder, modality, fold)
+            if manifest is not None and not manifest.wanted(
+                    folder, patterns[(modality, 'enroll')],
+                    patterns[(modality, 'probe')], attack,
+                    sorted(get_ids(dev_ids)), sorted(get_ids(eval_ids))):
+                continue
             # create empty norm folder
-            empty_norm(folder)
+            empty_norm(folder, manifest)
 
             # create enrollments
             pattern = patterns[(modality, 'enroll')]
             enrollment_probes(folder, files, 'dev',
-                              pattern, get_ids(dev_ids))
+                              pattern, get_ids(dev_ids), manifest=manifest)
             enrollment_probes(folder, files, 'eval',
-                              pattern, get_ids(eval_ids))
+                              pattern, get_ids(eval_ids), manifest=manifest)
 
             # create probes
             pattern = patterns[(modality, 'probe')]
             enrollment_probes(folder, files, 'dev',
                               pattern, get_ids(dev_ids),
-                              cls='attack' if attack else 'probe')
+                              cls='attack' if attack else 'probe',
+                              manifest=manifest)
             enrollment_probes(folder, files, 'eval',
                               pattern, get_ids(eval_ids),
-                              cls='attack' if attack else 'probe')
+                              cls='attack' if attack else 'probe',
+                              manifest=manifest)
 
 
-def pad_list(folder, files, bf, pa, ids):
+def pad_list(folder, files, bf, pa, ids, manifest=None):
     create_directories_safe(folder)
-    bf = re.compile(bf)
-    pa = re.compile(pa)
-    bf_files = filter(bf.search, files)
-    pa_files = filter(pa.search, files)
-    for name, lines in [
-        ('for_real.lst', bf_files),
-        ('for_attack.lst', pa_files),
-    ]:
-        with open(join(folder, name), 'w') as f:
-            for line in lines:
-                path = line.strip()
-                client_id = swan_file_metadata(path)[0].id
-                if client_id not in ids:
-                    continue
-                if name == 'for_real.lst':
-                    f.write('{0} {1}\n'.format(path, client_id))
-                else:
-                    attack_type = path.split('/')[2]
-                    f.write('{0} {1} {2}\n'.format(
-                        path, client_id, attack_type))
-
-
-def pad_protocols(out_folder, files, patterns):
+    real = ['{0} {1}\n'.format(r.path, r.client_id)
+            for r in files.select(bf, ids)]
+    attack = ['{0} {1} {2}\n'.format(r.path, r.client_id, r.attack_type)
+              for r in files.select(pa, ids)]
+    write_list(join(folder, 'for_real.lst'), real, manifest)
+    write_list(join(folder, 'for_attack.lst'), attack, manifest)
+
+
+def pad_protocols(out_folder, files, patterns, manifest=None):
     for fold, train_ids, dev_ids, eval_ids in PAD_FOLDS:
         folder = '{}_f{}'.format(out_folder, fold)
+        if manifest is not None and not manifest.wanted(
+                folder, sorted(patterns.items()), sorted(get_ids(train_ids)),
+                sorted(get_ids(dev_ids)), sorted(get_ids(eval_ids))):
+            continue
 
         for group, ids in (
             ('train', train_ids),
@@ -165,10 +371,10 @@ def pad_protocols(out_folder, files, patterns):
             bf = patterns[(group, 'bf')]
             pa = patterns[(group, 'pa')]
             pad_list(join(folder, group), files,
-                     bf, pa, get_ids(ids))
+                     bf, pa, get_ids(ids), manifest)
 
 
-def bio_protocol_1(out_folder, files):
+def bio_protocol_1(out_folder, files, manifest=None):
     # This give the variation for indoor versus outdoor.
     # enroll with session 2
     # probe with session 3
@@ -185,10 +391,10 @@ def bio_protocol_1(out_folder, files):
         ('face', 'probe'): r'.*session_03/iPhone/.*/.*_03_0[1-2]_p_1.*',
         ('voice', 'probe'): r'.*session_03/iPhone/.*/.*_03_0[3-4]_p_2.*',
     }
-    licit_protocols(out_folder, files, patterns)
+    licit_protocols(out_folder, files, patterns, manifest=manifest)
 
 
-def bio_protocol_2(out_folder, files):
+def bio_protocol_2(out_folder, files, manifest=None):
     # This will give variation for Indoor controlled.
     # enroll with session 1
     # probe with session 2
@@ -205,10 +411,10 @@ def bio_protocol_2(out_folder, files):
         ('face', 'probe'): r'.*session_02/iPhone/.*/.*_02_0[1-2]_p_1.*',
         ('voice', 'probe'): r'.*session_02/iPhone/.*/.*_02_0[3-4]_p_2.*',
     }
-    licit_protocols(out_folder, files, patterns)
+    licit_protocols(out_folder, files, patterns, manifest=manifest)
 
 
-def bio_protocol_3(out_folder, files):
+def bio_protocol_3(out_folder, files, manifest=None):
     # This will give variation for indoor controlled versus indoor/outdoor uncontrolled
     # enroll with session 2
     # probe with session 3,4,5,6
@@ -225,19 +431,20 @@ def bio_protocol_3(out_folder, files):
         ('face', 'probe'): r'.*session_0[3-6]/iPhone/.*/.*_0[3-6]_0[1-2]_p_1.*',
         ('voice', 'probe'): r'.*session_0[3-6]/iPhone/.*/.*_0[3-6]_0[3-4]_p_2.*',
     }
-    licit_protocols(out_folder, files, patterns)
+    licit_protocols(out_folder, files, patterns, manifest=manifest)
 
 
-def bio_protocol_4(out_folder, files):
+def bio_protocol_4(out_folder, files, manifest=None):
     # This is just like protocol 3 but faces are talking faces
     patterns = {
         ('face', 'enroll'): r'.*session_02/iPhone/.*/.*_02_0[1-2]_p_2\.mp4',
         ('face', 'probe'): r'.*session_0[3-6]/iPhone/.*/.*_0[3-6]_0[3-4]_p_2.*',
     }
-    licit_protocols(out_folder, files, patterns, modalities=['face'])
+    licit_protocols(out_folder, files, patterns, modalities=['face'],
+                    manifest=manifest)
 
 
-def spoof_protocol_3(out_folder, files):
+def spoof_protocol_3(out_folder, files, manifest=None):
     # This will give variation for indoor controlled versus indoor/outdoor
     # uncontrolled
     # enroll with session 2
@@ -255,19 +462,21 @@ def spoof_protocol_3(out_folder, files):
         ('face', 'probe'): r'pa-database/StillFace/.*',
         ('voice', 'probe'): r'pa-database/Voice/.*',
     }
-    licit_protocols(out_folder, files, patterns, attack=True)
+    licit_protocols(out_folder, files, patterns, attack=True,
+                    manifest=manifest)
 
 
-def spoof_protocol_4(out_folder, files):
+def spoof_protocol_4(out_folder, files, manifest=None):
     # spoof protocol for talking faces that matches bio_protocol_4
     patterns = {
         ('face', 'enroll'): r'.*session_02/iPhone/.*/.*_02_0[1-2]_p_2\.mp4',
         ('face', 'probe'): r'pa-database/TalkingFace/.*',
     }
-    licit_protocols(out_folder, files, patterns, attack=True, modalities=['face'])
+    licit_protocols(out_folder, files, patterns, attack=True,
+                    modalities=['face'], manifest=manifest)
 
 
-def all_pad_protocols(out_folder, files):
+def all_pad_protocols(out_folder, files, manifest=None):
     # protocol 1
     # eye
     patterns = {
@@ -278,7 +487,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/Eye/PA\.EI\.1/.*',
         ('eval', 'pa'): r'pa-database/Eye/PA\.EI\.1/.*',
     }
-    pad_protocols(out_folder + 'pad_p1_pae1', files, patterns)
+    pad_protocols(out_folder + 'pad_p1_pae1', files, patterns, manifest)
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-4]_p_3\.mp4',
         ('dev', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-4]_p_3\.mp4',
@@ -287,7 +496,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/Eye/PA\.EI\.4/.*',
         ('eval', 'pa'): r'pa-database/Eye/PA\.EI\.4/.*',
     }
-    pad_protocols(out_folder + 'pad_p1_pae4', files, patterns)
+    pad_protocols(out_folder + 'pad_p1_pae4', files, patterns, manifest)
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-4]_p_3\.mp4',
         ('dev', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-4]_p_3\.mp4',
@@ -296,7 +505,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/Eye/PA\.EI\.5/.*',
         ('eval', 'pa'): r'pa-database/Eye/PA\.EI\.5/.*',
     }
-    pad_protocols(out_folder + 'pad_p1_pae5', files, patterns)
+    pad_protocols(out_folder + 'pad_p1_pae5', files, patterns, manifest)
     # face
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-2]_p_1\.mp4',
@@ -306,7 +515,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/TalkingFace/PA\.F\.1/.*',
         ('eval', 'pa'): r'pa-database/TalkingFace/PA\.F\.1/.*',
     }
-    pad_protocols(out_folder + 'pad_p1_paf1', files, patterns)
+    pad_protocols(out_folder + 'pad_p1_paf1', files, patterns, manifest)
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_2\.mp4',
         ('dev', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_2\.mp4',
@@ -315,7 +524,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/TalkingFace/PA\.F\.5/.*',
         ('eval', 'pa'): r'pa-database/TalkingFace/PA\.F\.5/.*',
     }
-    pad_protocols(out_folder + 'pad_p1_paf5', files, patterns)
+    pad_protocols(out_folder + 'pad_p1_paf5', files, patterns, manifest)
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_2\.mp4',
         ('dev', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_2\.mp4',
@@ -324,7 +533,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/TalkingFace/PA\.F\.6/.*',
         ('eval', 'pa'): r'pa-database/TalkingFace/PA\.F\.6/.*',
     }
-    pad_protocols(out_folder + 'pad_p1_paf6', files, patterns)
+    pad_protocols(out_folder + 'pad_p1_paf6', files, patterns, manifest)
     # voice
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_2\.mp4',
@@ -334,7 +543,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/Voice/PA\.V\.4/.*',
         ('eval', 'pa'): r'pa-database/Voice/PA\.V\.4/.*',
     }
-    pad_protocols(out_folder + 'pad_p1_pav4', files, patterns)
+    pad_protocols(out_folder + 'pad_p1_pav4', files, patterns, manifest)
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_2\.mp4',
         ('dev', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_2\.mp4',
@@ -343,7 +552,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/Voice/PA\.V\.7/.*',
         ('eval', 'pa'): r'pa-database/Voice/PA\.V\.7/.*',
     }
-    pad_protocols(out_folder + 'pad_p1_pav7', files, patterns)
+    pad_protocols(out_folder + 'pad_p1_pav7', files, patterns, manifest)
     # protocol 2
     # eye
     patterns = {
@@ -354,7 +563,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/Eye/.*',
         ('eval', 'pa'): r'pa-database/Eye/.*',
     }
-    pad_protocols(out_folder + 'pad_p2_eye', files, patterns)
+    pad_protocols(out_folder + 'pad_p2_eye', files, patterns, manifest)
     # face
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_[1-2]\.mp4',
@@ -364,7 +573,7 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/TalkingFace/.*',
         ('eval', 'pa'): r'pa-database/TalkingFace/.*',
     }
-    pad_protocols(out_folder + 'pad_p2_face', files, patterns)
+    pad_protocols(out_folder + 'pad_p2_face', files, patterns, manifest)
     # voice
     patterns = {
         ('train', 'bf'): r'.*session_02/iPhone/.*/.*_02_0[1-8]_p_2\.mp4',
@@ -374,25 +583,76 @@ def all_pad_protocols(out_folder, files):
         ('dev', 'pa'): r'pa-database/Voice/.*',
         ('eval', 'pa'): r'pa-database/Voice/.*',
     }
-    pad_protocols(out_folder + 'pad_p2_voice', files, patterns)
+    pad_protocols(out_folder + 'pad_p2_voice', files, patterns, manifest)
+
+
+PROTOCOLS = (
+    ('licit_p1', bio_protocol_1),
+    ('licit_p2', bio_protocol_2),
+    ('licit_p3', bio_protocol_3),
+    ('spoof_p3', spoof_protocol_3),
+    ('spoof_p4', spoof_protocol_4),
+    ('', all_pad_protocols),
+    ('licit_p4', bio_protocol_4),
+)
+"""The protocol families as (prefix, function) pairs."""
+
+
+def _create_family(args):
+    function, path, files, manifest = args
+    function(path, files, manifest=manifest)
+    return manifest.protocols, manifest.stats
+
+
+def create_protocols(output, files, jobs=1, only=None, force=False):
+    """Writes the file lists of all protocols that changed.
+
+    Parameters
+    ----------
+    output : str
+        The directory to write the protocols to.
+    files : :any:`FileTable`
+        The files of the database.
+    jobs : int
+        The number of protocol families that are written in parallel.
+    only : [str], optional
+        If given, only protocols that match one of these glob patterns are
+        generated.
+    force : bool
+        If ``True``, all (selected) protocols are generated again.
+
+    Returns
+    -------
+    :any:`Manifest`
+        The manifest of this run. It is also saved in ``output``.
+    """
+    manifest = Manifest(output, files, only=only, force=force)
+    tasks = [(function, join(output, prefix), files, manifest)
+             for prefix, function in PROTOCOLS]
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            # each process updates its own copy of the manifest
+            for protocols, stats in pool.map(
+                    _create_family, tasks, chunksize=1):
+                manifest.update(protocols, stats)
+    else:
+        for task in tasks:
+            _create_family(task)
+    manifest.save()
+    return manifest
 
 
 def _create(args):
     # list all files
-    files = open(pkg_resources.resource_filename(
-        __name__, 'lists/swan_noextra.lst')).readlines()
+    with open(pkg_resources.resource_filename(
+            __name__, 'lists/swan_noextra.lst')) as f:
+        files = FileTable(f)
     # create protocols
-    path = pkg_resources.resource_filename(__name__, 'lists/licit_p1')
-    bio_protocol_1(path, files)
-    path = pkg_resources.resource_filename(__name__, 'lists/licit_p2')
-    bio_protocol_2(path, files)
-    path = pkg_resources.resource_filename(__name__, 'lists/licit_p3')
-    bio_protocol_3(path, files)
-    path = pkg_resources.resource_filename(__name__, 'lists/spoof_p3')
-    spoof_protocol_3(path, files)
-    path = pkg_resources.resource_filename(__name__, 'lists/spoof_p4')
-    spoof_protocol_4(path, files)
-    path = pkg_resources.resource_filename(__name__, 'lists/')
-    all_pad_protocols(path, files)
-    path = pkg_resources.resource_filename(__name__, 'lists/licit_p4')
-    bio_protocol_4(path, files)
+    manifest = create_protocols(args.output, files, jobs=args.jobs,
+                                only=args.only, force=args.force)
+    for name, count in sorted(manifest.stats.items()):
+        print('{}: {}'.format(name, count))
+    # and the index that the databases read them from
+    index = join(args.output, 'swan_protocols.npz')
+    if manifest.stats['written lists'] or not isfile(index):
+        compile_protocols(args.output, index)
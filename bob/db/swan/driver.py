@@ -22,22 +22,37 @@ import sys
 from bob.db.base.driver import Interface as AbstractInterface
 
 
+def database_for_protocol(protocol, **kwargs):
+  """Returns the PAD database for ``pad_*`` protocols and the biometric
+  recognition database otherwise."""
+
+  if protocol is not None and protocol.startswith('pad_'):
+    from .query_pad import Database, SwanVideoPadFile
+    kwargs.setdefault('pad_file_class', SwanVideoPadFile)
+  else:
+    from .query_bio import Database
+  return Database(protocol=protocol, **kwargs)
+
+
 def _dumplist(args):
   """Dumps lists of files based on your criteria."""
 
-  from . import Database
-  db = Database()
+  from .filelists import iter_paths
 
-  r = db.objects(group=args.group)
+  paths = iter_paths(
+      protocols=args.protocol, groups=args.group, purposes=args.purpose,
+      classes=args.cls, unique=args.unique)
 
   output = sys.stdout
   if args.selftest:
     from bob.db.base.utils import null
     output = null()
 
-  for f in r:
-    output.write('%s\n' % f.make_path(
-        directory=args.directory, extension=args.extension))
+  end = '\0' if args.null else '\n'
+  for path in paths:
+    if args.directory:
+      path = os.path.join(args.directory, path)
+    output.write(path + args.extension + end)
 
   return 0
 
@@ -45,14 +60,24 @@ def _dumplist(args):
 def _checkfiles(args):
   """Checks the existence of the files based on your criteria."""
 
-  from . import Database
-  db = Database()
-
-  r = db.objects(group=args.group)
-
-  # go through all files, check if they are available
-  bad = [f for f in r if not os.path.exists(f.make_path(
-      directory=args.directory, extension=args.extension))]
+  from .checkfiles import check_files, write_report
+  from .filelists import iter_paths
+
+  paths = iter_paths(protocols=args.protocol, groups=args.group)
+  expected_sizes = None
+  if args.size:
+    from .metadata import DEFAULT_METADATA_INDEX
+    records = DEFAULT_METADATA_INDEX.records
+    expected_sizes = dict(
+        zip(records['path'].astype(str).tolist(), records['size'].tolist()))
+  results = check_files(
+      paths, args.directory, extension=args.extension, jobs=args.jobs,
+      check_size=args.size, check_readable=args.readable,
+      expected_sizes=expected_sizes)
+  bad = [r for r in results if r['error']]
+
+  if args.report:
+    write_report(results, args.report)
 
   # report
   output = sys.stdout
@@ -61,11 +86,12 @@ def _checkfiles(args):
     output = null()
 
   if bad:
-    for f in bad:
-      output.write('Cannot find file "%s"\n' % f.make_path(
-          directory=args.directory, extension=args.extension))
-    output.write('%d files (out of %d) were not found at "%s"\n' %
-                 (len(bad), len(r), args.directory))
+    for r in bad:
+      output.write('Bad file "%s": %s\n' % (
+          os.path.join(args.directory, r['path'] + args.extension),
+          r['error']))
+    output.write('%d files (out of %d) are bad at "%s"\n' %
+                 (len(bad), len(results), args.directory))
 
   return 0
 
@@ -116,35 +142,73 @@ class Interface(AbstractInterface):
     subparsers = self.setup_parser(parser, "SWAN dataset", docs)
 
     # add the dumplist command
+    from .filelists import CLASSES, GROUPS, PURPOSES, list_protocols
+    protocols = list_protocols()
     dump_parser = subparsers.add_parser(
         'dumplist', help="Dumps list of files based on your criteria")
     dump_parser.add_argument(
         '-d', '--directory', help="if given, this path will be prepended to "
-        "every entry returned [default: <internal>]")
-    dump_parser.add_argument('-e', '--extension', default='.png',
+        "every entry returned")
+    dump_parser.add_argument('-e', '--extension', default='',
                              help="if given, this extension will be appended "
                              "to every entry returned.")
     dump_parser.add_argument(
-        '-g', '--group', help="if given, this value will limit the output "
-        "files to those belonging to a particular group.",
-        choices=('train', 'test'))
+        '-p', '--protocol', action='append', help="if given, only the files "
+        "of this protocol are listed. Can be given several times. "
+        "[default: all protocols]", choices=protocols, metavar='PROTOCOL')
+    dump_parser.add_argument(
+        '-g', '--group', action='append', help="if given, this value will "
+        "limit the output files to those belonging to a particular group.",
+        choices=GROUPS)
+    dump_parser.add_argument(
+        '-u', '--purpose', action='append', help="if given, this value will "
+        "limit the output files to those of a particular purpose.",
+        choices=PURPOSES)
+    dump_parser.add_argument(
+        '-c', '--class', dest='cls', action='append', help="if given, this "
+        "value will limit the output files to bona fide or attack files.",
+        choices=CLASSES)
+    dump_parser.add_argument(
+        '-0', '--null', action='store_true', help="separate the entries with "
+        "a null character instead of a newline, e.g. for xargs -0")
+    dump_parser.add_argument(
+        '--unique', action='store_true', help="list files that are in "
+        "several lists only once (needs memory for all listed paths)")
     dump_parser.add_argument(
         '--self-test', dest="selftest", action='store_true', help=SUPPRESS)
     dump_parser.set_defaults(func=_dumplist)  # action
 
     # add the checkfiles command
+    from bob.extension import rc
     check_parser = subparsers.add_parser(
         'checkfiles', help="Check if the files exist, based on your criteria")
     check_parser.add_argument(
-        '-d', '--directory', help="the path to the root directory to use "
-        "[default: <internal>]")
-    check_parser.add_argument('-e', '--extension', default=".png",
+        '-d', '--directory', default=rc['bob.db.swan.directory'],
+        required=rc['bob.db.swan.directory'] is None,
+        help="the path to the root directory to use [default: %(default)s]")
+    check_parser.add_argument('-e', '--extension', default='',
                               help="the extension appended to every sample "
-                              "[default: %(default)s]")
+                              "[default: %(default)r]")
+    check_parser.add_argument(
+        '-p', '--protocol', action='append', help="if given, only the files "
+        "of this protocol are checked. Can be given several times. "
+        "[default: all protocols]", choices=protocols, metavar='PROTOCOL')
     check_parser.add_argument(
-        '-g', '--group', help="if given, this value will limit the output "
-        "files to those belonging to a particular group.",
-        choices=('train', 'test'))
+        '-g', '--group', action='append', help="if given, this value will "
+        "limit the output files to those belonging to a particular group.",
+        choices=GROUPS)
+    check_parser.add_argument(
+        '-j', '--jobs', type=int, default=16, help="the number of directories "
+        "that are checked concurrently [default: %(default)s]")
+    check_parser.add_argument(
+        '--size', action='store_true', help="also check that files are not "
+        "empty and have the size recorded in the metadata index")
+    check_parser.add_argument(
+        '--readable', action='store_true', help="also check that the header "
+        "of each file can be read")
+    check_parser.add_argument(
+        '-o', '--report', help="if given, a report of all files is written "
+        "to this .json or .csv file")
     check_parser.add_argument(
         '--self-test', dest="selftest", action='store_true', help=SUPPRESS)
     check_parser.set_defaults(func=_checkfiles)  # action
@@ -152,3 +216,31 @@ class Interface(AbstractInterface):
     # add the create command
     from .create import create_subparser
     create_subparser(subparsers)
+
+    # add the index command
+    from .metadata import index_subparser
+    index_subparser(subparsers)
+
+    # add the export-frames command
+    from .framestore import export_frames_subparser
+    export_frames_subparser(subparsers)
+
+    # add the compile-protocols command
+    from .protocol_index import compile_protocols_subparser
+    compile_protocols_subparser(subparsers)
+
+    # add the pack-annotations command
+    from .annotations import pack_annotations_subparser
+    pack_annotations_subparser(subparsers)
+
+    # add the annotate command
+    from .annotate import annotate_subparser
+    annotate_subparser(subparsers)
+
+    # add the extract-audio command
+    from .cache import extract_audio_subparser
+    extract_audio_subparser(subparsers)
+
+    # add the quarantine command
+    from .retry import quarantine_subparser
+    quarantine_subparser(subparsers)
@@ -0,0 +1,155 @@
+"""Direct access to the paths in the protocol file lists.
+
+The command line tools of this package (e.g. ``checkfiles``) only need the
+paths of the files of one or several protocols. This module streams them
+straight from the text file lists, without creating database or file objects.
+"""
+
+import os
+from .protocol_index import LISTS_DIRECTORY
+
+GROUPS = ("world", "train", "dev", "eval")
+"The groups of the protocols. ``world`` is the training set of biometric protocols."
+
+PURPOSES = ("train", "enroll", "probe")
+"""The purposes of the files. Files of the ``world`` and ``train`` groups are
+for training. The files of the other groups are enrolled or probed."""
+
+CLASSES = ("real", "attack")
+"The classes of the files: bona fide or presentation attack."
+
+
+def list_purpose(group, list_name):
+    """Returns the purpose (see :any:`PURPOSES`) of the files of a list."""
+    if group in ("world", "train"):
+        return "train"
+    if list_name == "for_models.lst":
+        return "enroll"
+    return "probe"
+
+
+def row_class(list_name, row):
+    """Returns the class (see :any:`CLASSES`) of a row of a list."""
+    if list_name == "for_attack.lst":
+        return "attack"
+    # the client id column (the 4th) of spoofing score lists is attack/<type>
+    if list_name == "for_scores.lst" and len(row) > 3 and row[3].startswith("attack"):
+        return "attack"
+    return "real"
+
+
+def list_protocols(directory=LISTS_DIRECTORY):
+    """Returns the names of all protocols.
+
+    Parameters
+    ----------
+    directory : str
+        The directory that contains one folder per protocol.
+
+    Returns
+    -------
+    [str]
+    """
+    return sorted(
+        name
+        for name in os.listdir(directory)
+        if os.path.isdir(os.path.join(directory, name))
+    )
+
+
+def list_files(protocol, groups=None, directory=LISTS_DIRECTORY):
+    """Returns the file lists of a protocol.
+
+    Parameters
+    ----------
+    protocol : str
+        The name of the protocol.
+    groups : [str], optional
+        If given, only lists of these groups (see :any:`GROUPS`) are returned.
+    directory : str
+        The directory that contains one folder per protocol.
+
+    Returns
+    -------
+    [(str, str)]
+        The group and the path of each list.
+    """
+    folder = os.path.join(directory, protocol)
+    if not os.path.isdir(folder):
+        raise ValueError(
+            "The protocol {} does not exist in {}.".format(protocol, directory)
+        )
+    lists = []
+    for group in sorted(os.listdir(folder)):
+        # the world list of biometric protocols is in norm/
+        name = "world" if group == "norm" else group
+        if groups is not None and name not in groups:
+            continue
+        group_folder = os.path.join(folder, group)
+        for list_name in sorted(os.listdir(group_folder)):
+            if list_name.endswith(".lst"):
+                lists.append((name, os.path.join(group_folder, list_name)))
+    return lists
+
+
+def iter_rows(list_file):
+    """Yields the columns of the rows of a list, one line at a time."""
+    with open(list_file) as f:
+        for line in f:
+            row = line.split()
+            if row and not row[0].startswith("#"):
+                yield row
+
+
+def iter_paths(
+    protocols=None,
+    groups=None,
+    purposes=None,
+    classes=None,
+    unique=False,
+    directory=LISTS_DIRECTORY,
+):
+    """Yields the paths of the files of one or several protocols.
+
+    The lists are read one line at a time, so the first paths are yielded
+    immediately and the memory usage is constant unless ``unique`` is set.
+
+    Parameters
+    ----------
+    protocols : [str], optional
+        The protocols. All protocols by default.
+    groups : [str], optional
+        If given, only files of these groups (see :any:`GROUPS`) are yielded.
+    purposes : [str], optional
+        If given, only files of these purposes (see :any:`PURPOSES`) are
+        yielded.
+    classes : [str], optional
+        If given, only files of these classes (see :any:`CLASSES`) are
+        yielded.
+    unique : bool
+        If ``True``, each path is yielded once. This needs memory that grows
+        with the number of paths. Otherwise, paths that are in several lists
+        are yielded several times.
+    directory : str
+        The directory that contains one folder per protocol.
+
+    Yields
+    ------
+    str
+        The paths relative to the database directory.
+    """
+    seen = set()
+    for protocol in protocols or list_protocols(directory):
+        for group, list_file in list_files(protocol, groups, directory):
+            list_name = os.path.basename(list_file)
+            if purposes is not None and list_purpose(group, list_name) not in purposes:
+                continue
+            for row in iter_rows(list_file):
+                if classes is not None and row_class(list_name, row) not in classes:
+                    continue
+                path = row[0]
+                if unique:
+                    if path in seen:
+                        continue
+                    seen.add(path)
+                yield path
@@ -0,0 +1,303 @@
+"""A store of pre-decoded SWAN video frames.
+
+Decoding the H.264 videos of SWAN dominates the run time of repeated
+experiments. This module exports the (optionally subsampled and downscaled)
+upright frames of the videos of a protocol into one ``.npy`` file per video.
+:any:`bob.db.swan.common.SwanVideoFile` loads these files as memory-mapped
+arrays so that several processes share the pages through the OS cache:
+
+.. code-block:: sh
+
+    $ bob_dbmanage.py swan export-frames --protocol pad_p2_face_f1 \\
+        --store /path/to/frames --jobs 8
+
+.. note::
+
+    When frames are subsampled with ``--step``, the frame indices of the
+    stored videos do not match the indices of the original videos anymore.
+    The same goes for coordinates (e.g. annotations) when frames are
+    downscaled.
+"""
+
+from multiprocessing import Pool
+import json
+import os
+import tempfile
+import numpy as np
+from numpy.lib import format as npy_format
+from numpy.lib.format import open_memmap
+from bob.extension import rc
+from bob.io.video import reader
+from .video import rotate
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FrameStore(object):
+    """A directory of pre-decoded videos.
+
+    Parameters
+    ----------
+    directory : str
+        The root directory of the store.
+    """
+
+    def __init__(self, directory, **kwargs):
+        super(FrameStore, self).__init__(**kwargs)
+        self.directory = directory
+
+    def __repr__(self):
+        return "FrameStore({!r})".format(self.directory)
+
+    def path(self, path):
+        """Returns the path of a stored video."""
+        return os.path.join(self.directory, path + ".npy")
+
+    def __contains__(self, path):
+        return os.path.isfile(self.path(path))
+
+    @property
+    def options(self):
+        """The options (``step`` and ``downscale``) the store was exported
+        with or ``None`` if nothing was exported yet."""
+        try:
+            with open(os.path.join(self.directory, "options.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def frame_format(self, frame_format):
+        """Returns the format that gives the output of ``frame_format`` on the
+        full resolution frames when it is applied on the stored frames, which
+        may be downscaled.
+
+        Parameters
+        ----------
+        frame_format : :any:`bob.db.swan.video.FrameFormat` or None
+            The format of full resolution frames.
+
+        Returns
+        -------
+        :any:`bob.db.swan.video.FrameFormat` or None
+        """
+        if frame_format is None:
+            return None
+        return frame_format.downscaled((self.options or {}).get("downscale", 1))
+
+    def load(self, path, mmap=True):
+        """Loads a stored video.
+
+        Parameters
+        ----------
+        path : str
+            The path of the video relative to the database directory.
+        mmap : bool
+            If ``True``, a read-only memory-mapped array is returned.
+
+        Returns
+        -------
+        numpy.ndarray
+            The frames with the shape ``(n_frames, 3, height, width)``.
+        """
+        return np.load(self.path(path), mmap_mode="r" if mmap else None)
+
+    def export(self, video_path, path, step=1, downscale=1):
+        """Decodes a video and writes it to the store.
+
+        The frames are written one by one so the memory usage does not depend
+        on the length of the video. All frames are stored, also when the
+        header of the video announces fewer or more frames.
+
+        Parameters
+        ----------
+        video_path : str
+            The path of the video file to decode.
+        path : str
+            The path of the video relative to the database directory.
+        step : int
+            Only every ``step``-th frame is stored.
+        downscale : int
+            Frames are downscaled by this integer factor.
+        """
+        output = self.path(path)
+        folder = os.path.dirname(output)
+        os.makedirs(folder, exist_ok=True)
+        video = reader(video_path)
+        count = (video.number_of_frames + step - 1) // step
+        fd, temp = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        os.close(fd)
+        try:
+            data, stored, appended = None, 0, None
+            for index, frame in enumerate(video):
+                if index % step:
+                    continue
+                frame = rotate(frame)[:, ::downscale, ::downscale]
+                if data is None:
+                    shape = (max(count, 1),) + frame.shape
+                    data = open_memmap(temp, mode="w+", dtype=frame.dtype, shape=shape)
+                if stored < len(data):
+                    data[stored] = frame
+                else:
+                    # the video is longer than announced by its header, the
+                    # frames are appended to the file after the array
+                    if appended is None:
+                        data.flush()
+                        appended = open(temp, "ab")
+                    appended.write(np.ascontiguousarray(frame, data.dtype).tobytes())
+                stored += 1
+            if data is None:
+                raise RuntimeError("{} has no frames.".format(video_path))
+            data.flush()
+            capacity = len(data)
+            del data
+            if appended is not None:
+                appended.close()
+            if stored != capacity:
+                _set_length(temp, stored)
+            os.replace(temp, output)
+        except BaseException:
+            if appended is not None:
+                appended.close()
+            os.remove(temp)
+            raise
+
+
+def _set_length(path, count):
+    # sets the number of frames of a .npy file by rewriting the shape in its
+    # header (which is padded, so its length does not change) and cutting off
+    # the data after them, instead of copying the frames to a new file
+    with open(path, "r+b") as f:
+        version = npy_format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(f)
+        offset = f.tell()
+        shape = (count,) + shape[1:]
+        header = "{{'descr': {!r}, 'fortran_order': {!r}, 'shape': {!r}, }}".format(
+            npy_format.dtype_to_descr(dtype), fortran_order, shape
+        )
+        # the magic string, the version and the length of the header
+        start = 10 if version == (1, 0) else 12
+        if len(header) < offset - start:
+            f.seek(start)
+            f.write(header.ljust(offset - start - 1).encode("latin1") + b"\n")
+            f.truncate(offset + int(np.prod(shape)) * dtype.itemsize)
+            return
+    # the header has no room for a longer shape (older versions of numpy do
+    # not reserve it), so the frames are copied to a new file
+    data = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, data)
+    del data
+    os.replace(temp, path)
+
+
+def _export(args):
+    store, video_path, path, step, downscale = args
+    try:
+        store.export(video_path, path, step=step, downscale=downscale)
+    except Exception:
+        logger.warning("Failed to export %s", video_path, exc_info=True)
+        return False
+    return True
+
+
+def export_frames(files, directory, store, step=1, downscale=1, force=False, jobs=1):
+    """Exports the frames of several files into a frame store.
+
+    Parameters
+    ----------
+    files : [:any:`bob.db.swan.common.SwanVideoFile`]
+        The files to export.
+    directory : str
+        The root directory of the SWAN database.
+    store : :any:`FrameStore`
+        The store to export to.
+    step : int
+        Only every ``step``-th frame is stored.
+    downscale : int
+        Frames are downscaled by this integer factor.
+    force : bool
+        If ``True``, videos already in the store are exported again.
+    jobs : int
+        The number of parallel processes.
+
+    Returns
+    -------
+    int
+        The number of exported videos.
+    """
+    options = dict(step=step, downscale=downscale)
+    if store.options not in (None, options) and not force:
+        raise ValueError(
+            "The store {} was exported with {}. Use force to overwrite it.".format(
+                store.directory, store.options
+            )
+        )
+    os.makedirs(store.directory, exist_ok=True)
+    with open(os.path.join(store.directory, "options.json"), "w") as f:
+        json.dump(options, f)
+
+    todo = [
+        (store, f.make_path(directory), f.path, step, downscale)
+        for f in files
+        if force or f.path not in store
+    ]
+    logger.info("Exporting %d of %d videos", len(todo), len(files))
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            return sum(pool.imap_unordered(_export, todo))
+    return sum(_export(args) for args in todo)
+
+
+def export_frames_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "export-frames", help="Exports the frames of a protocol to a frame store."
+    )
+    parser.add_argument(
+        "-p", "--protocol", required=True, help="the protocol to export"
+    )
+    parser.add_argument(
+        "-s", "--store", required=True, help="the root directory of the frame store"
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=rc["bob.db.swan.directory"],
+        required=rc["bob.db.swan.directory"] is None,
+        help="the root directory of the SWAN database [default: %(default)s]",
+    )
+    parser.add_argument(
+        "--step", type=int, default=1, help="only store every step-th frame"
+    )
+    parser.add_argument(
+        "--downscale", type=int, default=1, help="downscale frames by this factor"
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="export existing videos again"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="the number of parallel processes"
+    )
+    parser.set_defaults(func=_export_frames)  # action
+
+
+def _export_frames(args):
+    from .driver import database_for_protocol
+
+    db = database_for_protocol(args.protocol)
+    files = db.objects(protocol=args.protocol)
+    count = export_frames(
+        files,
+        args.directory,
+        FrameStore(args.store),
+        step=args.step,
+        downscale=args.downscale,
+        force=args.force,
+        jobs=args.jobs,
+    )
+    print("Exported {} videos to {}".format(count, args.store))
+    return 0
@@ -0,0 +1,282 @@
+"""An index of the metadata of all SWAN videos.
+
+Opening a video container only to read its number of frames is slow. This
+module builds an index of the metadata of every ``.mp4`` file in
+``lists/swan_noextra.lst`` once and stores it next to the file lists. The
+properties of :any:`bob.db.swan.common.SwanVideoFile` answer from this index
+when it is available. The index is (re)built incrementally with:
+
+.. code-block:: sh
+
+    $ bob_dbmanage.py swan index --directory /path/to/swan --jobs 8
+"""
+
+from argparse import SUPPRESS
+from multiprocessing import Pool
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+import pkg_resources
+from bob.extension import rc
+from bob.io.video import reader
+import logging
+
+logger = logging.getLogger(__name__)
+
+METADATA_DTYPE = np.dtype(
+    [
+        ("path", "S64"),
+        ("size", "i8"),
+        ("mtime", "f8"),
+        ("number_of_frames", "i4"),
+        ("frame_rate", "f4"),
+        ("duration", "f4"),
+        ("height", "i2"),
+        ("width", "i2"),
+        ("video_codec", "S8"),
+        ("audio_rate", "i4"),
+        ("audio_codec", "S8"),
+    ]
+)
+"""The fields of the index. ``duration`` is in seconds and ``height`` and
+``width`` are of the upright (rotated) frames."""
+
+DEFAULT_INDEX_PATH = pkg_resources.resource_filename(
+    __name__, "lists/swan_metadata.npz"
+)
+"The default location of the metadata index."
+
+
+class MetadataIndex(object):
+    """Provides O(1) access to the metadata of SWAN videos.
+
+    The index file is only read on first access.
+
+    Parameters
+    ----------
+    path : str
+        The path of the index file.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, **kwargs):
+        super(MetadataIndex, self).__init__(**kwargs)
+        self.path = path
+        self._records = None
+        self._positions = None
+
+    def __repr__(self):
+        return "MetadataIndex({!r})".format(self.path)
+
+    @property
+    def records(self):
+        """The structured array of all records."""
+        if self._records is None:
+            if os.path.isfile(self.path):
+                with np.load(self.path) as data:
+                    self._records = data["records"]
+            else:
+                logger.debug("The metadata index %s does not exist.", self.path)
+                self._records = np.zeros(0, dtype=METADATA_DTYPE)
+            self._positions = {
+                path.decode(): i for i, path in enumerate(self._records["path"])
+            }
+        return self._records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def get(self, path):
+        """Returns the record of a video or ``None`` if it is not indexed.
+
+        Parameters
+        ----------
+        path : str
+            The path of the video relative to the database directory.
+
+        Returns
+        -------
+        dict or None
+        """
+        records = self.records
+        position = self._positions.get(path)
+        if position is None:
+            return None
+        record = records[position]
+        return {
+            name: (
+                record[name].decode()
+                if METADATA_DTYPE[name].kind == "S"
+                else record[name].item()
+            )
+            for name in METADATA_DTYPE.names
+        }
+
+
+def _probe_audio(path):
+    cmd = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "a:0",
+        "-show_entries",
+        "stream=sample_rate,codec_name",
+        "-of",
+        "json",
+        path,
+    ]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout
+    streams = json.loads(output.decode()).get("streams") or [{}]
+    return int(streams[0].get("sample_rate", 0)), streams[0].get("codec_name", "")
+
+
+def probe_video(directory, path):
+    """Reads the metadata of a single video.
+
+    Returns
+    -------
+    tuple
+        A record of :any:`METADATA_DTYPE`.
+    """
+    full_path = os.path.join(directory, path)
+    stat = os.stat(full_path)
+    video = reader(full_path)
+    audio_rate, audio_codec = _probe_audio(full_path)
+    # SWAN videos are not upright, see SwanVideoFile.swap
+    return (
+        path,
+        stat.st_size,
+        stat.st_mtime,
+        video.number_of_frames,
+        video.frame_rate,
+        video.duration / 1e6,
+        video.width,
+        video.height,
+        video.codec_name,
+        audio_rate,
+        audio_codec,
+    )
+
+
+def _probe(args):
+    directory, path = args
+    try:
+        return probe_video(directory, path)
+    except Exception:
+        logger.warning("Failed to read the metadata of %s", path, exc_info=True)
+        return None
+
+
+def build_index(directory, paths, output=DEFAULT_INDEX_PATH, force=False, jobs=1):
+    """Builds the metadata index incrementally.
+
+    Videos that are already in the index and whose size and modification
+    time did not change are not opened again.
+
+    Parameters
+    ----------
+    directory : str
+        The root directory of the SWAN database.
+    paths : [str]
+        The paths of the videos relative to ``directory``.
+    output : str
+        The path of the index file.
+    force : bool
+        If ``True``, all videos are read again.
+    jobs : int
+        The number of parallel processes.
+
+    Returns
+    -------
+    numpy.ndarray
+        The records of the new index.
+    """
+    previous = {}
+    if not force and os.path.isfile(output):
+        with np.load(output) as data:
+            previous = {r["path"].decode(): r for r in data["records"]}
+
+    records, todo = [], []
+    for path in paths:
+        record = previous.get(path)
+        if record is not None:
+            try:
+                stat = os.stat(os.path.join(directory, path))
+            except FileNotFoundError:
+                stat = None
+            if stat is not None and (stat.st_size, stat.st_mtime) == (
+                record["size"],
+                record["mtime"],
+            ):
+                records.append(record.item())
+                continue
+        todo.append((directory, path))
+    logger.info(
+        "Reading the metadata of %d videos (%d unchanged)", len(todo), len(records)
+    )
+
+    if jobs > 1:
+        with Pool(jobs) as pool:
+            probed = list(pool.imap(_probe, todo, chunksize=16))
+    else:
+        probed = [_probe(args) for args in todo]
+    records.extend(r for r in probed if r is not None)
+
+    records = np.array(records, dtype=METADATA_DTYPE)
+    records.sort(order="path")
+    np.savez_compressed(output, records=records)
+    return records
+
+
+def index_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "index", help="Builds the index of the metadata of all videos."
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=rc["bob.db.swan.directory"],
+        required=rc["bob.db.swan.directory"] is None,
+        help="the root directory of the SWAN database [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=DEFAULT_INDEX_PATH,
+        help="the path of the index file [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="the number of parallel processes"
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="read all videos again"
+    )
+    parser.add_argument(
+        "--self-test", dest="selftest", action="store_true", help=SUPPRESS
+    )
+    parser.set_defaults(func=_index)  # action
+
+
+def _index(args):
+    lists = pkg_resources.resource_filename(__name__, "lists/swan_noextra.lst")
+    with open(lists) as f:
+        paths = [line.strip() for line in f if line.strip().endswith(".mp4")]
+    records = build_index(
+        args.directory, paths, output=args.output, force=args.force, jobs=args.jobs
+    )
+    output = sys.stdout
+    if args.selftest:
+        from bob.db.base.utils import null
+
+        output = null()
+    output.write("Indexed {} videos in {}\n".format(len(records), args.output))
+    return 0
+
+
+DEFAULT_METADATA_INDEX = MetadataIndex()
+"The metadata index shipped with this package."
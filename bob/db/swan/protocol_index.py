@@ -0,0 +1,383 @@
+"""A compiled index of all protocol file lists.
+
+The protocols of SWAN are defined by several hundred text file lists which
+:any:`bob.bio.base.database.FileListBioDatabase` and
+:any:`bob.pad.base.database.FileListPadDatabase` parse with regular
+expressions every time a protocol is opened. This module compiles all of them
+into a single ``.npz`` file: a table of the unique strings (paths, client ids,
+model ids and attack types) and one array of row indices into this table. The
+rows of each list are also grouped by model id so that the files of a model
+are found without scanning the list. The databases of this package read their
+lists from this index when it is available and up to date:
+
+.. code-block:: sh
+
+    $ bob_dbmanage.py swan compile-protocols
+
+The text file lists are still shipped: the list readers of bob check that
+the lists of a protocol exist to find its groups, and
+:mod:`bob.db.swan.filelists` and the ``create`` command read and write them.
+"""
+
+import os
+import re
+import numpy as np
+import pkg_resources
+import logging
+
+logger = logging.getLogger(__name__)
+
+LISTS_DIRECTORY = pkg_resources.resource_filename(__name__, "lists")
+"The directory of the protocol file lists shipped with this package."
+
+DEFAULT_PROTOCOL_INDEX_PATH = os.path.join(LISTS_DIRECTORY, "swan_protocols.npz")
+"The default location of the protocol index."
+
+# the same expression that the list readers of bob use
+_TOKEN = re.compile(r"[\w/(-.)]+")
+
+
+def read_list_rows(list_file):
+    """Reads the rows of a file list like the list readers of bob do.
+
+    Returns
+    -------
+    [[str]]
+        The columns of each row. Comments and empty lines are skipped.
+    """
+    rows = []
+    with open(list_file) as f:
+        for line in f:
+            if line.strip().startswith("#"):
+                continue
+            row = _TOKEN.findall(line)
+            if row:
+                rows.append(row)
+    return rows
+
+
+def find_lists(directory):
+    """Returns the paths of all file lists of all protocols in a directory.
+
+    Lists directly in ``directory`` (e.g. ``swan_noextra.lst``) do not belong
+    to a protocol and are ignored.
+    """
+    lists = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        if root == directory:
+            continue
+        for name in sorted(files):
+            if name.endswith(".lst"):
+                path = os.path.join(root, name)
+                lists.append(os.path.relpath(path, directory).replace(os.sep, "/"))
+    return lists
+
+
+class ProtocolIndex(object):
+    """Provides the rows of the compiled file lists.
+
+    The index file is only read on first access. A list is served from the
+    index only if its text file is missing or was not modified after the index
+    was written and has the size it had when the index was compiled.
+    Otherwise, the text file is parsed as before. Only the size and the
+    modification time of the text files are compared, they are not read.
+
+    Parameters
+    ----------
+    path : str
+        The path of the index file.
+    directory : str
+        The directory of the text file lists.
+    """
+
+    def __init__(
+        self, path=DEFAULT_PROTOCOL_INDEX_PATH, directory=LISTS_DIRECTORY, **kwargs
+    ):
+        super(ProtocolIndex, self).__init__(**kwargs)
+        self.path = path
+        self.directory = directory
+        self._data = None
+
+    def __repr__(self):
+        return "ProtocolIndex({!r})".format(self.path)
+
+    def _load(self):
+        if self._data is None:
+            if os.path.isfile(self.path):
+                mtime = os.stat(self.path).st_mtime_ns
+                with np.load(self.path) as data:
+                    names = data["lists"].astype(str).tolist()
+                    self._data = dict(
+                        mtime=mtime,
+                        strings=data["strings"].astype(str).tolist(),
+                        rows=data["rows"],
+                        offsets=data["offsets"],
+                        sizes=data["sizes"],
+                        positions={name: i for i, name in enumerate(names)},
+                    )
+                    # indices compiled by earlier versions have no model tables
+                    if "model_rows" in data.files:
+                        for key in MODEL_TABLE_KEYS:
+                            self._data[key] = data[key]
+            else:
+                logger.debug("The protocol index %s does not exist.", self.path)
+                self._data = dict(positions={})
+        return self._data
+
+    @property
+    def lists(self):
+        """The names of all compiled lists, relative to ``directory``."""
+        return sorted(self._load()["positions"])
+
+    @property
+    def protocols(self):
+        """The names of all compiled protocols."""
+        return sorted(set(name.split("/")[0] for name in self.lists))
+
+    def __len__(self):
+        return len(self._load()["positions"])
+
+    def __contains__(self, list_file):
+        return self.rows(list_file) is not None
+
+    def _position(self, list_file):
+        # the position of an up to date list in the index or None
+        data = self._load()
+        name = os.path.relpath(
+            os.path.join(self.directory, list_file), self.directory
+        ).replace(os.sep, "/")
+        position = data["positions"].get(name)
+        if position is None:
+            return None
+        text_file = os.path.join(self.directory, name)
+        if os.path.isfile(text_file) and not self._is_up_to_date(text_file, position):
+            logger.debug("%s changed since the protocol index was compiled.", name)
+            return None
+        return position
+
+    def _is_up_to_date(self, text_file, position):
+        # like make, a list that was modified after the index was written
+        # is out of date
+        data = self._load()
+        stat = os.stat(text_file)
+        return (
+            stat.st_size == data["sizes"][position]
+            and stat.st_mtime_ns <= data["mtime"]
+        )
+
+    def rows(self, list_file):
+        """Returns the rows of a list or ``None`` if the list is not indexed.
+
+        Parameters
+        ----------
+        list_file : str
+            The path of the list, either absolute or relative to
+            ``directory``.
+
+        Returns
+        -------
+        [[str]] or None
+        """
+        position = self._position(list_file)
+        if position is None:
+            return None
+        data = self._data
+        strings = data["strings"]
+        start, end = data["offsets"][position], data["offsets"][position + 1]
+        return [
+            [strings[i] for i in row if i >= 0]
+            for row in data["rows"][start:end].tolist()
+        ]
+
+    def model_table(self, list_file):
+        """Returns the positions of the rows of each model in a list.
+
+        Parameters
+        ----------
+        list_file : str
+            The path of the list, either absolute or relative to
+            ``directory``.
+
+        Returns
+        -------
+        dict or None
+            The (sorted) positions of the rows in the list for each model id,
+            i.e. the second column. ``None`` if the list is not indexed.
+        """
+        position = self._position(list_file)
+        if position is None or "model_rows" not in self._data:
+            return None
+        data = self._data
+        strings, model_rows = data["strings"], data["model_rows"]
+        first, last = data["list_models"][position : position + 2]
+        starts = data["model_starts"]
+        return {
+            strings[key]: model_rows[starts[i] : starts[i + 1]].tolist()
+            for i, key in enumerate(data["model_keys"][first:last].tolist(), first)
+        }
+
+
+def group_models(rows):
+    """Groups the rows of a file list by model id.
+
+    Parameters
+    ----------
+    rows : [[str]]
+        The rows of the list. The model id is the second column, like in the
+        list readers of bob.
+
+    Returns
+    -------
+    dict
+        The (sorted) positions of the rows of each model id.
+    """
+    table = {}
+    for position, row in enumerate(rows):
+        if len(row) > 1:
+            table.setdefault(row[1], []).append(position)
+    return table
+
+
+MODEL_TABLE_KEYS = ("model_rows", "model_starts", "model_keys", "list_models")
+
+
+def compile_protocols(directory=LISTS_DIRECTORY, output=DEFAULT_PROTOCOL_INDEX_PATH):
+    """Compiles all file lists of all protocols into one index.
+
+    Parameters
+    ----------
+    directory : str
+        The directory that contains one folder per protocol.
+    output : str
+        The path of the index file.
+
+    Returns
+    -------
+    int
+        The number of compiled lists.
+    """
+    lists = find_lists(directory)
+    strings, rows, offsets, sizes = {}, [], [0], []
+    model_rows, model_starts, model_keys, list_models = [], [0], [], [0]
+    for name in lists:
+        path = os.path.join(directory, name)
+        list_rows = read_list_rows(path)
+        for row in list_rows:
+            if len(row) > 4:
+                raise ValueError("Cannot parse the line {} of {}".format(row, path))
+            row = [strings.setdefault(column, len(strings)) for column in row]
+            rows.append(row + [-1] * (4 - len(row)))
+        offsets.append(len(rows))
+        sizes.append(os.path.getsize(path))
+        for model_id, positions in group_models(list_rows).items():
+            model_keys.append(strings[model_id])
+            model_rows.extend(positions)
+            model_starts.append(len(model_rows))
+        list_models.append(len(model_keys))
+
+    np.savez_compressed(
+        output,
+        lists=np.array(lists, dtype=str).astype("S"),
+        # the indices of the strings are their insertion order
+        strings=np.array(list(strings), dtype=str).astype("S"),
+        rows=np.array(rows, dtype="i4").reshape(-1, 4),
+        offsets=np.array(offsets, dtype="i8"),
+        sizes=np.array(sizes, dtype="i8"),
+        # the model tables of all lists: the rows of the models of a list are
+        # model_rows[model_starts[i]:model_starts[i + 1]] for i in
+        # range(list_models[list], list_models[list + 1])
+        model_rows=np.array(model_rows, dtype="i4"),
+        model_starts=np.array(model_starts, dtype="i8"),
+        model_keys=np.array(model_keys, dtype="i4"),
+        list_models=np.array(list_models, dtype="i8"),
+    )
+    logger.info(
+        "Compiled %d lists with %d rows and %d unique strings into %s",
+        len(lists),
+        len(rows),
+        len(strings),
+        output,
+    )
+    return len(lists)
+
+
+class IndexedListReader(object):
+    """A mixin for the list readers of bob that reads lists from a
+    :any:`ProtocolIndex` and falls back to parsing the text file.
+
+    Parameters
+    ----------
+    store_lists : bool
+        Passed to the list reader of bob.
+    protocol_index : :any:`ProtocolIndex` or None
+        The index to read the lists from.
+    """
+
+    def __init__(self, store_lists, protocol_index=None):
+        super(IndexedListReader, self).__init__(store_lists)
+        self.protocol_index = protocol_index
+        self.model_tables = {}
+
+    def read_model_table(self, list_file, group, type=None):
+        """Returns the positions of the files of each model in a list.
+
+        The positions refer to the files returned by ``read_list`` with the
+        same arguments. Tables are kept in memory if the lists are.
+
+        Returns
+        -------
+        dict
+            The (sorted) positions of the files of each model id.
+        """
+        key = (group, type)
+        if key in self.model_tables:
+            return self.model_tables[key]
+        table = None
+        if self.protocol_index is not None:
+            table = self.protocol_index.model_table(list_file)
+        if table is None:
+            table = {}
+            for position, f in enumerate(self.read_list(list_file, group, type)):
+                table.setdefault(f._model_id, []).append(position)
+        if self.m_store_lists:
+            self.model_tables[key] = table
+        return table
+
+    def _read_multi_column_list(self, list_file):
+        rows = None
+        if self.protocol_index is not None:
+            rows = self.protocol_index.rows(list_file)
+        if rows is None:
+            return super(IndexedListReader, self)._read_multi_column_list(list_file)
+        return rows
+
+
+def compile_protocols_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "compile-protocols",
+        help="Compiles the file lists of all protocols into a single index.",
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        default=LISTS_DIRECTORY,
+        help="the directory of the protocol folders [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=DEFAULT_PROTOCOL_INDEX_PATH,
+        help="the path of the index file [default: %(default)s]",
+    )
+    parser.set_defaults(func=_compile_protocols)  # action
+
+
+def _compile_protocols(args):
+    count = compile_protocols(args.directory, args.output)
+    print("Compiled {} lists into {}".format(count, args.output))
+    return 0
+
+
+DEFAULT_PROTOCOL_INDEX = ProtocolIndex()
+"The protocol index shipped with this package."
@@ -5,7 +5,9 @@ import bob.bio.base
 import bob.io.base
 import bob.io.video
 from bob.extension import rc
+from bob.bio.base.database.filelist.models import ListReader
 from .common import SwanVideoFile, SwanAudioFile, SwanVideoDatabase
+from .protocol_index import IndexedListReader
 
 
 # class SwanAudioBioFile(SwanAudioFile, AudioBioFile):
@@ -16,6 +18,10 @@ class SwanVideoBioFile(SwanVideoFile):
     """SwanVideoBioFile are video files actually"""
 
 
+class SwanBioListReader(IndexedListReader, ListReader):
+    """Reads the file lists from the compiled protocol index"""
+
+
 class Database(bob.bio.base.database.FileListBioDatabase, SwanVideoDatabase):
     """Wrapper class for the SWAN database for speaker recognition
     (http://www.idiap.ch/dataset/swan). This class defines a simple protocol
@@ -41,14 +47,104 @@ class Database(bob.bio.base.database.FileListBioDatabase, SwanVideoDatabase):
             training_depends_on_protocol=False, models_depend_on_protocol=True,
             **kwargs
         )
+        self._dense_probe_files = {}
+
+    def _list_reader(self, protocol):
+        if protocol not in self.list_readers:
+            # checks that the protocol exists
+            super(Database, self)._list_reader(protocol)
+            self.list_readers[protocol] = SwanBioListReader(
+                self.keep_read_lists_in_memory, self.protocol_index)
+        return self.list_readers[protocol]
+
+    def uses_dense_probe_file(self, protocol):
+        # the base class checks the existence of the lists on every call
+        if protocol not in self._dense_probe_files:
+            self._dense_probe_files[protocol] = super(
+                Database, self).uses_dense_probe_file(protocol)
+        return self._dense_probe_files[protocol]
 
     def objects(self, groups=None, protocol=None, purposes=None,
-                model_ids=None, classes=None, filter_samples=None, **kwargs):
-        files = super(Database, self).objects(
-            groups=groups, protocol=protocol, purposes=purposes,
-            model_ids=model_ids, classes=classes, **kwargs)
-        files = self.update_files(files)
-        if filter_samples is None:
-            return files
-        files = list(filter(filter_samples, files))
-        return files
+                model_ids=None, classes=None, filter_samples=None,
+                sample_filter=None, **kwargs):
+        """Returns the files of a query, see the base class.
+
+        ``sample_filter`` (a :any:`bob.db.swan.SampleFilter` or a dict
+        of its arguments) is applied while the lists are read and
+        ``filter_samples`` (any callable) on the final file objects.
+        Queries with ``model_ids`` only visit the files of these models.
+        """
+        def objects(sample_filter):
+            return self._objects(groups, protocol, purposes, model_ids,
+                                 classes, sample_filter)
+        return self.filtered_objects(
+            objects, sample_filter=sample_filter,
+            filter_samples=filter_samples)
+
+    def _objects(self, groups, protocol, purposes, model_ids, classes,
+                 sample_filter=None):
+        """Same as the ``objects`` query of the base class but
+        ``sample_filter`` is applied on the list entries before the file
+        objects are created. With ``model_ids``, only the files of these
+        models are visited, using the model tables of the list readers. With
+        dense probe lists, all probe files are returned as in the base
+        class."""
+        protocol = protocol or self.protocol
+        dense = self.uses_dense_probe_file(protocol)
+        if dense and classes is not None:
+            raise ValueError("To be able to use the 'classes' keyword, please "
+                             "use the 'for_scores.lst' list file.")
+        purposes = self.check_parameters_for_validity(
+            purposes, 'purpose', ('enroll', 'probe'))
+        groups = self.check_parameters_for_validity(
+            groups, 'group', self.groups(protocol),
+            default_parameters=self.groups(protocol, add_subworld=False))
+        classes = self.check_parameters_for_validity(
+            classes, 'class', ('client', 'impostor'))
+        if isinstance(model_ids, str):
+            model_ids = (model_ids,)
+        if model_ids is not None:
+            model_ids = set(model_ids)
+        reader = self._list_reader(protocol)
+
+        def model_files(group, type=None):
+            list_file = self._get_list_file(group, type, protocol=protocol)
+            files = reader.read_list(list_file, group, type)
+            if model_ids is None:
+                return files
+            table = reader.read_model_table(list_file, group, type)
+            # the files keep the order of the list like in the base class
+            positions = sorted(
+                p for m in model_ids for p in table.get(m, ()))
+            return [files[p] for p in positions]
+
+        lists = [model_files(group) for group in
+                 ('world', 'optional_world_1', 'optional_world_2')
+                 if group in groups]
+        probe_lists = []
+        for group in ('dev', 'eval'):
+            if group not in groups:
+                continue
+            if 'enroll' in purposes:
+                lists.append(model_files(group, 'for_models'))
+            if 'probe' not in purposes:
+                continue
+            if dense:
+                list_file = self._get_list_file(
+                    group, 'for_probes', protocol=protocol)
+                probe_lists.append(
+                    reader.read_list(list_file, group, 'for_probes'))
+            else:
+                probe_lists.append([
+                    f for f in model_files(group, 'for_scores')
+                    if ('client' in classes and f.client_id == f.claimed_id)
+                    or ('impostor' in classes and
+                        f.client_id != f.claimed_id)])
+
+        file_ids, retval = set(), []
+        for files in lists + probe_lists:
+            for f in files:
+                if f.id not in file_ids:
+                    file_ids.add(f.id)
+                    retval.append(f)
+        return self._make_bio(self.prefilter(retval, sample_filter))
@@ -4,7 +4,9 @@ from bob.pad.voice.database import PadVoiceFile as VoicePadFile
 from bob.pad.face.database import VideoPadFile
 from bob.pad.base.database import FileListPadDatabase
 from bob.extension import rc
+from bob.pad.base.database.filelist.models import ListReader
 from .common import SwanVideoFile, SwanAudioFile, SwanVideoDatabase
+from .protocol_index import IndexedListReader
 
 
 class SwanAudioPadFile(SwanAudioFile, VoicePadFile):
@@ -15,6 +17,10 @@ class SwanVideoPadFile(SwanVideoFile, VideoPadFile):
     """SwanVideoPadFile are video files actually"""
 
 
+class SwanPadListReader(IndexedListReader, ListReader):
+    """Reads the file lists from the compiled protocol index"""
+
+
 class Database(FileListPadDatabase, SwanVideoDatabase):
     """Wrapper class for the SWAN database for PAD
     (http://www.idiap.ch/dataset/swan).
@@ -39,13 +45,47 @@ class Database(FileListPadDatabase, SwanVideoDatabase):
             **kwargs
         )
 
+    def _list_reader(self, protocol):
+        if protocol not in self.list_readers:
+            # checks that the protocol exists
+            super(Database, self)._list_reader(protocol)
+            self.list_readers[protocol] = SwanPadListReader(
+                self.keep_read_lists_in_memory, self.protocol_index)
+        return self.list_readers[protocol]
+
     def objects(self, groups=None, protocol=None, purposes=None,
-                model_ids=None, classes=None, filter_samples=None, **kwargs):
-        files = super(Database, self).objects(
-            groups=groups, protocol=protocol, purposes=purposes,
-            model_ids=model_ids, classes=classes, **kwargs)
-        files = self.update_files(files)
-        if filter_samples is None:
-            return files
-        files = list(filter(filter_samples, files))
-        return files
+                model_ids=None, classes=None, filter_samples=None,
+                sample_filter=None, **kwargs):
+        """Returns the files of a query, see the base class.
+
+        ``sample_filter`` (a :any:`bob.db.swan.SampleFilter` or a dict
+        of its arguments) is applied while the lists are read and
+        ``filter_samples`` (any callable) on the final file objects.
+        """
+        def objects(sample_filter):
+            return self._objects(groups, protocol, purposes, sample_filter)
+        return self.filtered_objects(
+            objects, sample_filter=sample_filter,
+            filter_samples=filter_samples)
+
+    def _objects(self, groups, protocol, purposes, sample_filter=None):
+        """Same as the ``objects`` query of the base class but
+        ``sample_filter`` is applied on the list entries before the file
+        objects are created."""
+        purposes = self.check_parameters_for_validity(
+            purposes, 'purpose', ('real', 'attack'))
+        groups = self.check_parameters_for_validity(
+            groups, 'group', self.groups(protocol),
+            default_parameters=self.groups(protocol))
+        reader = self._list_reader(protocol)
+        files = []
+        for group in ('train', 'dev', 'eval'):
+            if group not in groups:
+                continue
+            for purpose in ('real', 'attack'):
+                if purpose in purposes:
+                    type = 'for_' + purpose
+                    list_file = self._get_list_file(
+                        group, type, protocol=protocol)
+                    files.extend(reader.read_list(list_file, group, type))
+        return self._make_pad(self.prefilter(files, sample_filter))
@@ -0,0 +1,195 @@
+"""Resampling of the audio signals of the SWAN database.
+
+The following methods are available:
+
+``"polyphase"``
+    Rational polyphase filtering using :any:`scipy.signal.resample_poly`. The
+    anti-aliasing filter of each ``(rate, new_rate)`` pair is designed once and
+    cached.
+``"fft"``
+    Resampling in the frequency domain using :any:`scipy.signal.resample`. This
+    is slow for long or prime-length signals.
+``"decoder"``
+    The target rate is requested from the audio decoder so that no separate
+    resampling pass is needed. See :any:`bob.db.swan.audio.read_audio`.
+
+Signals that are decoded block by block are resampled with a
+:any:`StreamResampler`, which gives the same result as ``"polyphase"``.
+"""
+
+from functools import lru_cache
+from math import gcd
+import numpy as np
+import scipy.signal
+import logging
+
+logger = logging.getLogger(__name__)
+
+RESAMPLE_METHODS = ("polyphase", "fft", "decoder")
+"Names of the available resampling methods."
+
+
+@lru_cache(maxsize=None)
+def polyphase_filter(rate, new_rate):
+    """Returns the polyphase resampling factors and the anti-aliasing filter.
+
+    The filter is the same as the default filter of
+    :any:`scipy.signal.resample_poly`, i.e. a Kaiser windowed FIR filter.
+
+    Parameters
+    ----------
+    rate : int
+        The sampling rate of the signal.
+    new_rate : int
+        The target sampling rate.
+
+    Returns
+    -------
+    up : int
+    down : int
+    taps : numpy.ndarray
+        The (read-only) filter coefficients.
+    """
+    divisor = gcd(int(rate), int(new_rate))
+    up, down = int(new_rate) // divisor, int(rate) // divisor
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    taps = scipy.signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0))
+    taps.setflags(write=False)
+    return up, down, taps
+
+
+def resample(signal, rate, new_rate, method="polyphase", dtype=None):
+    """Resamples a signal along its first axis.
+
+    Parameters
+    ----------
+    signal : numpy.ndarray
+        The signal with the shape ``(n_samples,)`` or
+        ``(n_samples, n_channels)``.
+    rate : int
+        The sampling rate of the signal.
+    new_rate : int
+        The target sampling rate.
+    method : str
+        One of :any:`RESAMPLE_METHODS`. With ``"decoder"`` the signal is
+        expected to be decoded at ``new_rate`` already; if it is not, polyphase
+        resampling is used.
+    dtype : str, optional
+        The floating point type, ``"float32"`` or ``"float64"``, in which the
+        signal is resampled and returned. By default, the result is
+        ``float64``.
+
+    Returns
+    -------
+    numpy.ndarray
+        The resampled signal.
+    """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError(
+            "Unknown resampling method {!r}. Expected one of {}.".format(
+                method, RESAMPLE_METHODS
+            )
+        )
+    if dtype is not None:
+        signal = signal.astype(dtype, copy=False)
+    if rate == new_rate:
+        return signal
+    logger.debug("Resampling audio from %d to %d using %s", rate, new_rate, method)
+    if method == "fft":
+        samps = round(len(signal) * new_rate / rate)  # Number of samples to resample
+        return scipy.signal.resample(signal, samps)
+    up, down, taps = polyphase_filter(rate, new_rate)
+    if dtype is not None:
+        # the type of the filter decides the precision of the computation
+        taps = taps.astype(dtype, copy=False)
+    return scipy.signal.resample_poly(signal, up, down, axis=0, window=taps)
+
+
+class StreamResampler(object):
+    """Resamples a signal block by block.
+
+    The output is the same as :any:`resample` with the ``"polyphase"`` method
+    on the whole signal, but only a few filter lengths of the signal are kept
+    in memory.
+
+    Parameters
+    ----------
+    rate : int
+        The sampling rate of the signal.
+    new_rate : int
+        The target sampling rate.
+    dtype : str
+        The floating point type of the computation and of the output.
+    """
+
+    def __init__(self, rate, new_rate, dtype="float64", **kwargs):
+        super(StreamResampler, self).__init__(**kwargs)
+        self.up, self.down, taps = polyphase_filter(rate, new_rate)
+        self.half_len = (len(taps) - 1) // 2
+        # phases[p, i] is the tap applied to the i-th previous input sample
+        # of the outputs with the phase p
+        self.n_taps = -(-len(taps) // self.up)
+        self.dtype = np.dtype(dtype)
+        padded = np.zeros(self.n_taps * self.up, dtype=self.dtype)
+        padded[: len(taps)] = taps * self.up
+        self.phases = padded.reshape(self.n_taps, self.up).T.copy()
+        self._buffer = None
+        self._start = -(self.n_taps - 1)  # the index of the first buffered sample
+        self._n_in = 0
+        self._n_out = 0
+
+    def _append(self, block):
+        block = np.asarray(block, dtype=self.dtype)
+        if self._buffer is None:
+            # the samples before the signal are zero
+            self._buffer = np.zeros((self.n_taps - 1,) + block.shape[1:], self.dtype)
+        self._buffer = np.concatenate([self._buffer, block])
+
+    def _outputs(self, end):
+        m = np.arange(self._n_out, end)
+        q = m * self.down + self.half_len
+        last = q // self.up
+        indices = last[:, None] - np.arange(self.n_taps) - self._start
+        windows = self._buffer[indices]
+        out = np.einsum("nk,nk...->n...", self.phases[q % self.up], windows)
+        self._n_out = end
+        # drop the samples that the next outputs do not need
+        first = (end * self.down + self.half_len) // self.up - (self.n_taps - 1)
+        if first > self._start:
+            self._buffer = self._buffer[first - self._start :]
+            self._start = first
+        return out
+
+    def process(self, block):
+        """Resamples the next block of the signal.
+
+        Parameters
+        ----------
+        block : numpy.ndarray
+            The next samples with the shape ``(n_samples,)`` or
+            ``(n_samples, n_channels)``.
+
+        Returns
+        -------
+        numpy.ndarray
+            The output samples that depend only on the samples seen so far.
+        """
+        self._append(block)
+        self._n_in += len(block)
+        end = -(-(self._n_in * self.up - self.half_len) // self.down)
+        return self._outputs(max(end, self._n_out))
+
+    def flush(self):
+        """Returns the remaining output samples at the end of the signal."""
+        if self._buffer is None:
+            return np.zeros(0, self.dtype)
+        end = -(-(self._n_in * self.up) // self.down)
+        if end <= self._n_out:
+            return self._buffer[:0]
+        # the samples after the signal are zero
+        last = ((end - 1) * self.down + self.half_len) // self.up
+        missing = last + 1 - (self._start + len(self._buffer))
+        if missing > 0:
+            self._append(np.zeros((missing,) + self._buffer.shape[1:]))
+        return self._outputs(end)
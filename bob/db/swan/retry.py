@@ -0,0 +1,291 @@
+"""Retrying of flaky video decoding.
+
+Decoding SWAN videos with :any:`bob.io.base.load` occasionally fails with a
+:any:`RuntimeError` that goes away when the file is loaded again. Truly corrupt
+files however fail every time. :any:`RetryPolicy` retries a bounded number of
+times with an exponential backoff and records files that keep failing in a
+:any:`Quarantine` so that later runs skip them immediately.
+
+The quarantine can be persisted between runs with:
+
+.. code-block:: sh
+
+    $ bob config set bob.db.swan.quarantine_file /path/to/quarantine.lst
+
+Files are only quarantined after several calls failed, also when these calls
+were made by different runs, and files that were repaired are released with
+their path relative to the database directory:
+
+.. code-block:: sh
+
+    $ bob_dbmanage.py swan quarantine --release IDIAP/session_01/.../file.mp4
+"""
+
+from collections import Counter
+import json
+import os
+import tempfile
+import time
+from bob.extension import rc
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QuarantinedFileError(RuntimeError):
+    """Raised when a file that is known to be broken is loaded."""
+
+
+class Quarantine(object):
+    """A set of files that are known to be broken.
+
+    Parameters
+    ----------
+    path : str, optional
+        A text file with one quarantined path per line. If given, the
+        quarantine is read from this file on first access and appended to
+        it. The failed calls of files that are not quarantined yet are
+        recorded in ``<path>.failures``.
+
+    Notes
+    -----
+    Paths are matched by their trailing components, so a file that was
+    quarantined with its absolute path is found and released with its path
+    relative to the database directory.
+    """
+
+    def __init__(self, path=None, **kwargs):
+        super(Quarantine, self).__init__(**kwargs)
+        self.path = path
+        self._files = None
+        self._failures = None
+
+    def __repr__(self):
+        return "Quarantine({!r})".format(self.path)
+
+    @property
+    def files(self):
+        """The set of quarantined paths."""
+        if self._files is None:
+            self._files = set()
+            if self.path is not None and os.path.isfile(self.path):
+                with open(self.path) as f:
+                    self._files.update(line.strip() for line in f if line.strip())
+        return self._files
+
+    @property
+    def failures(self):
+        """The number of failed calls of each file (a
+        :any:`collections.Counter`)."""
+        if self._failures is None:
+            self._failures = Counter()
+            if self.path is not None and os.path.isfile(self.path + ".failures"):
+                with open(self.path + ".failures") as f:
+                    self._failures.update(line.strip() for line in f if line.strip())
+        return self._failures
+
+    def _matching(self, paths, entries):
+        # the entries that are one of the paths or end with one of them
+        suffixes = tuple(os.sep + path.lstrip(os.sep) for path in paths)
+        paths = set(paths)
+        return {e for e in entries if e in paths or e.endswith(suffixes)}
+
+    def __contains__(self, path):
+        return path in self.files or bool(self._matching([path], self.files))
+
+    def __len__(self):
+        return len(self.files)
+
+    def add(self, path):
+        """Adds a file to the quarantine."""
+        if path in self.files:
+            return
+        self.files.add(path)
+        if self.path is not None:
+            # appending a single line is atomic enough for concurrent jobs
+            with open(self.path, "a") as f:
+                f.write(path + "\n")
+
+    def add_failure(self, path):
+        """Records a failed call of a file.
+
+        Returns
+        -------
+        int
+            The number of failed calls of the file, including those of
+            earlier runs.
+        """
+        self.failures[path] += 1
+        if self.path is not None:
+            with open(self.path + ".failures", "a") as f:
+                f.write(path + "\n")
+        return self.failures[path]
+
+    def _rewrite(self, path, lines):
+        # the file is replaced atomically
+        folder = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(
+            "w", dir=folder, suffix=".tmp", delete=False
+        ) as f:
+            f.writelines(line + "\n" for line in lines)
+        os.replace(f.name, path)
+
+    def release(self, paths=None):
+        """Removes files from the quarantine, e.g. after they were repaired.
+
+        Parameters
+        ----------
+        paths : [str], optional
+            The files to release, either as they were quarantined or relative
+            to the database directory. All files are released by default.
+            Their failed calls are forgotten too.
+
+        Returns
+        -------
+        [str]
+            The released files as they were quarantined.
+        """
+        files, failures = self.files, self.failures
+        if paths is None:
+            released, forgotten = set(files), set(failures)
+        else:
+            released = self._matching(paths, files)
+            forgotten = self._matching(paths, failures)
+        files.difference_update(released)
+        for path in forgotten:
+            del failures[path]
+        if released and self.path is not None:
+            self._rewrite(self.path, sorted(files))
+        if forgotten and self.path is not None:
+            self._rewrite(self.path + ".failures", sorted(failures.elements()))
+        return sorted(released)
+
+
+class RetryPolicy(object):
+    """Calls a function until it succeeds or the attempts are exhausted.
+
+    Parameters
+    ----------
+    max_attempts : int
+        The maximum number of calls for each file.
+    delay : float
+        The delay in seconds before the first retry.
+    backoff : float
+        The factor the delay is multiplied with after each retry.
+    max_delay : float
+        The maximum delay in seconds between two attempts.
+    exceptions : tuple
+        The exceptions that trigger a retry.
+    quarantine : :any:`Quarantine`, optional
+        Files that keep failing are added here and are not loaded again. Its
+        file also keeps the failed calls of earlier runs.
+    quarantine_after : int
+        A file is quarantined once this many calls with it (in this or in
+        earlier runs) failed all their attempts, so that one bad moment (e.g.
+        of a network file system) does not quarantine a file for good.
+
+    Attributes
+    ----------
+    stats : :any:`collections.Counter`
+        Counts the ``calls``, ``retries``, ``failures`` and ``quarantined``
+        (skipped) files.
+    """
+
+    def __init__(
+        self,
+        max_attempts=5,
+        delay=0.05,
+        backoff=2.0,
+        max_delay=1.0,
+        exceptions=(RuntimeError,),
+        quarantine=None,
+        quarantine_after=3,
+        **kwargs
+    ):
+        super(RetryPolicy, self).__init__(**kwargs)
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.exceptions = exceptions
+        self.quarantine = quarantine if quarantine is not None else Quarantine()
+        self.quarantine_after = quarantine_after
+        self.stats = Counter()
+
+    def __call__(self, function, path, *args, **kwargs):
+        """Returns ``function(path, *args, **kwargs)`` retrying on failures.
+
+        Raises
+        ------
+        QuarantinedFileError
+            If ``path`` is in the quarantine.
+        RuntimeError
+            If all attempts failed.
+        """
+        if path in self.quarantine:
+            self.stats["quarantined"] += 1
+            raise QuarantinedFileError("{} is quarantined.".format(path))
+        self.stats["calls"] += 1
+        delay = self.delay
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return function(path, *args, **kwargs)
+            except self.exceptions as e:
+                if attempt == self.max_attempts:
+                    self.stats["failures"] += 1
+                    if self.quarantine.add_failure(path) >= self.quarantine_after:
+                        self.quarantine.add(path)
+                    raise RuntimeError(
+                        "Failed to load {} after {} attempts.".format(path, attempt)
+                    ) from e
+                self.stats["retries"] += 1
+                logger.debug("Attempt %d to load %s failed: %s", attempt, path, e)
+                time.sleep(delay)
+                delay = min(delay * self.backoff, self.max_delay)
+
+    def export_stats(self, path):
+        """Writes the counters and the quarantined files to a JSON file."""
+        with open(path, "w") as f:
+            json.dump(
+                dict(stats=dict(self.stats), quarantine=sorted(self.quarantine.files)),
+                f,
+                indent=2,
+            )
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy(
+    quarantine=Quarantine(rc["bob.db.swan.quarantine_file"])
+)
+"The retry policy used by :any:`bob.db.swan.common.SwanVideoFile` by default."
+
+
+def quarantine_subparser(subparsers):
+    parser = subparsers.add_parser(
+        "quarantine", help="Lists or releases the files in the quarantine."
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        default=rc["bob.db.swan.quarantine_file"],
+        required=rc["bob.db.swan.quarantine_file"] is None,
+        help="the quarantine file [default: %(default)s]",
+    )
+    parser.add_argument(
+        "-r",
+        "--release",
+        action="append",
+        help="release this file from the quarantine. Can be given several times.",
+    )
+    parser.add_argument("--release-all", action="store_true", help="release all files")
+    parser.set_defaults(func=_quarantine)  # action
+
+
+def _quarantine(args):
+    quarantine = Quarantine(args.file)
+    if args.release_all or args.release:
+        released = quarantine.release(None if args.release_all else args.release)
+        print("Released {} files from {}".format(len(released), args.file))
+        return 0
+    for path in sorted(quarantine.files):
+        print(path)
+    return 0
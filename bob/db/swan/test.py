@@ -62,3 +62,864 @@ def test_pad_protocols():
     bf, pa = db.all_files(groups='train')
     assert len(bf) == 230, len(bf)
     assert len(pa) == 391, len(pa)
+
+    # the same filter, applied while the lists are read
+    from .common import SampleFilter
+    db.all_files_options = dict(sample_filter=SampleFilter(sites='IDIAP'))
+    bf, pa = db.all_files(groups='train')
+    assert len(bf) == 230, len(bf)
+    assert len(pa) == 391, len(pa)
+
+    db.all_files_options = dict(
+        sample_filter=dict(sites='IDIAP', devices='iPhone'),
+        filter_samples=lambda f: f.session == 2)
+    bf, pa = db.all_files(groups='train')
+    assert all(f.device == 'iPhone' and f.session == 2 for f in bf + pa)
+
+
+def test_sample_filter_spoof():
+    from .common import swan_file_metadata
+    from .query_bio import Database
+
+    db = Database(protocol='spoof_p3_face_f4')
+    probes = db.objects(groups='dev', purposes='probe')
+    attacks = [f for f in probes if f.client_id.startswith('attack/')]
+    assert attacks
+
+    # attacks are filtered by the site and the client that they attack
+    files = db.objects(groups='dev', purposes='probe',
+                       sample_filter=dict(sites='NTNU'))
+    expected = [f.path for f in probes
+                if swan_file_metadata(f.path)[0].institute == 'NTNU']
+    assert [f.path for f in files] == expected
+    assert any(f.client_id.startswith('attack/') for f in files)
+
+    client_id = swan_file_metadata(attacks[0].path)[0].id
+    files = db.objects(groups='dev', purposes='probe',
+                       sample_filter=dict(client_ids=client_id))
+    assert attacks[0].path in [f.path for f in files]
+    assert all(swan_file_metadata(f.path)[0].id == client_id for f in files)
+
+
+def test_resample():
+    import numpy as np
+    from .resample import resample, polyphase_filter
+
+    signal = np.random.RandomState(0).randn(44101)
+    up, down, _ = polyphase_filter(44100, 16000)
+    assert (up, down) == (160, 441), (up, down)
+    assert polyphase_filter(44100, 16000) is polyphase_filter(44100, 16000)
+
+    poly = resample(signal, 44100, 16000)
+    fft = resample(signal, 44100, 16000, method="fft")
+    assert abs(len(poly) - len(fft)) <= 1, (len(poly), len(fft))
+    assert resample(signal, 16000, 16000) is signal
+
+
+def test_audio_cache():
+    import os
+    import tempfile
+    import numpy as np
+    from .cache import AudioCache
+
+    with tempfile.TemporaryDirectory() as folder:
+        video = os.path.join(folder, "video.mp4")
+        with open(video, "wb") as f:
+            f.write(b"not really a video")
+        cache = AudioCache(os.path.join(folder, "cache"), max_size=None)
+        key = cache.key(video, new_rate=16000)
+        assert key != cache.key(video, new_rate=8000)
+        assert cache.get(key) is None
+
+        signal = np.arange(1000, dtype="int16")
+        cache.put(key, 16000, signal)
+        rate, cached = cache.get(key)
+        assert rate == 16000, rate
+        assert np.array_equal(cached, signal)
+
+        # a small cache keeps only the most recent entry
+        cache.max_size = os.path.getsize(cache.path(key)) + 10
+        other = cache.key(video, new_rate=8000)
+        cache.put(other, 8000, signal)
+        assert cache.get(key) is None
+        assert cache.get(other) is not None
+
+        # the entries written by other processes count too
+        assert cache.audio_key(video, backend="av") != cache.audio_key(video)
+        first, second = (
+            AudioCache(cache.directory, max_size=3 * cache.max_size)
+            for _ in range(2))
+        keys = [cache.key(video, new_rate=rate) for rate in (1, 2, 3, 4)]
+        first.put(keys[0], 1, signal)
+        second.put(keys[1], 2, signal)
+        first.put(keys[2], 3, signal)
+        second.put(keys[3], 4, signal)
+        assert [k in cache for k in keys] == [False, True, True, True]
+        assert cache.disk_usage() <= first.max_size
+
+
+def test_retry_policy():
+    import os
+    import tempfile
+    from .retry import Quarantine, RetryPolicy, QuarantinedFileError
+
+    calls = []
+
+    def flaky(path):
+        calls.append(path)
+        if len(calls) < 3:
+            raise RuntimeError("transient")
+        return path
+
+    policy = RetryPolicy(max_attempts=3, delay=0)
+    assert policy(flaky, "good.mp4") == "good.mp4"
+    assert policy.stats["retries"] == 2, policy.stats
+
+    def broken(path):
+        raise RuntimeError("corrupt")
+
+    # files are quarantined after 3 failed calls
+    for error in (RuntimeError,) * 3 + (QuarantinedFileError,):
+        assert "bad.mp4" not in policy.quarantine or error is QuarantinedFileError
+        try:
+            policy(broken, "bad.mp4")
+        except error:
+            pass
+        else:
+            raise AssertionError("loading a broken file did not fail")
+    assert policy.stats["failures"] == 3, policy.stats
+    assert policy.stats["quarantined"] == 1, policy.stats
+    assert "bad.mp4" in policy.quarantine
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "quarantine.lst")
+        quarantine = Quarantine(path)
+        # the file is only read on first access
+        with open(path, "w") as f:
+            f.write("a.mp4\nb.mp4\n")
+        assert len(quarantine) == 2
+        quarantine.add("c.mp4")
+        assert quarantine.release(["b.mp4", "d.mp4"]) == ["b.mp4"]
+        assert sorted(Quarantine(path).files) == ["a.mp4", "c.mp4"]
+        assert quarantine.release() == ["a.mp4", "c.mp4"]
+        assert len(Quarantine(path)) == 0
+
+        # failed calls add up over runs, e.g. one call per process
+        video = os.path.join(folder, "IDIAP", "bad.mp4")
+        for run in range(3):
+            policy = RetryPolicy(max_attempts=1, delay=0,
+                                 quarantine=Quarantine(path))
+            try:
+                policy(broken, video)
+            except RuntimeError:
+                pass
+        assert Quarantine(path).failures[video] == 3
+        assert video in Quarantine(path) and "IDIAP/bad.mp4" in Quarantine(path)
+        # files are released with their path in the database
+        quarantine = Quarantine(path)
+        assert quarantine.release(["IDIAP/bad.mp4"]) == [video]
+        assert video not in Quarantine(path)
+        assert not Quarantine(path).failures
+
+
+def test_selected_frame_indices():
+    from types import SimpleNamespace
+    from .video import selected_frame_indices
+
+    def selector(style):
+        return SimpleNamespace(
+            selection_style=style, max_number_of_frames=3, step_size=10
+        )
+
+    assert selected_frame_indices(selector("first"), 100) == [0, 1, 2]
+    assert selected_frame_indices(selector("first"), 2) == [0, 1]
+    assert selected_frame_indices(selector("step"), 100) == [5, 15, 25]
+    assert selected_frame_indices(selector("all"), 100) is None
+    unlimited = SimpleNamespace(selection_style="first", max_number_of_frames=None)
+    assert selected_frame_indices(unlimited, 4) == [0, 1, 2, 3]
+
+
+def test_load_video_short_header():
+    from types import SimpleNamespace
+    import numpy as np
+    from . import video as module
+    from .video import FrameFormat, load_video
+
+    frames = np.zeros((6, 3, 2, 2), 'uint8') + \
+        np.arange(6, dtype='uint8')[:, None, None, None]
+
+    class Reader(object):
+        # the header announces more frames than the video has
+        number_of_frames = 10
+
+        def __iter__(self):
+            return iter(frames)
+
+    reader, load = module.reader, module.load
+    module.reader, module.load = (lambda path: Reader()), (lambda path: frames)
+    try:
+        first = SimpleNamespace(selection_style='first', max_number_of_frames=3)
+        video = load_video('short.mp4', first)
+        assert len(video) == 10 and video[:3, 0, 0, 0].tolist() == [0, 1, 2]
+
+        # frame 7 does not exist, so the whole video is loaded instead
+        step = SimpleNamespace(selection_style='step', max_number_of_frames=3,
+                               step_size=3)
+        video = load_video('short.mp4', step, contiguous=True)
+        assert len(video) == 6 and (video == frames).all()
+        video = load_video('short.mp4', step, frame_format=FrameFormat(grey=True))
+        assert video.shape == (6, 2, 2), video.shape
+        assert video[:, 0, 0].tolist() == [0, 1, 0, 0, 4, 0]
+
+        # all frames are decoded when the header announces too few frames
+        for count in (4, 0):
+            Reader.number_of_frames = count
+            video = load_video('long.mp4', contiguous=True)
+            assert (video == frames).all() and video.flags.c_contiguous
+            video = load_video('long.mp4', frame_format=FrameFormat(grey=True))
+            assert video[:, 0, 0].tolist() == list(range(6))
+    finally:
+        module.reader, module.load = reader, load
+
+
+def test_lazy_file_metadata():
+    from .common import SwanFile, swan_file_metadata
+
+    class File(SwanFile):
+        def __init__(self, path):
+            self.path = path
+
+    f = File("IDIAP/session_01/iPad/00001/4_00001_m_01_01_t_2.mp4")
+    assert "_metadata" not in f.__dict__
+    assert f.client.id == "IDIAP_00001", f.client.id
+    assert (f.session, f.nrecording, f.device, f.modality) == (
+        1, "01", "iPad", "voice")
+    other = swan_file_metadata(
+        "IDIAP/session_02/iPhone/00001/4_00001_m_02_01_p_2.mp4")
+    assert other[0] is f.client
+
+
+def test_update_files():
+    from .query_bio import Database
+    from .video import FrameFormat
+
+    db = Database(protocol='licit_p1_face_f1', frame_format=FrameFormat(grey=True),
+                  original_directory='/swan')
+    files = db.objects(groups='dev', purposes='probe')
+    # the files share the settings of the database instead of copying them
+    assert all(f._options is files[0]._options for f in files)
+    assert 'frame_format' not in files[0].__dict__
+    assert files[0].frame_format is db.frame_format
+    assert files[0].original_directory == '/swan'
+    assert files[0].contiguous_frames is True
+    assert files[1].frame_shape == db.frame_shape == (1280, 720)
+    # but each file can still be changed
+    files[0].frame_format = None
+    assert files[0].frame_format is None
+    assert files[1].frame_format is db.frame_format
+
+
+def test_metadata_index():
+    import os
+    import tempfile
+    from . import metadata as module
+    from .metadata import MetadataIndex, build_index
+
+    probed = []
+
+    def probe_video(directory, path):
+        probed.append(path)
+        stat = os.stat(os.path.join(directory, path))
+        return (path, stat.st_size, stat.st_mtime, 10 * len(probed), 30.0,
+                1.0, 1280, 720, 'h264', 44100, 'aac')
+
+    probe = module.probe_video
+    module.probe_video = probe_video
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            paths = ['IDIAP/a.mp4', 'NTNU/b.mp4']
+            for path in paths:
+                os.makedirs(os.path.join(folder, os.path.dirname(path)))
+                with open(os.path.join(folder, path), 'w') as f:
+                    f.write('video')
+            output = os.path.join(folder, 'metadata.npz')
+            assert len(MetadataIndex(output)) == 0
+            assert len(build_index(folder, paths, output=output)) == 2
+
+            index = MetadataIndex(output)
+            assert len(index) == 2 and 'IDIAP/a.mp4' in index
+            record = index.get('NTNU/b.mp4')
+            assert record['number_of_frames'] == 20
+            assert (record['video_codec'], record['size']) == ('h264', 5)
+            assert index.get('MPH-FRA/c.mp4') is None
+            assert 'MPH-FRA/c.mp4' not in index
+
+            # unchanged videos are not opened again, stale ones are
+            with open(os.path.join(folder, paths[0]), 'w') as f:
+                f.write('new video')
+            probed[:] = []
+            build_index(folder, paths + ['MPH-FRA/c.mp4'], output=output)
+            assert probed == ['IDIAP/a.mp4', 'MPH-FRA/c.mp4']
+            index = MetadataIndex(output)
+            assert len(index) == 2 and index.get('IDIAP/a.mp4')['size'] == 9
+    finally:
+        module.probe_video = probe
+
+
+def test_protocol_index():
+    import os
+    import shutil
+    import tempfile
+    from .protocol_index import (
+        LISTS_DIRECTORY, ProtocolIndex, compile_protocols, group_models,
+        read_list_rows)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'protocols.npz')
+        assert compile_protocols(output=path) > 0
+        index = ProtocolIndex(path)
+        assert 'pad_p2_face_f1' in index.protocols
+        for name in ('pad_p2_face_f1/train/for_attack.lst',
+                     'licit_p1_face_f1/dev/for_models.lst'):
+            rows = index.rows(os.path.join(LISTS_DIRECTORY, name))
+            assert rows == read_list_rows(os.path.join(LISTS_DIRECTORY, name))
+        assert index.rows('unknown/dev/for_models.lst') is None
+
+        name = 'spoof_p3_voice_f3/dev/for_scores.lst'
+        table = index.model_table(name)
+        assert table == group_models(index.rows(name))
+        for model_id, positions in table.items():
+            assert all(index.rows(name)[p][1] == model_id for p in positions)
+
+        # lists that changed after the index (even with the same size) are not
+        # served
+        lists = os.path.join(tmp, 'lists')
+        shutil.copytree(os.path.join(LISTS_DIRECTORY, 'licit_p1_face_f1'),
+                        os.path.join(lists, 'licit_p1_face_f1'))
+        compile_protocols(lists, path)
+        name = 'licit_p1_face_f1/dev/for_models.lst'
+        assert ProtocolIndex(path, lists).rows(name) is not None
+        with open(os.path.join(lists, name)) as f:
+            lines = f.readlines()
+        with open(os.path.join(lists, name), 'w') as f:
+            f.writelines(reversed(lines))
+        index = ProtocolIndex(path, lists)
+        assert index.rows(name) is None and index.model_table(name) is None
+        assert index.rows('licit_p1_face_f1/dev/for_probes.lst') is not None
+
+
+def test_file_table():
+    from .create import FileTable
+
+    files = FileTable([
+        'IDIAP/session_02/iPhone/00001/4_00001_m_02_01_p_1.mp4\n',
+        'NTNU/session_02/iPhone/00001/1_00001_m_02_01_p_1.mp4\n',
+        'pa-database/TalkingFace/PA.F.1/1_1_00001_m_01_01_p_1.mp4\n',
+    ])
+    assert len(files) == 3
+    records = files.select(r'session_02/iPhone/.*_p_1\.mp4')
+    assert [r.client_id for r in records] == ['IDIAP_00001', 'NTNU_00001']
+    assert files.select(r'session_02/iPhone/.*_p_1\.mp4') is records
+    records = files.select(r'pa-database/', ids={'NTNU_00001'})
+    assert [r.attack_type for r in records] == ['PA.F.1']
+
+
+def test_create_manifest():
+    import json
+    import os
+    import tempfile
+    from .create import FileTable, create_protocols
+
+    lines = [
+        'IDIAP/session_02/iPhone/00001/4_00001_m_02_01_p_1.mp4\n',
+        'NTNU/session_02/iPhone/00001/1_00001_m_02_01_p_1.mp4\n',
+        'pa-database/TalkingFace/PA.F.1/1_1_00001_m_01_01_p_1.mp4\n',
+    ]
+    with tempfile.TemporaryDirectory() as output:
+        manifest = create_protocols(output, FileTable(lines))
+        count = manifest.stats['generated protocols']
+        assert count > 0 and not manifest.stats['unchanged protocols']
+        list_file = os.path.join(output, 'pad_p2_face_f1/train/for_real.lst')
+        mtime = os.stat(list_file).st_mtime_ns
+
+        # nothing changed, so nothing is generated again
+        manifest = create_protocols(output, FileTable(lines))
+        assert manifest.stats['unchanged protocols'] == count
+        assert not manifest.stats['generated protocols']
+        assert os.stat(list_file).st_mtime_ns == mtime
+
+        # a list that was edited is generated again
+        with open(list_file, 'a') as f:
+            f.write('edited\n')
+        manifest = create_protocols(output, FileTable(lines))
+        assert manifest.stats['generated protocols'] == 1
+        assert manifest.stats['written lists'] == 1
+        with open(list_file) as f:
+            assert 'edited' not in f.read()
+
+        # the master list changed, so all protocols are generated again
+        lines.append('IDIAP/session_03/iPhone/00001/4_00001_m_03_01_p_1.mp4\n')
+        manifest = create_protocols(output, FileTable(lines))
+        assert manifest.stats['generated protocols'] == count
+        assert manifest.stats['written lists'] > 0
+        with open(manifest.path) as f:
+            before = json.load(f)['protocols']
+
+        # only some protocols are generated, the others stay in the manifest
+        lines.append('NTNU/session_03/iPhone/00001/1_00001_m_03_01_p_1.mp4\n')
+        manifest = create_protocols(output, FileTable(lines),
+                                    only=['pad_p2_*'])
+        assert 0 < manifest.stats['generated protocols'] < count
+        with open(manifest.path) as f:
+            after = json.load(f)['protocols']
+        assert sorted(after) == sorted(before)
+        for name in after:
+            assert (after[name] == before[name]) != name.startswith('pad_p2_')
+
+    # the shipped manifest is up to date with the shipped lists
+    from .create import Manifest
+    from .protocol_index import LISTS_DIRECTORY
+    with open(os.path.join(LISTS_DIRECTORY, 'swan_noextra.lst')) as f:
+        manifest = Manifest(LISTS_DIRECTORY, FileTable(f))
+    with open(manifest.path) as f:
+        assert json.load(f)['inputs'] == manifest.inputs
+
+
+def test_check_files():
+    import os
+    import tempfile
+    from .checkfiles import check_files
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'a'))
+        with open(os.path.join(tmp, 'a', 'good.mp4'), 'wb') as f:
+            f.write(b'\0\0\0\x18ftypmp42' + b'\0' * 16)
+        with open(os.path.join(tmp, 'a', 'bad.mp4'), 'wb') as f:
+            f.write(b'not a video')
+        paths = ['a/good.mp4', 'a/bad.mp4', 'a/missing.mp4', 'b/missing.mp4']
+        results = check_files(paths + paths, tmp, jobs=2, check_size=True,
+                              check_readable=True,
+                              expected_sizes={'a/good.mp4': 28})
+        errors = {r['path']: r['error'] for r in results}
+        assert len(results) == 4, results
+        assert errors['a/good.mp4'] is None, errors
+        assert errors['a/bad.mp4'] == 'not an MP4 container', errors
+        assert errors['a/missing.mp4'] == 'not found', errors
+        assert errors['b/missing.mp4'] == 'not found', errors
+
+
+def test_filelists():
+    from .filelists import iter_paths
+
+    def count(**kwargs):
+        return sum(1 for _ in iter_paths(protocols=['pad_p2_face_f1'], **kwargs))
+
+    assert count(groups=['train'], classes=['real']) == 750
+    assert count(groups=['train'], classes=['attack']) == 1251
+    assert count(purposes=['train']) == 750 + 1251
+    assert count(purposes=['enroll']) == 0
+
+    paths = list(iter_paths(protocols=['spoof_p3_face_f1'], groups=['dev'],
+                            purposes=['probe'], classes=['attack']))
+    assert paths and all(p.startswith('pa-database/') for p in paths)
+    assert not list(iter_paths(protocols=['licit_p1_face_f1'],
+                               classes=['attack']))
+
+    # unknown protocols are rejected by the command line
+    from argparse import ArgumentParser
+    from .driver import Interface
+
+    parser = ArgumentParser()
+    Interface().add_commands(parser.add_subparsers())
+    args = parser.parse_args(['swan', 'dumplist', '-p', 'pad_p2_face_f1'])
+    assert args.protocol == ['pad_p2_face_f1']
+    try:
+        parser.parse_args(['swan', 'dumplist', '-p', 'pad_p2_face'])
+    except SystemExit:
+        pass
+    else:
+        raise AssertionError('an unknown protocol was accepted')
+
+
+def test_annotation_pack():
+    import json
+    import os
+    import tempfile
+    from .annotations import AnnotationCache, AnnotationPack, pack_annotations
+
+    annotations = {'0': {'leye': [1, 2], 'reye': [3, 4], 'quality': 0.5},
+                   '5': None, '10': {'leye': [5, 6]}}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'a.json')
+        with open(path, 'w') as f:
+            json.dump(annotations, f)
+        cache = AnnotationCache()
+        assert cache.read(path) == annotations
+        # the cached annotations are not changed through a returned copy
+        cache.read(path)['0']['leye'][0] = 100
+        assert cache.read(path) == annotations
+        assert (cache.hits, cache.misses, len(cache)) == (2, 1, 1)
+
+        # modified files are parsed again
+        changed = dict(annotations, **{'10': {'leye': [7, 8]}})
+        with open(path, 'w') as f:
+            json.dump(changed, f)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        assert cache.read(path) == changed
+        assert (cache.misses, len(cache)) == (2, 1)
+
+        pack = os.path.join(tmp, 'pack.npz')
+        assert pack_annotations([('a.mp4', annotations)], pack) == 1
+        pack = AnnotationPack(pack)
+        assert 'a.mp4' in pack and 'b.mp4' not in pack
+        assert pack.get('a.mp4') == annotations, pack.get('a.mp4')
+
+
+def test_annotate_video():
+    from .annotate import annotate_video, detector_runs
+
+    class Detector(object):
+        def __init__(self, frames):
+            self.frames = frames
+
+        def __call__(self, frame, annotations=None):
+            if frame in self.frames:
+                return {'leye': (frame, 1), 'reye': (frame, 2)}
+
+    class Flandmark(Detector):
+        pass
+
+    class FailSafe(object):
+        annotators = [Detector({0, 1}), Flandmark({1, 2})]
+        required_keys = ['leye', 'reye']
+        only_required_keys = True
+
+    class Wrapper(object):
+        annotator = FailSafe()
+        normalize = True
+        validator = staticmethod(lambda annotations: bool(annotations))
+        max_age = 1
+
+    annotations, detectors = annotate_video(Wrapper(), iter(range(5)))
+    assert list(annotations) == ['0', '1', '2', '3', '4']
+    assert annotations['1'] == {'leye': (1, 1), 'reye': (1, 2)}
+    # frame 3 reuses the annotations of frame 2, frame 4 is too old
+    assert annotations['3'] == annotations['2'] and annotations['4'] is None
+    assert detector_runs(detectors) == [
+        [0, 'Detector'], [2, 'Flandmark'], [4, None]]
+
+
+def test_annotate_command():
+    from argparse import Namespace
+    from . import annotate as module
+
+    annotated = []
+
+    def annotate_files(paths, *args, **kwargs):
+        annotated.extend(paths)
+        return dict(annotated=len(paths), skipped=0, failed=0)
+
+    annotate_files, module.annotate_files = module.annotate_files, annotate_files
+    try:
+        args = Namespace(
+            protocol=['spoof_p3_voice_f1'], group=None, shard=None,
+            directory='/swan', output_directory='/annotations', config=None,
+            extension='', jobs=1, force=False, keyframe_interval=None,
+            min_confidence=0.8)
+        assert module._annotate(args) == 0
+    finally:
+        module.annotate_files = annotate_files
+    # the .wav files of the voice attacks are not annotated
+    assert annotated and all(p.endswith('.mp4') for p in annotated)
+
+
+def test_landmark_tracker():
+    import numpy
+    from .annotate import LandmarkTracker
+
+    rng = numpy.random.RandomState(0)
+    frame = (rng.rand(3, 200, 120) * 255).astype('uint8')
+    tracker = LandmarkTracker(patch_size=16, search_radius=12)
+    assert tracker.reset(frame, {'leye': (100, 40), 'reye': (100, 80),
+                                 'topleft': (60, 20)})
+    moved = numpy.roll(frame, (6, -4), axis=(1, 2))
+    annotations, confidence = tracker.track(moved)
+    assert confidence > 0.99, confidence
+    assert numpy.allclose(annotations['leye'], (106, 36), atol=0.5), annotations
+    assert numpy.allclose(annotations['topleft'], (66, 16), atol=0.5), annotations
+    annotations, confidence = tracker.track(rng.rand(3, 200, 120) * 255)
+    assert confidence < 0.8, confidence
+
+
+def test_frame_format():
+    import numpy
+    from . import SWAN_FRAME_SHAPE
+    from .video import FrameFormat
+
+    frame = numpy.zeros(SWAN_FRAME_SHAPE, 'uint8')
+    frame[0] = 200
+    frame[:, 100:300, 50:250] = 90
+    frame_format = FrameFormat(size=(100, 100), grey=True, roi=(100, 50, 200, 200))
+    assert frame_format.shape(SWAN_FRAME_SHAPE) == (100, 100)
+    formatted = frame_format(frame)
+    assert formatted.shape == (100, 100) and formatted.dtype == numpy.uint8
+    assert (formatted == 90).all(), formatted
+
+    formatted = FrameFormat(size=(640, 360))(frame)
+    assert formatted.shape == (3, 640, 360)
+    assert formatted[0, 0, 0] == 200 and formatted[1, 0, 0] == 0
+    assert formatted[0, 100, 100] == 90
+    formatted = FrameFormat(size=(224, 224), grey=True)(frame)
+    assert formatted.shape == (224, 224)
+    assert formatted[0, 0] == round(0.299 * 200)
+
+    # the region of interest of frames that were stored downscaled
+    stored = FrameFormat(roi=(100, 50, 200, 200)).downscaled(3)
+    assert stored.roi == (34, 17, 66, 67), stored.roi
+    formatted = stored(frame[:, ::3, ::3])
+    assert formatted.shape == (3, 200, 200) and (formatted == 90).all()
+    assert frame_format.downscaled(1) is frame_format
+
+
+def test_upright_frames():
+    import numpy
+    from .video import upright_frames
+
+    decoded = [numpy.arange(24, dtype='uint8').reshape(2, 3, 4)] * 2
+    views = list(upright_frames(decoded, contiguous=False))
+    assert views[0].shape == (2, 4, 3) and not views[0].flags.c_contiguous
+    frames = list(upright_frames(decoded))
+    assert all(f.flags.c_contiguous for f in frames)
+    assert (frames[0] == views[0]).all() and frames[0] is not frames[1]
+    frames = list(upright_frames(decoded, reuse_buffer=True))
+    assert frames[0] is frames[1]
+
+
+def test_stream_resampler():
+    import numpy as np
+    from .audio import audio_blocks
+    from .resample import StreamResampler, resample
+
+    signal = (np.random.RandomState(0).randn(20011) * 3000).astype('int16')
+    resampler = StreamResampler(44100, 16000)
+    chunks = [resampler.process(signal[i:i + 1000])
+              for i in range(0, len(signal), 1000)]
+    streamed = np.concatenate(chunks + [resampler.flush()])
+    assert np.allclose(streamed, resample(signal, 44100, 16000))
+
+    blocks = list(audio_blocks(chunks, 320, 160, dtype='int16'))
+    assert all(b.shape == (320,) and b.dtype == np.int16 for b in blocks)
+    assert (blocks[1][:160] == blocks[0][160:]).all()
+
+
+def test_audio_dtype():
+    import numpy as np
+    from .audio import cast_audio
+    from .resample import resample
+
+    signal = (np.random.RandomState(0).randn(8000) * 3000).astype('int16')
+    reference = resample(signal, 44100, 16000)
+    single = resample(signal, 44100, 16000, dtype='float32')
+    assert reference.dtype == np.float64 and single.dtype == np.float32
+    assert np.allclose(single, reference, atol=0.1)
+
+    assert cast_audio(reference, 'float64') is reference
+    clipped = cast_audio(np.array([-40000.4, 1.6, 40000.]), 'int16')
+    assert clipped.dtype == np.int16
+    assert clipped.tolist() == [-32768, 2, 32767]
+
+
+def test_extract_audio():
+    import os
+    import tempfile
+    import numpy as np
+    from .cache import AudioCache, extract_audio
+
+    with tempfile.TemporaryDirectory() as folder:
+        videos = []
+        for name in ('cached.mp4', 'broken.mp4'):
+            videos.append(os.path.join(folder, name))
+            with open(videos[-1], 'wb') as f:
+                f.write(b'not really a video')
+        cache = AudioCache(os.path.join(folder, 'cache'), max_size=None)
+        key = cache.audio_key(videos[0], new_rate=16000, dtype='int16',
+                              backend='tempfile')
+        cache.put(key, 16000, np.zeros(10, dtype='int16'))
+        assert key in cache
+
+        stats = extract_audio(videos + videos[:1], cache, new_rate=16000,
+                              dtype='int16', backend='tempfile')
+        assert stats['skipped'] == 1, stats
+        assert stats['failed'] == 1, stats
+        assert stats['extracted'] == 0, stats
+
+
+def test_audio_video_mapping():
+    import numpy as np
+    from .audiovisual import AudioVideo
+
+    frames = np.zeros((4, 3, 2, 2), dtype='uint8')
+    sample = AudioVideo(frames, np.array([0, 1, 2, 3]),
+                        np.array([0.0, 0.04, 0.08, 0.12]), 16000,
+                        np.arange(2000), audio_start=-0.01)
+    assert sample.frame_samples.tolist() == [160, 800, 1440, 2080]
+    assert sample.frame_audio(0).tolist() == list(range(160, 800))
+    # the last frame lasts one frame period, past the end of the audio
+    assert len(sample.frame_audio(2)) == 560
+    assert len(sample.frame_audio(3)) == 0
+    assert len(sample.frame_audio(1, duration=0.01)) == 160
+
+
+def test_video_file_frames():
+    import numpy as np
+    from bob.bio.video.utils import FrameSelector
+    from .common import SwanVideoFile
+
+    video = np.arange(4 * 3 * 2 * 2, dtype='uint8').reshape(4, 3, 2, 2)
+    calls = []
+
+    class Store(object):
+        def __contains__(self, path):
+            return True
+
+        def frame_format(self, frame_format):
+            return frame_format
+
+        def load(self, path):
+            return video
+
+    class File(SwanVideoFile):
+        frame_store = Store()
+        metadata_index = {'IDIAP/00001/video': {'number_of_frames': 4}}
+
+        def __init__(self, path):
+            self.path = path
+
+        def retry_policy(self, function, *args, **kwargs):
+            calls.append((function.__name__, args, kwargs))
+
+    f = File('IDIAP/00001/video')
+    frames = list(f.frames)
+    assert len(frames) == 4 and (frames[2] == video[2]).all()
+
+    selector = FrameSelector(selection_style='first', max_number_of_frames=2)
+    f.load_audio_video('/swan', selector)
+    assert calls == [('load_audio_video', ('/swan/IDIAP/00001/video', [0, 1]), {
+        'transform': f.swap, 'frame_format': None, 'new_rate': None,
+        'resample_method': 'polyphase', 'dtype': 'float64'})], calls
+
+
+def test_frame_store():
+    import os
+    import tempfile
+    import numpy as np
+    from . import framestore as module
+    from .driver import database_for_protocol
+    from .framestore import FrameStore
+    from .query_bio import Database as BioDatabase
+    from .query_pad import Database as PadDatabase
+
+    frames = np.arange(7 * 3 * 4 * 6, dtype='uint8').reshape(7, 3, 4, 6)
+
+    class Reader(object):
+        number_of_frames = 7
+
+        def __iter__(self):
+            return iter(frames)
+
+    reader = module.reader
+    module.reader = lambda path: Reader()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            store = FrameStore(folder)
+            assert 'IDIAP/video' not in store
+            store.export('video.mp4', 'IDIAP/video')
+            assert 'IDIAP/video' in store
+            video = store.load('IDIAP/video')
+            assert isinstance(video, np.memmap) and video.shape == (7, 3, 6, 4)
+            assert (video == frames.swapaxes(-2, -1)).all()
+
+            store.export('video.mp4', 'IDIAP/video', step=3, downscale=2)
+            video = store.load('IDIAP/video', mmap=False)
+            assert (video == frames[::3].swapaxes(-2, -1)[..., ::2, ::2]).all()
+
+            # the header announces more frames than the video has
+            Reader.number_of_frames = 10
+            store.export('short.mp4', 'IDIAP/short', step=2)
+            video = store.load('IDIAP/short')
+            assert (video == frames[::2].swapaxes(-2, -1)).all()
+            assert os.path.getsize(store.path('IDIAP/short')) == \
+                video.offset + video.nbytes
+
+            # the header announces fewer frames than the video has
+            for Reader.number_of_frames in (4, 0):
+                store.export('long.mp4', 'IDIAP/long', step=2)
+                video = store.load('IDIAP/long')
+                assert (video == frames[::2].swapaxes(-2, -1)).all()
+            assert not [p for p in os.listdir(os.path.join(folder, 'IDIAP'))
+                        if p.endswith('.tmp')]
+    finally:
+        module.reader = reader
+
+    assert isinstance(database_for_protocol('pad_p2_face_f1'), PadDatabase)
+    assert isinstance(database_for_protocol('licit_p1_face_f1'), BioDatabase)
+
+
+def test_stream_frames():
+    import os
+    import tempfile
+    import numpy as np
+    from .framestore import FrameStore
+    from .query_bio import Database
+    from .retry import RetryPolicy
+
+    with tempfile.TemporaryDirectory() as folder:
+        store = FrameStore(folder)
+        db = Database(protocol='licit_p1_face_f1', original_directory=folder,
+                      frame_store=store, retry_policy=RetryPolicy(max_attempts=1))
+        files = db.objects(groups='dev', purposes='probe')[:3]
+        # the first two files are stored and the last one does not exist
+        for n, f in enumerate(files[:2]):
+            video = np.full((5 + n, 3, 4, 2), n, dtype='uint8')
+            video[:, 0, 0, 0] = np.arange(len(video))
+            os.makedirs(os.path.dirname(store.path(f.path)), exist_ok=True)
+            np.save(store.path(f.path), video)
+
+        frames = list(db.stream_frames(files, workers=2, skip_errors=True))
+        for n, f in enumerate(files[:2]):
+            indices = [index for g, index, frame in frames if g is f]
+            assert indices == list(range(5 + n)), indices
+        assert all(frame[0, 0, 0] == index and (frame[1:] == n).all()
+                   for f, index, frame in frames for n in [files.index(f)])
+
+        try:
+            list(db.stream_frames(files, workers=2))
+        except RuntimeError as e:
+            assert files[2].path in str(e), e
+        else:
+            raise AssertionError('the missing file was not reported')
+
+        batches = list(db.stream_frames(files[:2], batch_size=4, workers=1))
+        assert [len(keys) for keys, batch in batches] == [4, 4, 3]
+        assert batches[0][1].shape == (4, 3, 4, 2)
+        assert [key[1] for keys, batch in batches for key in keys] == \
+            list(range(5)) + list(range(6))
+
+
+def test_objects_by_model():
+    from bob.bio.base.database import FileListBioDatabase
+    from .query_bio import Database
+
+    db = Database()
+    protocol = 'spoof_p3_voice_f3'
+    model_ids = sorted(db.model_ids_with_protocol(
+        protocol=protocol, groups='eval'))[:3]
+    for purposes in ('enroll', 'probe'):
+        for classes in (None, 'impostor'):
+            query = dict(protocol=protocol, groups='eval', purposes=purposes,
+                         model_ids=model_ids, classes=classes)
+            files = db.objects(**query)
+            expected = FileListBioDatabase.objects(db, **query)
+            assert files, query
+            assert [f.path for f in files] == [f.path for f in expected]
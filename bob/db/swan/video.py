@@ -0,0 +1,534 @@
+"""Decoding of SWAN video files."""
+
+from multiprocessing import get_context
+import queue
+from bob.io.base import load
+from bob.io.video import reader
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def rotate(data):
+    """Rotates a frame or a video since SWAN videos are not upright."""
+    return np.swapaxes(data, -2, -1)
+
+
+GREY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype="float32")
+"The weights of the red, green and blue channels in grey frames (ITU-R BT.601)."
+
+
+def _interpolation(source, target):
+    # the positions and weights of bilinear interpolation along one axis
+    positions = (np.arange(target) + 0.5) * source / target - 0.5
+    positions = positions.clip(0, source - 1)
+    low = np.floor(positions).astype(int)
+    high = np.minimum(low + 1, source - 1)
+    return low, high, (positions - low).astype("float32")
+
+
+class FrameFormat(object):
+    """Crops, scales and converts upright frames right after they are decoded.
+
+    The region of interest is cropped first, without copying the frame. The
+    crop is then shrunk by averaging blocks of pixels, resized to the exact
+    target size with bilinear interpolation and converted to grey. Only the
+    small output frame is allocated, so the full resolution frames of a video
+    never accumulate in memory.
+
+    Parameters
+    ----------
+    size : (int, int), optional
+        The ``(height, width)`` of the output frames. The size of the region
+        of interest by default.
+    grey : bool
+        If ``True``, frames are converted to grey with :any:`GREY_WEIGHTS` and
+        have the shape ``(height, width)``.
+    roi : (int, int, int, int), optional
+        The ``(top, left, height, width)`` of the region of interest in the
+        upright frames.
+    """
+
+    def __init__(self, size=None, grey=False, roi=None, **kwargs):
+        super(FrameFormat, self).__init__(**kwargs)
+        self.size = None if size is None else tuple(int(v) for v in size)
+        self.grey = grey
+        self.roi = None if roi is None else tuple(int(v) for v in roi)
+        self._interpolations = {}
+
+    def __repr__(self):
+        return "FrameFormat(size={!r}, grey={!r}, roi={!r})".format(
+            self.size, self.grey, self.roi
+        )
+
+    def __getstate__(self):
+        # the interpolations are cheap to recompute in worker processes
+        state = dict(self.__dict__)
+        state["_interpolations"] = {}
+        return state
+
+    def shape(self, frame_shape):
+        """Returns the shape of the output frames for upright frames of
+        ``frame_shape``, e.g. :any:`bob.db.swan.SWAN_FRAME_SHAPE`."""
+        channels, height, width = frame_shape
+        if self.roi is not None:
+            top, left, height, width = self.roi
+            height = min(height, frame_shape[1] - top)
+            width = min(width, frame_shape[2] - left)
+        if self.size is not None:
+            height, width = self.size
+        return (height, width) if self.grey else (channels, height, width)
+
+    def downscaled(self, factor):
+        """Returns the format of frames that were downscaled by taking every
+        ``factor``-th pixel (e.g. in a
+        :any:`bob.db.swan.framestore.FrameStore`).
+
+        The region of interest is mapped onto the downscaled frames and the
+        output keeps the size of the output of full resolution frames.
+        """
+        if factor == 1 or self.roi is None:
+            return self
+        top, left, height, width = self.roi
+
+        def first(start):
+            # the first downscaled pixel at or after start
+            return -(-start // factor)
+
+        roi = (
+            first(top),
+            first(left),
+            first(top + height) - first(top),
+            first(left + width) - first(left),
+        )
+        return FrameFormat(size=self.size or (height, width), grey=self.grey, roi=roi)
+
+    def _resize(self, frame, height, width):
+        source = frame.shape[-2:]
+        # averaging blocks first avoids the aliasing of large downscales
+        fy, fx = max(1, source[0] // height), max(1, source[1] // width)
+        if fy > 1 or fx > 1:
+            h, w = source[0] // fy, source[1] // fx
+            frame = frame[..., : h * fy, : w * fx]
+            # strided sums are faster than a reshape of the transposed frame
+            blocks = np.zeros(frame.shape[:-2] + (h, w), dtype="float32")
+            for i in range(fy):
+                for j in range(fx):
+                    blocks += frame[..., i::fy, j::fx]
+            frame = blocks / (fy * fx)
+        else:
+            frame = frame.astype("float32")
+        if frame.shape[-2:] == (height, width):
+            return frame
+        key = frame.shape[-2:] + (height, width)
+        if key not in self._interpolations:
+            self._interpolations[key] = (
+                _interpolation(frame.shape[-2], height),
+                _interpolation(frame.shape[-1], width),
+            )
+        (y0, y1, wy), (x0, x1, wx) = self._interpolations[key]
+        wy = wy[:, None]
+        frame = frame[..., y0, :] * (1 - wy) + frame[..., y1, :] * wy
+        return frame[..., x0] * (1 - wx) + frame[..., x1] * wx
+
+    def __call__(self, frame):
+        """Formats one upright frame with the shape ``(3, height, width)``."""
+        dtype = frame.dtype
+        if self.roi is not None:
+            top, left, height, width = self.roi
+            frame = frame[..., top : top + height, left : left + width]
+        if self.size is not None:
+            frame = self._resize(frame, *self.size)
+        if self.grey:
+            frame = np.tensordot(GREY_WEIGHTS, frame, axes=(0, -3))
+        if frame.dtype == dtype:
+            return np.ascontiguousarray(frame)
+        if np.issubdtype(dtype, np.integer):
+            frame = np.rint(frame)
+        return frame.astype(dtype)
+
+
+def _attribute(obj, *names):
+    # FrameSelector attributes were renamed between bob.bio.video versions
+    for name in names:
+        if hasattr(obj, name):
+            return getattr(obj, name)
+    return None
+
+
+def selected_frame_indices(frame_selector, count):
+    """Returns the indices of the frames that a frame selector would select.
+
+    Parameters
+    ----------
+    frame_selector : :any:`bob.bio.video.FrameSelector`
+        The frame selector.
+    count : int
+        The number of frames in the video.
+
+    Returns
+    -------
+    list or None
+        The selected indices or ``None`` if all frames are selected or the
+        selection style is not known.
+    """
+    style = _attribute(frame_selector, "selection_style", "selection")
+    max_frames = _attribute(frame_selector, "max_number_of_frames", "max_frames")
+    step = _attribute(frame_selector, "step_size", "step")
+    if max_frames is None:
+        max_frames = count
+    if style == "first":
+        return list(range(min(count, max_frames)))
+    if style == "spread":
+        from bob.bio.base import selected_indices
+
+        return list(selected_indices(count, max_frames))
+    if style == "step":
+        return list(range(step // 2, count, step))[:max_frames]
+    return None
+
+
+def load_video(
+    path, frame_selector=None, transform=None, frame_format=None, contiguous=False
+):
+    """Loads a video, decoding only the frames that a frame selector needs.
+
+    When only some frames are selected, the video is returned as a zero
+    initialized array where only the selected frames are filled in. Such an
+    array is allocated lazily by the operating system so the memory that is
+    actually used grows with the number of selected frames and not with the
+    length of the video. Decoding stops after the last selected frame. If a
+    selected frame is past the real end of the video (i.e. its header
+    announces too many frames), the whole video is loaded instead and the
+    frame selector picks among the frames that it really has.
+
+    Parameters
+    ----------
+    path : str
+        The path of the video file.
+    frame_selector : :any:`bob.bio.video.FrameSelector`, optional
+        The frame selector that will be applied on the returned video.
+    transform : callable, optional
+        A function that is applied on each frame, e.g. to rotate it.
+    frame_format : :any:`FrameFormat`, optional
+        If given, it is applied on each frame after ``transform`` and the
+        video is decoded frame by frame.
+    contiguous : bool
+        If ``True``, the frames are decoded one by one into a C-contiguous
+        array, so frames that ``transform`` returns as views (e.g. of
+        :any:`rotate`) are copied exactly once. Otherwise, ``transform`` is
+        applied on the whole decoded video and may return a view of it.
+
+    Returns
+    -------
+    numpy.ndarray
+        The video with the shape ``(n_frames, 3, height, width)`` or the
+        shape given by ``frame_format``.
+    """
+    transform = transform or (lambda data: data)
+    indices = None
+    if frame_selector is not None or frame_format is not None or contiguous:
+        video = reader(path)
+    if frame_selector is not None:
+        indices = selected_frame_indices(frame_selector, video.number_of_frames)
+    if frame_format is not None or (contiguous and not indices):
+        data = _decode_frames(video, path, indices, transform, frame_format)
+    elif not indices:
+        return transform(load(path))
+    else:
+        data = _decode_selected(video, indices, transform)
+    if data is None:
+        # the video is shorter than announced by its header, so the selected
+        # frames are decoded again from the frames that the video really has
+        logger.warning(
+            "%s has fewer frames than the %d of its header",
+            path,
+            video.number_of_frames,
+        )
+        data = transform(load(path))
+        if frame_format is not None:
+            indices = selected_frame_indices(frame_selector, len(data))
+            data = format_video(data, frame_format, indices)
+        return data
+    if indices:
+        logger.debug("Decoded %d selected frames of %s", len(set(indices)), path)
+    return data
+
+
+def _decode_selected(video, indices, transform):
+    # returns None if a selected frame is past the end of the video
+    selected, last, data = set(indices), max(indices), None
+    for index, frame in enumerate(video):
+        if index > last:
+            break
+        if index not in selected:
+            continue
+        frame = transform(frame)
+        if data is None:
+            data = np.zeros((video.number_of_frames,) + frame.shape, frame.dtype)
+        data[index] = frame
+        if index == last:
+            return data
+    return None
+
+
+def _decode_frames(video, path, indices, transform, frame_format=None):
+    # returns None if a selected frame is past the end of the video
+    count = video.number_of_frames
+    selected = None if indices is None else set(indices)
+    last = None if indices is None else max(selected, default=-1)
+    data, decoded = None, 0
+    for index, frame in enumerate(video):
+        if last is not None and index > last:
+            break
+        decoded = index + 1
+        if selected is not None and index not in selected:
+            continue
+        frame = transform(frame)
+        if frame_format is not None:
+            frame = frame_format(frame)
+        if data is None:
+            data = np.zeros((max(count, index + 1),) + frame.shape, frame.dtype)
+        elif index >= len(data):
+            # the header announced fewer frames than the video has
+            data = np.concatenate([data, np.zeros_like(data)])
+        data[index] = frame
+    if last is not None and decoded <= last:
+        return None
+    if data is None:
+        raise RuntimeError("{} has none of the selected frames.".format(path))
+    if indices is None and decoded != len(data):
+        # the header announced another number of frames
+        logger.debug("%s has %d frames, its header %d", path, decoded, count)
+        data = data[:decoded]
+    return data
+
+
+def upright_frames(frames, contiguous=True, reuse_buffer=False):
+    """Yields the upright frames of a decoded video.
+
+    Parameters
+    ----------
+    frames : iterable of numpy.ndarray
+        The frames as decoded, e.g. by :any:`bob.io.video.reader`.
+    contiguous : bool
+        If ``True``, each frame is copied once into a C-contiguous array, so
+        consumers that need contiguous data (OpenCV, bob.ip, inference
+        libraries) do not copy it again. Otherwise, non-contiguous views are
+        yielded.
+    reuse_buffer : bool
+        If ``True`` (and ``contiguous``), all frames are copied into the same
+        array, which avoids allocating memory for each frame. The consumer
+        must copy the frames it keeps.
+
+    Yields
+    ------
+    numpy.ndarray
+        The upright frames.
+    """
+    buffer = None
+    for frame in frames:
+        frame = rotate(frame)
+        if not contiguous:
+            yield frame
+        elif reuse_buffer:
+            if buffer is None or buffer.shape != frame.shape:
+                buffer = np.empty(frame.shape, frame.dtype)
+            np.copyto(buffer, frame)
+            yield buffer
+        else:
+            yield np.ascontiguousarray(frame)
+
+
+def format_video(video, frame_format, indices=None):
+    """Formats the frames of a video that is already loaded, e.g. from a
+    :any:`bob.db.swan.framestore.FrameStore`.
+
+    Parameters
+    ----------
+    video : numpy.ndarray
+        The upright frames with the shape ``(n_frames, 3, height, width)``.
+    frame_format : :any:`FrameFormat`
+        The format of the output frames.
+    indices : [int], optional
+        If given, only these frames are formatted and the other frames are
+        zero.
+
+    Returns
+    -------
+    numpy.ndarray
+        The formatted video.
+    """
+    data = np.zeros(
+        (len(video),) + frame_format.shape(video.shape[1:]), dtype=video.dtype
+    )
+    for index in range(len(video)) if indices is None else indices:
+        data[index] = frame_format(video[index])
+    return data
+
+
+def _put_frames(path, results, position, sent, frame_format=None):
+    # the frames that were sent before a retry are not sent again
+    for index, frame in enumerate(reader(path)):
+        if index < sent[0]:
+            continue
+        frame = rotate(frame)
+        if frame_format is not None:
+            frame = frame_format(frame)
+        results.put(("frame", position, index, frame))
+        sent[0] = index + 1
+
+
+def _stream_worker(
+    tasks, results, frame_format=None, retry_policy=None, stored_frame_format=None
+):
+    for position, path, stored_path in iter(tasks.get, None):
+        try:
+            if stored_path is not None:
+                for index, frame in enumerate(np.load(stored_path, mmap_mode="r")):
+                    if stored_frame_format is not None:
+                        frame = stored_frame_format(frame)
+                    results.put(("frame", position, index, np.array(frame)))
+            elif retry_policy is not None:
+                retry_policy(_put_frames, path, results, position, [0], frame_format)
+            else:
+                _put_frames(path, results, position, [0], frame_format)
+        except Exception as e:
+            results.put(("error", position, "{}: {}".format(path, e)))
+        results.put(("done", position))
+
+
+def stream_frames(
+    paths,
+    workers=4,
+    prefetch=32,
+    skip_errors=False,
+    frame_format=None,
+    stored_paths=None,
+    stored_frame_format=None,
+    retry_policy=None,
+    poll_interval=1.0,
+):
+    """Decodes videos in a pool of processes and yields their frames.
+
+    Frames of one video are yielded in order, but frames of different videos
+    are interleaved.
+
+    Parameters
+    ----------
+    paths : [str]
+        The paths of the videos.
+    workers : int
+        The number of decoding processes.
+    prefetch : int
+        The maximum number of decoded frames that wait to be consumed. Workers
+        block when this many frames are waiting.
+    skip_errors : bool
+        If ``True``, videos that fail to decode (or whose worker was killed)
+        are logged and skipped. Otherwise, a :any:`RuntimeError` is raised.
+    frame_format : :any:`FrameFormat`, optional
+        If given, frames are formatted in the workers, which also reduces the
+        data sent between processes.
+    stored_paths : [str], optional
+        For each video, the ``.npy`` file of its upright frames in a
+        :any:`bob.db.swan.framestore.FrameStore` or ``None`` to decode it.
+    stored_frame_format : :any:`FrameFormat`, optional
+        The format of the stored frames, see
+        :any:`bob.db.swan.framestore.FrameStore.frame_format`.
+    retry_policy : :any:`bob.db.swan.retry.RetryPolicy`, optional
+        If given, the workers retry the videos that fail to decode. Frames
+        that were yielded already are not yielded again.
+    poll_interval : float
+        The workers are checked when no frame arrived for this many seconds.
+
+    Yields
+    ------
+    position : int
+        The position of the video in ``paths``.
+    index : int
+        The index of the frame in the video.
+    frame : numpy.ndarray
+        The upright (and formatted) frame.
+
+    Raises
+    ------
+    RuntimeError
+        If a video fails to decode (unless ``skip_errors``). When a worker is
+        killed (e.g. by the out-of-memory killer), the videos that were not
+        finished fail once all workers exited.
+    """
+    if stored_paths is None:
+        stored_paths = [None] * len(paths)
+    context = get_context()
+    tasks, results = context.Queue(), context.Queue(maxsize=prefetch)
+    for position, path in enumerate(paths):
+        tasks.put((position, path, stored_paths[position]))
+    processes = []
+    for _ in range(max(1, min(workers, len(paths)))):
+        tasks.put(None)
+        process = context.Process(
+            target=_stream_worker,
+            args=(tasks, results, frame_format, retry_policy, stored_frame_format),
+        )
+        process.daemon = True
+        process.start()
+        processes.append(process)
+
+    def failed(message):
+        if not skip_errors:
+            raise RuntimeError("Failed to decode " + message)
+        logger.error("Failed to decode %s", message)
+
+    finished = set()
+    try:
+        while len(finished) < len(paths):
+            try:
+                message = results.get(timeout=poll_interval)
+            except queue.Empty:
+                if any(process.is_alive() for process in processes):
+                    continue
+                # the videos of a killed worker (and the messages that it had
+                # not sent yet) are lost
+                exitcodes = sorted(set(p.exitcode for p in processes))
+                for position, path in enumerate(paths):
+                    if position not in finished:
+                        finished.add(position)
+                        failed(
+                            "{}: the workers exited with the codes {}".format(
+                                path, exitcodes
+                            )
+                        )
+                continue
+            if message[0] == "frame":
+                yield message[1:]
+            elif message[0] == "done":
+                finished.add(message[1])
+            else:
+                failed(message[2])
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+
+def batch_frames(frames, batch_size):
+    """Groups the output of :any:`stream_frames` into batches.
+
+    Yields
+    ------
+    keys : [(int, int)]
+        The ``(position, index)`` of the frames in the batch.
+    batch : numpy.ndarray
+        The stacked frames. The last batch may be smaller.
+    """
+    keys, batch = [], []
+    for position, index, frame in frames:
+        keys.append((position, index))
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield keys, np.stack(batch)
+            keys, batch = [], []
+    if batch:
+        yield keys, np.stack(batch)